@@ -0,0 +1,141 @@
+# backend/activity.py
+"""
+Coalesced last-login / session-activity tracking.
+
+Logins and authenticated requests only record a timestamp in memory; repeated
+events for the same user or session collapse into one entry. A background
+thread writes the latest timestamps every ACTIVITY_FLUSH_INTERVAL seconds with
+one bulk UPDATE per table, so the login path never opens a write transaction.
+"""
+
+import os
+import atexit
+import logging
+import threading
+from datetime import datetime
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+# Only ever move timestamps forward, so out-of-order flushes from several workers are harmless
+UPDATE_LAST_LOGIN_SQL = """
+    UPDATE users AS u SET last_login = v.ts
+    FROM (VALUES %s) AS v(id, ts)
+    WHERE u.id = v.id AND (u.last_login IS NULL OR u.last_login < v.ts)
+"""
+
+UPDATE_SESSION_ACTIVITY_SQL = """
+    UPDATE user_sessions AS s SET last_activity = v.ts
+    FROM (VALUES %s) AS v(id, ts)
+    WHERE s.id = v.id AND (s.last_activity IS NULL OR s.last_activity < v.ts)
+"""
+
+UPDATE_TEMPLATE = "(%s::uuid, %s::timestamp)"
+
+
+class ActivityBuffer:
+    """Keeps the latest timestamp per user/session and flushes them in bulk"""
+
+    def __init__(self, engine, flush_interval=5.0):
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self._logins = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.events = 0
+        self.rows_written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self._thread = threading.Thread(target=self._run, name='activity-flusher', daemon=True)
+        self._thread.start()
+
+    def record_login(self, user_id, at=None):
+        self._record(self._logins, str(user_id), at or datetime.utcnow())
+
+    def record_session_activity(self, session_id, at=None):
+        self._record(self._sessions, str(session_id), at or datetime.utcnow())
+
+    def _record(self, pending, key, at):
+        with self._lock:
+            self.events += 1
+            current = pending.get(key)
+            if current is None or current < at:
+                pending[key] = at
+
+    def pending_last_login(self, user_id):
+        """Login time not yet written to users.last_login, if any"""
+        with self._lock:
+            return self._logins.get(str(user_id))
+
+    def flush(self):
+        """Write the coalesced timestamps; returns the number of rows sent"""
+        with self._flush_lock:
+            with self._lock:
+                logins, self._logins = self._logins, {}
+                sessions, self._sessions = self._sessions, {}
+            if not logins and not sessions:
+                return 0
+            try:
+                self._write(logins, sessions)
+            except Exception as e:
+                self.failed_flushes += 1
+                logger.error(f"❌ Activity flush failed: {e}")
+                # Merge back for the next attempt, keeping whichever timestamp is newer
+                with self._lock:
+                    for pending, failed in ((self._logins, logins), (self._sessions, sessions)):
+                        for key, at in failed.items():
+                            if key not in pending or pending[key] < at:
+                                pending[key] = at
+                return 0
+            self.flushes += 1
+            self.rows_written += len(logins) + len(sessions)
+            return len(logins) + len(sessions)
+
+    def _write(self, logins, sessions):
+        with self.engine.begin() as conn:
+            cursor = conn.connection.cursor()
+            # Sorted so concurrent workers lock rows in the same order
+            if logins:
+                execute_values(cursor, UPDATE_LAST_LOGIN_SQL, sorted(logins.items()),
+                               template=UPDATE_TEMPLATE, page_size=1000)
+            if sessions:
+                execute_values(cursor, UPDATE_SESSION_ACTIVITY_SQL, sorted(sessions.items()),
+                               template=UPDATE_TEMPLATE, page_size=1000)
+            cursor.close()
+
+    def close(self, timeout=10.0):
+        """Stop the background thread and flush what is left (registered with atexit)"""
+        self._stop.set()
+        self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._logins) + len(self._sessions)
+        return {
+            'pending': pending,
+            'events': self.events,
+            'rowsWritten': self.rows_written,
+            'flushes': self.flushes,
+            'failedFlushes': self.failed_flushes,
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_activity_buffer(engine):
+    """Process-wide buffer, flushed automatically at interpreter shutdown"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = ActivityBuffer(engine, flush_interval=float(os.getenv('ACTIVITY_FLUSH_INTERVAL', 5.0)))
+            atexit.register(_buffer.close)
+        return _buffer
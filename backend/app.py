@@ -3,31 +3,58 @@ Academic AI Platform - Main Flask Application
 Compact LLM for Enterprise API Integration & Data Access
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
+import logging
+from functools import wraps
 from dotenv import load_dotenv
 from auth_routes import auth_bp, init_jwt
-from models import Base, engine
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy.exc import SQLAlchemyError
+from models import engine
+from migrations import prepare_schema
+from db_engine import pool_status
+from health import health_bp, monitor as health_monitor
+from rollups import DashboardStatsService, get_rollup_buffer
+from llm import get_chat_model, UsageMeter, sse_event
+from usage_logs import record_usage, usage_row, get_usage_writer
+from response_cache import response_cache_from_env, similarity_tier_from_env, cache_key
+from single_flight import single_flight_from_env, COALESCED_STATUS
+from llm_limiter import LimiterRejected
+from activity import get_activity_buffer
+from user_cache import get_profile_cache
+from institutions import get_institution_directory
+from conversations import ConversationRepository
+from pagination import page_limit
+from budget_guard import budget_guard_from_env, expected_cost, BudgetExceededError
+from tool_router import get_tool_router
+from tool_registry import get_tool_registry
 
 # Load environment variables
 load_dotenv()
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app, supports_credentials=True, origins=["http://localhost:3000", "https://your-render-domain.onrender.com"])
+logger = logging.getLogger(__name__)
 
-# Configuration
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
-app.config['GEMINI_API_KEY'] = os.getenv('GEMINI_API_KEY')
+# Core API routes
+api_bp = Blueprint('api', __name__)
 
-# Initialize JWT
-jwt = init_jwt(app)
+# Dashboard stats are read from rollups and cached briefly per institution
+stats_service = DashboardStatsService(engine, ttl=float(os.getenv('DASHBOARD_STATS_TTL', 10)))
 
-# Register blueprints
-app.register_blueprint(auth_bp)
+# Response cache for stateless tool prompts (plus the pgvector similarity tier when enabled)
+response_cache = response_cache_from_env(similarity=similarity_tier_from_env(engine))
 
-@app.route('/')
+# Identical in-flight prompts share one upstream call
+single_flight = single_flight_from_env()
+
+# Sequence-ordered conversation history
+conversation_repository = ConversationRepository(engine)
+
+# Per-user/department/institution budgets, checked in memory before every LLM call
+budget_guard = budget_guard_from_env(engine)
+
+@api_bp.route('/')
 def home():
     """Health check endpoint"""
     return jsonify({
@@ -36,76 +63,326 @@ def home():
         "status": "healthy"
     })
 
-@app.route('/api/health')
-def health_check():
-    """Detailed health check"""
-    return jsonify({
-        "status": "healthy",
-        "services": {
-            "flask": "running",
-            "gemini_api": "configured" if app.config['GEMINI_API_KEY'] else "not_configured",
-            "database": "connected" if check_database_connection() else "disconnected",
-            "mcp_server": "pending"
-        }
-    })
+def super_admin_required(view):
+    """Operational endpoints: a valid JWT whose role is super_admin"""
+    @wraps(view)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        if get_jwt_identity().get('role') != 'super_admin':
+            return jsonify({'message': 'Unauthorized access'}), 403
+        return view(*args, **kwargs)
+    return wrapper
 
-def check_database_connection():
-    """Check if database connection is working"""
-    try:
-        # Try to connect to the database
-        engine.connect()
-        return True
-    except Exception:
-        return False
+@api_bp.route('/api/metrics/db-pool')
+@super_admin_required
+def db_pool_metrics():
+    """Connection pool gauges: checked-out connections, overflow, wait and connect latency"""
+    return jsonify(pool_status(engine))
+
+@api_bp.route('/api/metrics/response-cache')
+@super_admin_required
+def response_cache_metrics():
+    """Response cache size, evictions and hit rate"""
+    return jsonify(response_cache.stats())
+
+@api_bp.route('/api/metrics/single-flight')
+@super_admin_required
+def single_flight_metrics():
+    """Coalesced LLM calls: upstream calls made and duplicates collapsed into them"""
+    return jsonify(single_flight.stats())
+
+@api_bp.route('/api/metrics/usage-writer')
+@super_admin_required
+def usage_writer_metrics():
+    """Buffered ai_usage_logs writer: queued rows, flushes and failures"""
+    return jsonify(get_usage_writer(engine).stats())
+
+@api_bp.route('/api/metrics/activity')
+@super_admin_required
+def activity_metrics():
+    """Coalesced last-login/session-activity buffer: pending rows and flushes"""
+    return jsonify(get_activity_buffer(engine).stats())
+
+@api_bp.route('/api/metrics/rollups')
+@super_admin_required
+def rollup_metrics():
+    """Buffered signup rollups: pending deltas and flushes"""
+    return jsonify(get_rollup_buffer(engine).stats())
+
+@api_bp.route('/api/metrics/user-cache')
+@super_admin_required
+def user_cache_metrics():
+    """Profile cache size, hit rate and invalidations"""
+    return jsonify(get_profile_cache().stats())
+
+@api_bp.route('/api/metrics/budgets')
+@super_admin_required
+def budget_metrics():
+    """In-memory budget guard: tracked entities, rejections and last reconcile"""
+    return jsonify(budget_guard.stats())
 
-@app.route('/api/chat', methods=['POST'])
+@api_bp.route('/api/metrics/router')
+@super_admin_required
+def router_metrics():
+    """Tool routing: decisions by selection method and mean rule-matching time"""
+    return jsonify(tool_router().stats())
+
+@api_bp.route('/api/metrics/tool-registry')
+@super_admin_required
+def tool_registry_metrics():
+    """In-process ai_tools/ai_agents registry: version, sizes and reloads"""
+    return jsonify(get_tool_registry(engine).stats())
+
+@api_bp.route('/api/tools', methods=['GET'])
+@jwt_required()
+def list_tools():
+    """Tools available to the current user's role (?category= to narrow), from the in-process registry"""
+    current_user = get_jwt_identity()
+    tools = get_tool_registry(engine).tools_for(current_user.get('role'), request.args.get('category'))
+    return jsonify({'tools': [tool.to_dict() for tool in tools]})
+
+def tool_router():
+    """Rule-based tool router; its LLM fallback calls are logged as usage"""
+    return get_tool_router(engine, on_usage=lambda user_id, usage, input_data: record_usage(
+        engine, usage_row(user_id, usage, input_data)
+    ))
+
+@api_bp.route('/api/chat', methods=['POST'])
+@jwt_required()
 def chat():
-    """Main chat endpoint for AI interactions"""
+    """
+    Main chat endpoint for AI interactions (send "stream": true for Server-Sent Events).
+    Authenticated only: every paid call is logged and counted against a user's budget.
+    """
     try:
-        data = request.json
+        data = request.json or {}
         user_input = data.get('message', '')
-        
+
         if not user_input:
             return jsonify({"error": "No message provided"}), 400
-        
-        # TODO: Implement AI agent routing
-        response = {
-            "message": f"I received your message: '{user_input}'. AI agents are coming soon!",
-            "agent_used": "placeholder",
-            "status": "development"
-        }
-        
-        return jsonify(response)
-        
+
+        current_user = get_jwt_identity()
+        llm = get_chat_model()
+        # Over-budget users can still be served from the cache, but get no paid routing call
+        try:
+            budget_guard.check(current_user['id'], expected_cost(llm.model_name, user_input))
+            within_budget = True
+        except BudgetExceededError:
+            within_budget = False
+        # A requested tool the role may use wins; otherwise route by rules (LLM only when unsure)
+        route = tool_router().route(user_input, current_user.get('role'), requested_tool=data.get('tool'),
+                                    user_id=current_user['id'], allow_fallback=within_budget)
+        tool = route.tool
+        stream = data.get('stream') or 'text/event-stream' in request.headers.get('Accept', '')
+        model_settings = {'model': llm.model_name, 'temperature': llm.temperature}
+        meter = UsageMeter(llm.model_name, user_input)
+        request_data = {'message': user_input, 'tool': tool,
+                        'selectionMethod': route.method, 'confidence': round(route.confidence, 2)}
+
+        cached = response_cache.get(user_input, tool, model_settings)
+        if cached:
+            # Cache hits cost nothing and are logged as such
+            response_text, tier = cached
+            usage = free_usage(meter)
+            record_usage(engine, usage_row(current_user['id'], usage, request_data,
+                                           {'response': response_text, 'cache': tier}, status='cache_hit',
+                                           tool_id=route.tool_id))
+            if stream:
+                frames = [
+                    sse_event({'type': 'token', 'content': response_text}),
+                    sse_event({'type': 'done', 'agent_used': tool, 'cached': tier, 'usage': usage}, event='done'),
+                ]
+                return Response(frames, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+            return jsonify({"message": response_text, "agent_used": tool, "cached": tier, "usage": usage})
+
+        # Checked again: a routing call may have used up what was left
+        try:
+            budget_guard.check(current_user['id'], expected_cost(llm.model_name, user_input))
+        except BudgetExceededError as e:
+            return jsonify(e.to_dict()), 429
+
+        def remember(response_text):
+            response_cache.put(user_input, tool, model_settings, response_text)
+
+        # Identical prompts already waiting on the provider share that call
+        flight, leader = single_flight.join(cache_key(user_input, tool, model_settings))
+
+        if stream:
+            listener = flight.subscribe(single_flight.wait_timeout)
+            if leader:
+                def finish_stream(status, meter, error):
+                    if status == 'success':
+                        remember(meter.text)
+                    record_usage(engine, usage_row(
+                        current_user['id'], meter.summary(), request_data, {'response': meter.text},
+                        status=status, error_message=str(error) if status == 'error' else None,
+                        tool_id=route.tool_id
+                    ))
+
+                single_flight.pump(flight, lambda: llm.stream(user_input), meter, on_complete=finish_stream)
+            return Response(
+                stream_with_context(stream_chat(listener, flight, leader, meter, current_user, request_data,
+                                                route.tool_id)),
+                mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+            )
+
+        if leader:
+            response_text = single_flight.call(flight, lambda: llm.invoke(user_input), meter, on_success=remember)
+            usage = meter.summary()
+            record_usage(engine, usage_row(current_user['id'], usage, request_data, {'response': response_text},
+                                           tool_id=route.tool_id))
+        else:
+            response_text = flight.wait(single_flight.wait_timeout)
+            usage = free_usage(meter)
+            record_usage(engine, usage_row(current_user['id'], usage, request_data,
+                                           {'response': response_text}, status=COALESCED_STATUS,
+                                           tool_id=route.tool_id))
+
+        return jsonify({
+            "message": response_text,
+            "agent_used": tool,
+            "routing": route.to_dict(),
+            "usage": usage,
+            "coalesced": not leader
+        })
+
+    except LimiterRejected as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/dashboard/stats', methods=['GET'])
-def dashboard_stats():
-    """Get dashboard statistics for the frontend"""
-    # This would typically be fetched from your database
+def free_usage(meter):
+    """Usage for an answer that did not call the provider (cache hit or coalesced duplicate)"""
+    return dict(meter.summary(), promptTokens=0, completionTokens=0, totalTokens=0, cost=0)
+
+def stream_chat(listener, flight, leader, meter, current_user, request_data, tool_id=None):
+    """
+    Yield SSE frames from a (possibly shared) upstream stream. A client
+    disconnect only drops this listener; the leader's usage is recorded by the
+    pump when the upstream call ends, followers log a zero-cost row here.
+    """
+    status, error = COALESCED_STATUS, None
+    try:
+        for content in listener:
+            yield sse_event({'type': 'token', 'content': content})
+        usage = flight.usage if leader else free_usage(meter)
+        yield sse_event({'type': 'done', 'agent_used': request_data['tool'], 'usage': usage,
+                         'coalesced': not leader}, event='done')
+    except GeneratorExit:
+        # Raised by the WSGI server when the client goes away
+        status = 'cancelled'
+        raise
+    except Exception as e:
+        status, error = 'error', str(e)
+        yield sse_event({'type': 'error', 'message': error}, event='error')
+    finally:
+        listener.close()
+        if not leader:
+            record_usage(engine, usage_row(
+                current_user['id'], free_usage(meter), request_data,
+                {'response': flight.text}, status=status, error_message=error, tool_id=tool_id
+            ))
+
+@api_bp.route('/api/conversations/<conversation_id>/messages', methods=['GET'])
+@jwt_required()
+def conversation_messages(conversation_id):
+    """One page of a conversation, newest first page; pass ?before=<sequence> for older pages"""
+    current_user = get_jwt_identity()
+    try:
+        if conversation_repository.owner(conversation_id) != current_user['id']:
+            return jsonify({'message': 'Conversation not found'}), 404
+
+        before = request.args.get('before', type=int)
+        messages = conversation_repository.page(conversation_id, before=before,
+                                                limit=page_limit(request.args.get('limit')))
+    except SQLAlchemyError as e:
+        return jsonify({'message': f'Database error: {str(e)}'}), 500
+
     return jsonify({
-        "userCount": 1247,
-        "newToday": 23,
-        "systemUptime": 99.8,
-        "dailyCost": 0.12,
-        "dailyCap": 0.16,
-        "apiHealth": 98.7,
-        "recentActivity": [
-            {"user": "Dr. Johnson", "action": "Created quiz", "timestamp": "2025-06-09T10:30:00Z"},
-            {"user": "Alex Chen", "action": "Completed assignment", "timestamp": "2025-06-09T09:45:00Z"},
-            {"user": "Maria Rodriguez", "action": "Generated report", "timestamp": "2025-06-09T08:15:00Z"}
-        ]
+        'messages': [{
+            'sequence': message['sequence_number'],
+            'role': message['role'],
+            'content': message['content'],
+            'tokens': message['tokens'],
+            'createdAt': message['created_at'].isoformat() if message['created_at'] else None,
+        } for message in messages],
+        # Older messages exist when the oldest one on this page is not the first
+        'nextBefore': messages[0]['sequence_number'] if messages and messages[0]['sequence_number'] > 1 else None,
     })
 
-# Create tables if they don't exist
-@app.before_request
-def create_tables():
-    Base.metadata.create_all(bind=engine)
+@api_bp.route('/api/dashboard/stats', methods=['GET'])
+@jwt_required()
+def dashboard_stats():
+    """Get dashboard statistics for the frontend (served from performance_metrics rollups)"""
+    current_user = get_jwt_identity()
+    role = current_user.get('role')
+    if role not in ['admin', 'super_admin']:
+        return jsonify({'message': 'Unauthorized access'}), 403
+
+    if role == 'admin':
+        # Admins only see their own institution
+        try:
+            admin = get_profile_cache().get(current_user['id']) or {}
+        except SQLAlchemyError as e:
+            return jsonify({'message': f'Database error: {str(e)}'}), 500
+        institution_id = admin.get('institutionId')
+        # Never fall back to platform-wide stats
+        if not institution_id:
+            return jsonify({'message': 'Admin has no institution'}), 403
+    else:
+        institution_id = request.args.get('institutionId')
+
+    try:
+        stats = dict(stats_service.get_stats(institution_id))
+    except SQLAlchemyError as e:
+        return jsonify({'message': f'Database error: {str(e)}'}), 500
+
+    stats['systemUptime'] = health_monitor.availability()
+    return jsonify(stats)
+
+def create_app(auto_migrate=None):
+    """
+    Application factory.
+
+    The schema is migrated/verified once here, at boot. If the database is not
+    at the expected version this raises SchemaNotReadyError and the worker
+    never starts serving.
+    """
+    if auto_migrate is None:
+        auto_migrate = os.getenv('AUTO_MIGRATE', 'True').lower() == 'true'
+
+    prepare_schema(engine, auto_migrate=auto_migrate)
+
+    # Warm the email domain -> institution directory used by signup and imports
+    try:
+        get_institution_directory().load()
+    except SQLAlchemyError as e:
+        logger.warning(f"⚠️  Could not preload institutions: {e}")
+
+    app = Flask(__name__)
+    CORS(app, supports_credentials=True, origins=["http://localhost:3000", "https://your-render-domain.onrender.com"])
+
+    # Configuration
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
+    app.config['GEMINI_API_KEY'] = os.getenv('GEMINI_API_KEY')
+
+    # Initialize JWT
+    init_jwt(app)
+
+    # Register blueprints
+    app.register_blueprint(api_bp)
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(health_bp)
+
+    return app
+
+# Module-level app for `gunicorn app:app`
+app = create_app()
 
 if __name__ == '__main__':
     app.run(
         debug=os.getenv('FLASK_DEBUG', 'True').lower() == 'true',
         host='0.0.0.0',
         port=int(os.getenv('PORT', 5000))
-    )
\ No newline at end of file
+    )
@@ -8,8 +8,8 @@ import os
 import sys
 import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, text, event
-from sqlalchemy.engine import Engine
+from sqlalchemy import text
+from db_engine import create_db_engine
 from urllib.parse import urlparse
 import logging
 
@@ -41,35 +41,12 @@ class NeonSchemaManager:
     
     def create_optimized_engine(self):
         """Create SQLAlchemy engine optimized for Neon"""
-        engine_kwargs = {
-            'pool_size': 5,
-            'max_overflow': 10,
-            'pool_timeout': 30,
-            'pool_recycle': 3600,  # 1 hour
-            'pool_pre_ping': True,  # Verify connections before use
-            'connect_args': {
-                'connect_timeout': 30,
-                'application_name': 'academic_ai_platform'
-            }
-        }
-        
-        # Add SSL for Neon (required)
-        if 'neon.tech' in self.database_url or 'neondb.com' in self.database_url:
-            engine_kwargs['connect_args']['sslmode'] = 'require'
-        
-        self.engine = create_engine(self.database_url, **engine_kwargs)
-        
-        # Add event listener for connection optimization
-        @event.listens_for(self.engine, "connect")
-        def set_postgres_pragma(dbapi_connection, connection_record):
-            try:
-                with dbapi_connection.cursor() as cursor:
-                    # Optimize for Neon - use simpler settings
-                    cursor.execute("SET statement_timeout = '300s'")
-                    cursor.execute("SET lock_timeout = '60s'")
-            except Exception as e:
-                logger.warning(f"Could not set connection optimizations: {e}")
-        
+        # Same factory as the web app, with longer timeouts for schema DDL
+        self.engine = create_db_engine(
+            self.database_url,
+            statement_timeout='300s',
+            lock_timeout='60s',
+        )
         return self.engine
     
     def test_connection(self):
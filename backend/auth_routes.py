@@ -1,11 +1,32 @@
 # backend/auth_routes.py
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from datetime import timedelta, datetime
+from datetime import timedelta
 import os
+import json
 import uuid
-from models import User, Institution, SessionLocal
+import shutil
+import logging
+import tempfile
+import threading
+from models import User, Institution, SessionLocal, engine
+from sqlalchemy import text, tuple_
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import SQLAlchemyError
+from pagination import encode_cursor, decode_cursor, page_limit, InvalidCursorError
+from rollups import record_new_user
+from activity import get_activity_buffer
+from user_cache import get_profile_cache
+from passwords import get_password_hasher, HashingBusyError
+from institutions import get_institution_directory
+from user_import import parse_rows, import_users
+from provisioning import RosterProvisioner
+
+logger = logging.getLogger(__name__)
+
+# Opt-in migration aid only: accept the old placeholder password for accounts with no hash yet
+# (upgraded on login). Off by default, so an account without a stored hash cannot log in.
+LEGACY_PASSWORD_LOGIN = os.getenv('LEGACY_PASSWORD_LOGIN', 'False').lower() == 'true'
 
 # Create Blueprint
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
@@ -34,12 +55,25 @@ def login():
     try:
         # Find user by email
         user = session.query(User).filter(User.email == email).first()
+        # Give the connection back before the (slow) hash comparison
+        session.close()
         
-        # For now, we'll just check the password directly
-        # In production, you would verify against a hashed password
-        if not user or password != "password":  # Replace with proper password verification
+        hasher = get_password_hasher()
+        stored_hash = user.password_hash if user else None
+        # A missing hash verifies against a dummy and fails, at the same cost as a wrong password
+        valid = hasher.verify(password, stored_hash)
+        if stored_hash is None and user and LEGACY_PASSWORD_LOGIN:
+            # Accounts created before hashing landed still use the placeholder password
+            valid = password == "password"
+        if user and user.password_reset_required:
+            # Provisioned without a password (invite-pending): no password logs in until one is set
+            valid = False
+        if not user or not valid:
             return jsonify({'message': 'Invalid email or password'}), 401
         
+        if hasher.needs_rehash(stored_hash):
+            rehash_in_background(user.id, password)
+        
         # Create access token
         access_token = create_access_token(
             identity={
@@ -50,9 +84,9 @@ def login():
             }
         )
         
-        # Update last login
-        user.last_login = datetime.utcnow()
-        session.commit()
+        # Last login is written in the background; the login itself stays read-only
+        get_activity_buffer(engine).record_login(user.id)
+        get_profile_cache().invalidate_local(user.id)
         
         return jsonify({
             'token': access_token,
@@ -64,12 +98,28 @@ def login():
             }
         }), 200
     
+    except HashingBusyError:
+        return jsonify({'message': 'Too many login attempts in progress, try again shortly'}), 503
     except SQLAlchemyError as e:
-        session.rollback()
         return jsonify({'message': f'Database error: {str(e)}'}), 500
     finally:
         session.close()
 
+def rehash_in_background(user_id, password):
+    """Store a hash made with the current cost parameters without delaying the login"""
+    def upgrade():
+        try:
+            password_hash = get_password_hasher().hash(password)
+            with engine.begin() as conn:
+                conn.execute(
+                    text("UPDATE users SET password_hash = :hash WHERE id = CAST(:id AS UUID)"),
+                    {'hash': password_hash, 'id': str(user_id)}
+                )
+        except Exception as e:
+            logger.warning(f"⚠️  Password rehash for {user_id} failed: {e}")
+
+    threading.Thread(target=upgrade, name='password-rehash', daemon=True).start()
+
 # Sign up route
 @auth_bp.route('/signup', methods=['POST'])
 def signup():
@@ -89,6 +139,11 @@ def signup():
     # Extract domain from email for institution matching
     domain = email.split('@')[-1]
     
+    try:
+        password_hash = get_password_hasher().hash(password)
+    except HashingBusyError:
+        return jsonify({'message': 'Too many signups in progress, try again shortly'}), 503
+    
     session = SessionLocal()
     try:
         # Check if user already exists
@@ -96,21 +151,26 @@ def signup():
         if existing_user:
             return jsonify({'message': 'User with this email already exists'}), 409
         
-        # Find or create institution based on email domain
-        institution = session.query(Institution).filter(Institution.domain == domain).first()
-        if not institution:
+        # Find or create institution based on email domain (cached per worker)
+        directory = get_institution_directory()
+        institution = directory.lookup(domain)
+        created_institution = None
+        if institution:
+            institution_id = institution['id']
+        else:
             # For student signups, require existing institution
             if role == 'student':
                 return jsonify({'message': 'Institution not found for this email domain'}), 404
             
             # For other roles, create a new institution (this would be controlled by superadmin in production)
-            institution = Institution(
+            created_institution = Institution(
                 name=f"{domain.split('.')[0].title()} Institution",
                 domain=domain,
                 settings={}
             )
-            session.add(institution)
+            session.add(created_institution)
             session.flush()  # Get the ID without committing
+            institution_id = created_institution.id
         
         # Create new user
         new_user = User(
@@ -118,13 +178,16 @@ def signup():
             first_name=first_name,
             last_name=last_name,
             role=role,
-            institution_id=institution.id,
-            # In production, you would hash the password
-            # password_hash=generate_password_hash(password)
+            institution_id=institution_id,
+            password_hash=password_hash
         )
         
         session.add(new_user)
         session.commit()
+        record_new_user(institution_id)
+        if created_institution is not None:
+            directory.add(created_institution.id, created_institution.name, domain)
+        get_profile_cache().invalidate(new_user.id)
         
         return jsonify({
             'message': 'User created successfully',
@@ -147,28 +210,27 @@ def signup():
 def profile():
     current_user = get_jwt_identity()
     
-    session = SessionLocal()
     try:
-        user = session.query(User).filter(User.id == current_user['id']).first()
-        
-        if not user:
-            return jsonify({'message': 'User not found'}), 404
-        
-        return jsonify({
-            'user': {
-                'id': str(user.id),
-                'email': user.email,
-                'name': user.full_name,
-                'role': user.role,
-                'institution': user.institution.name if user.institution else None,
-                'lastLogin': user.last_login.isoformat() if user.last_login else None
-            }
-        }), 200
-    
+        user = get_profile_cache().get(current_user['id'])
     except SQLAlchemyError as e:
         return jsonify({'message': f'Database error: {str(e)}'}), 500
-    finally:
-        session.close()
+    
+    if not user:
+        return jsonify({'message': 'User not found'}), 404
+    
+    # Prefer a login that has not been flushed yet
+    last_login = get_activity_buffer(engine).pending_last_login(user['id']) or user['lastLogin']
+    
+    return jsonify({
+        'user': {
+            'id': user['id'],
+            'email': user['email'],
+            'name': user['name'],
+            'role': user['role'],
+            'institution': user['institution'],
+            'lastLogin': last_login.isoformat() if last_login else None
+        }
+    }), 200
 
 # SuperAdmin route for user role management
 @auth_bp.route('/users/role', methods=['PUT'])
@@ -204,6 +266,7 @@ def update_user_role():
         
         user.role = new_role
         session.commit()
+        get_profile_cache().invalidate(user.id)
         
         return jsonify({
             'message': 'User role updated successfully',
@@ -221,7 +284,123 @@ def update_user_role():
     finally:
         session.close()
 
-# Get all users (admin/superadmin only)
+# Bulk signup/import (admin/superadmin only): CSV or JSON batches
+@auth_bp.route('/users/import', methods=['POST'])
+@jwt_required()
+def bulk_import_users():
+    current_user = get_jwt_identity()
+    
+    if current_user.get('role') not in ['admin', 'super_admin']:
+        return jsonify({'message': 'Unauthorized access'}), 403
+    
+    if request.mimetype in ('text/csv', 'application/csv'):
+        rows = parse_rows(request.get_data(), 'text/csv')
+    else:
+        rows = parse_rows(request.get_json(silent=True), 'application/json')
+    
+    if not rows:
+        return jsonify({'message': 'No users provided'}), 400
+    max_rows = int(os.getenv('IMPORT_MAX_ROWS', 10000))
+    if len(rows) > max_rows:
+        return jsonify({'message': f'At most {max_rows} users per batch'}), 413
+    
+    try:
+        # Admins can only import into their own institution
+        allowed_institution_id = None
+        if current_user.get('role') == 'admin':
+            admin = get_profile_cache().get(current_user['id']) or {}
+            allowed_institution_id = admin.get('institutionId')
+            if not allowed_institution_id:
+                return jsonify({'message': 'Admin has no institution'}), 403
+        
+        result = import_users(
+            engine, get_institution_directory(), get_password_hasher(), rows,
+            max_role=current_user.get('role'), allowed_institution_id=allowed_institution_id,
+            chunk_size=int(os.getenv('IMPORT_CHUNK_SIZE', 500))
+        )
+        return jsonify(result), 201 if result['created'] else 200
+    
+    except SQLAlchemyError as e:
+        return jsonify({'message': f'Database error: {str(e)}'}), 500
+
+# Streaming roster provisioning (admin/superadmin only): CSV or NDJSON, progress streamed as NDJSON
+@auth_bp.route('/users/provision', methods=['POST'])
+@jwt_required()
+def provision_users():
+    current_user = get_jwt_identity()
+    
+    if current_user.get('role') not in ['admin', 'super_admin']:
+        return jsonify({'message': 'Unauthorized access'}), 403
+    
+    allowed_institution_id = None
+    if current_user.get('role') == 'admin':
+        try:
+            admin = get_profile_cache().get(current_user['id']) or {}
+        except SQLAlchemyError as e:
+            return jsonify({'message': f'Database error: {str(e)}'}), 500
+        allowed_institution_id = admin.get('institutionId')
+        if not allowed_institution_id:
+            return jsonify({'message': 'Admin has no institution'}), 403
+    
+    # Spool the upload to disk so a large roster never sits in memory
+    upload = tempfile.TemporaryFile()
+    shutil.copyfileobj(request.stream, upload, 1024 * 1024)
+    upload.seek(0)
+    
+    fmt = 'csv' if request.mimetype in ('text/csv', 'application/csv') else 'ndjson'
+    provisioner = RosterProvisioner(
+        engine, get_institution_directory(), get_password_hasher(),
+        batch_size=int(os.getenv('PROVISION_BATCH_SIZE', 5000)),
+        max_role=current_user.get('role'), allowed_institution_id=allowed_institution_id
+    )
+    
+    def events():
+        try:
+            for event in provisioner.run(upload, fmt):
+                yield json.dumps(event) + '\n'
+        except Exception as e:
+            # Nothing was merged; the transaction has been rolled back
+            yield json.dumps(dict(provisioner.counts, type='failed', error=str(e))) + '\n'
+        finally:
+            upload.close()
+    
+    return Response(stream_with_context(events()), mimetype='application/x-ndjson')
+
+# Serialized shape of a user in listings and exports
+def serialize_user(user):
+    return {
+        'id': str(user.id),
+        'email': user.email,
+        'name': user.full_name,
+        'role': user.role,
+        'institution': user.institution.name if user.institution else None,
+        'lastLogin': user.last_login.isoformat() if user.last_login else None,
+        'createdAt': user.created_at.isoformat()
+    }
+
+def users_query(session, current_user, args):
+    """Users visible to the caller, filtered and ordered newest first on (created_at, id)"""
+    query = session.query(User).options(joinedload(User.institution))
+
+    if current_user.get('role') == 'admin':
+        # Admins only see their own institution
+        admin = get_profile_cache().get(current_user['id']) or {}
+        query = query.filter(User.institution_id == admin.get('institutionId'))
+    elif args.get('institutionId'):
+        query = query.filter(User.institution_id == args['institutionId'])
+
+    if args.get('role'):
+        query = query.filter(User.role == args['role'])
+
+    search = (args.get('search') or '').strip()
+    if search:
+        # Matches the idx_users_search_trgm expression index
+        haystack = User.email + ' ' + User.first_name + ' ' + User.last_name
+        query = query.filter(haystack.ilike(f"%{search}%"))
+
+    return query.order_by(User.created_at.desc(), User.id.desc())
+
+# Get users (admin/superadmin only), one keyset page at a time or as an NDJSON export
 @auth_bp.route('/users', methods=['GET'])
 @jwt_required()
 def get_users():
@@ -230,24 +409,48 @@ def get_users():
     # Check if the current user is an admin or superadmin
     if current_user.get('role') not in ['admin', 'super_admin']:
         return jsonify({'message': 'Unauthorized access'}), 403
-    
+
+    if request.args.get('format') == 'ndjson':
+        return Response(
+            stream_with_context(export_users(current_user, request.args.to_dict())),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': 'attachment; filename=users.ndjson'}
+        )
+
+    limit = page_limit(request.args.get('limit'))
     session = SessionLocal()
     try:
-        users = session.query(User).all()
-        
-        user_list = [{
-            'id': str(user.id),
-            'email': user.email,
-            'name': user.full_name,
-            'role': user.role,
-            'institution': user.institution.name if user.institution else None,
-            'lastLogin': user.last_login.isoformat() if user.last_login else None,
-            'createdAt': user.created_at.isoformat()
-        } for user in users]
+        query = users_query(session, current_user, request.args)
+
+        cursor = request.args.get('cursor')
+        if cursor:
+            created_at, user_id = decode_cursor(cursor)
+            query = query.filter(tuple_(User.created_at, User.id) < (created_at, user_id))
+
+        # One extra row tells us whether there is a next page
+        users = query.limit(limit + 1).all()
+        page = users[:limit]
+        next_cursor = encode_cursor(page[-1].created_at, page[-1].id) if len(users) > limit else None
         
-        return jsonify({'users': user_list}), 200
+        return jsonify({
+            'users': [serialize_user(user) for user in page],
+            'nextCursor': next_cursor
+        }), 200
     
+    except InvalidCursorError as e:
+        return jsonify({'message': str(e)}), 400
     except SQLAlchemyError as e:
         return jsonify({'message': f'Database error: {str(e)}'}), 500
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+def export_users(current_user, args, batch_size=1000):
+    """Stream every matching user as one JSON object per line using a server-side cursor"""
+    session = SessionLocal()
+    try:
+        for user in users_query(session, current_user, args).yield_per(batch_size):
+            yield json.dumps(serialize_user(user)) + '\n'
+    except SQLAlchemyError as e:
+        yield json.dumps({'error': f'Database error: {str(e)}'}) + '\n'
+    finally:
+        session.close()
@@ -0,0 +1,88 @@
+# bench_embeddings.py
+"""
+Benchmark for the embedding provider and the similarity cache threshold.
+
+Reports embedding throughput per batch size, then the cosine distance
+between prompt variants that should share a cached answer and between
+unrelated prompts, to help pick RESPONSE_CACHE_MAX_DISTANCE. Finally replays
+a synthetic prompt stream against a NumpyVectorIndex-backed semantic lookup
+and reports the hit rate at that threshold. Uses EMBEDDING_PROVIDER, so with
+the default local provider it needs no network or database.
+
+Usage: python bench_embeddings.py [texts] [max_distance]
+"""
+
+import sys
+import time
+import random
+import numpy as np
+from dotenv import load_dotenv
+from embeddings import get_embedding_provider
+from response_cache import normalize_prompt
+from vector_index import NumpyVectorIndex
+
+load_dotenv()
+
+TOPICS = ['photosynthesis', 'the french revolution', 'linear algebra', 'cell division', 'supply and demand',
+          'plate tectonics', 'recursion', 'the water cycle', 'world war one', 'organic chemistry']
+TEMPLATES = ['create a quiz on {}', 'explain {} simply', 'summarize the key ideas of {}',
+             'write study notes about {}', 'give me practice problems for {}']
+VARIANTS = [lambda p: p, str.upper, lambda p: p.capitalize() + '!', lambda p: f'  {p} ?', lambda p: p + ' please']
+
+
+def prompt_stream(count, seed=7):
+    rng = random.Random(seed)
+    for _ in range(count):
+        base = rng.choice(TEMPLATES).format(rng.choice(TOPICS))
+        yield base, rng.choice(VARIANTS)(base)
+
+
+def distances(provider, pairs):
+    left = provider([normalize_prompt(a) for a, _ in pairs])
+    right = provider([normalize_prompt(b) for _, b in pairs])
+    return 1 - np.sum(left * right, axis=1)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    max_distance = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    provider = get_embedding_provider()
+    print(f"🔢 {provider.name} provider, {provider.dimensions} dimensions")
+    print("=" * 72)
+
+    texts = [variant for _, variant in prompt_stream(total)]
+    for batch_size in (1, 16, 64, 256):
+        start = time.perf_counter()
+        for offset in range(0, total, batch_size):
+            provider(texts[offset:offset + batch_size])
+        elapsed = time.perf_counter() - start
+        print(f"  batch={batch_size:<4} {total / elapsed:>10.0f} texts/s")
+
+    print("-" * 72)
+    same = distances(provider, list(prompt_stream(500)))
+    rng = random.Random(11)
+    unrelated = distances(provider, [
+        (rng.choice(TEMPLATES).format(a), rng.choice(TEMPLATES).format(b))
+        for a, b in (rng.sample(TOPICS, 2) for _ in range(500))
+    ])
+    print(f"  variants   distance p50={np.percentile(same, 50):.3f}  p99={np.percentile(same, 99):.3f}")
+    print(f"  unrelated  distance p1={np.percentile(unrelated, 1):.3f}  p50={np.percentile(unrelated, 50):.3f}")
+
+    print("-" * 72)
+    index = NumpyVectorIndex(dimensions=provider.dimensions)
+    hits = false_hits = 0
+    for base, variant in prompt_stream(min(total, 5000), seed=3):
+        vector = provider([normalize_prompt(variant)])[0]
+        found = index.search(vector, k=1)
+        if found and found[0][1] <= max_distance:
+            hits += 1
+            false_hits += found[0][2]['prompt'] != base
+        else:
+            index.add([(None, vector, {'prompt': base})])
+    lookups = min(total, 5000)
+    print(f"✅ max_distance={max_distance}: hit rate {hits / lookups:.1%}, "
+          f"wrong-answer hits {false_hits}, {len(index)} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# bench_password_hashing.py
+"""
+Benchmark for password verification throughput at different scrypt costs.
+
+For each N it times single-threaded verifications (one core) and then a
+burst of concurrent logins through PasswordHasher's process pool, and
+reports logins/sec overall and per core. Use it to pick PASSWORD_SCRYPT_N
+for the hardware you deploy on. No database needed.
+
+Usage: python bench_password_hashing.py [logins] [workers] [n,n,...]
+"""
+
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from passwords import PasswordHasher
+
+PASSWORD = 'correct horse battery staple'
+
+
+def single_core(hasher, encoded, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        hasher.verify(PASSWORD, encoded)
+    return count / (time.perf_counter() - start)
+
+
+def pooled(hasher, encoded, count):
+    # Request threads fan in to the bounded process pool, like gunicorn threads would
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=hasher.workers * 4) as clients:
+        list(clients.map(lambda _: hasher.verify(PASSWORD, encoded), range(count)))
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    costs = [int(n) for n in sys.argv[3].split(',')] if len(sys.argv) > 3 else [2 ** 12, 2 ** 14, 2 ** 15, 2 ** 16]
+
+    print(f"🔐 {logins} logins per setting, {workers} hashing workers, r=8 p=1")
+    print("=" * 72)
+    print(f"{'N':>8} {'ms/hash':>9} {'1 core/s':>10} {'pool/s':>10} {'pool/s/core':>12}")
+    for n in costs:
+        serial = PasswordHasher(n=n, workers=1, executor='thread')
+        hasher = PasswordHasher(n=n, workers=workers, max_pending=logins)
+        try:
+            encoded = serial.hash(PASSWORD)
+            one_core = single_core(serial, encoded, max(logins // 10, 5))
+            pool = pooled(hasher, encoded, logins)
+        finally:
+            serial.close()
+            hasher.close()
+        print(f"{n:>8} {1000 / one_core:>9.1f} {one_core:>10.1f} {pool:>10.1f} {pool / workers:>12.1f}")
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# bench_request_latency.py
+"""
+Per-request latency benchmark for /api/health and /api/auth/login.
+
+Compares the old behaviour (Base.metadata.create_all on every request via a
+before_request hook) with the current app factory, where the schema is only
+checked once at boot. Requires DATABASE_URL to point at a migrated database.
+
+Usage: python bench_request_latency.py [requests_per_endpoint]
+"""
+
+import statistics
+import sys
+import time
+from dotenv import load_dotenv
+from models import Base, engine
+
+load_dotenv()
+
+
+def measure(client, method, path, iterations, **kwargs):
+    """Return per-request latencies in milliseconds"""
+    call = getattr(client, method)
+    call(path, **kwargs)  # warm up the pool and any lazy imports
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        call(path, **kwargs)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    return f"p50 {statistics.median(ordered):7.2f} ms | p95 {p95:7.2f} ms | mean {statistics.mean(ordered):7.2f} ms"
+
+
+def run_benchmark(iterations=200):
+    from app import create_app
+
+    # "before": emulate the removed per-request create_all hook
+    legacy_app = create_app(auto_migrate=False)
+    legacy_app.before_request(lambda: Base.metadata.create_all(bind=engine))
+
+    # "after": schema verified once at boot, nothing on the request path
+    current_app = create_app(auto_migrate=False)
+
+    login_body = {'json': {'email': 'bench@aadu.edu', 'password': 'password'}}
+    endpoints = [
+        ('GET /api/health', 'get', '/api/health', {}),
+        ('POST /api/auth/login', 'post', '/api/auth/login', login_body),
+    ]
+
+    print("⏱️  Per-request latency benchmark")
+    print("=" * 72)
+    for label, method, path, kwargs in endpoints:
+        for name, flask_app in (('before', legacy_app), ('after', current_app)):
+            with flask_app.test_client() as client:
+                latencies = measure(client, method, path, iterations, **kwargs)
+            print(f"{label:<22} {name:<7} {summarize(latencies)}")
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,177 @@
+# bench_tool_router.py
+"""
+Benchmark for rule-based tool routing.
+
+Routes a labeled query set against the default ai_tools rows (seeded in
+full_schema.sql, keywords from migration 6) and reports accuracy, how many
+queries the rules settled on their own (the rest would go to the LLM
+fallback), and per-query latency. The same tools are then padded with
+synthetic ones to show how the precompiled matcher scales against a naive
+loop that tests every keyword of every tool with its own regex. Offline:
+no database, no LLM calls.
+
+Usage: python bench_tool_router.py [repeats] [synthetic_tools]
+"""
+
+import re
+import sys
+import time
+import random
+import numpy as np
+from tool_router import ToolRouter, DEFAULT_TOOL_KEYWORDS, DEFAULT_TOOL, mask_for
+
+# (name, display_name, category, allowed_roles) as seeded in full_schema.sql
+SEEDED_TOOLS = [
+    ('ai_tutor', 'AI Tutor', 'learning', ['student']),
+    ('study_guide_generator', 'Study Guide Generator', 'learning', ['student']),
+    ('essay_assistant', 'Essay Writing Assistant', 'learning', ['student']),
+    ('math_solver', 'Math Problem Solver', 'learning', ['student']),
+    ('lesson_planner', 'Lesson Plan Generator', 'teaching', ['faculty']),
+    ('quiz_creator', 'Quiz & Test Creator', 'assessment', ['faculty']),
+    ('rubric_builder', 'Rubric Builder', 'assessment', ['faculty']),
+    ('feedback_generator', 'Feedback Assistant', 'assessment', ['faculty']),
+    ('report_generator', 'Report Generator', 'administrative', ['admin', 'staff']),
+    ('email_composer', 'Email Composer', 'communication', ['admin', 'staff', 'faculty']),
+    ('schedule_optimizer', 'Schedule Optimizer', 'administrative', ['admin']),
+    ('data_analyzer', 'Data Analyzer', 'analytics', ['admin', 'superadmin']),
+]
+
+# (role, query, expected tool); general_chat means nothing specific should match
+LABELED_QUERIES = [
+    ('student', 'Can you explain how photosynthesis works?', 'ai_tutor'),
+    ('student', 'Help me understand recursion in Python', 'ai_tutor'),
+    ('student', 'Make a study guide for my biology midterm', 'study_guide_generator'),
+    ('student', 'I need flashcards for the French Revolution', 'study_guide_generator'),
+    ('student', 'Create a cheat sheet for organic chemistry reactions', 'study_guide_generator'),
+    ('student', 'Review my essay introduction and thesis statement', 'essay_assistant'),
+    ('student', 'Proofread this paragraph for me', 'essay_assistant'),
+    ('student', 'Solve the equation 3x + 5 = 20', 'math_solver'),
+    ('student', 'What is the derivative of sin(x) * x^2?', 'math_solver'),
+    ('student', 'Calculate the integral of 1/x from 1 to e', 'math_solver'),
+    ('faculty', 'Write a lesson plan on plate tectonics for grade 9', 'lesson_planner'),
+    ('faculty', 'Draft learning objectives for an intro statistics unit', 'lesson_planner'),
+    ('faculty', 'Create a 10 question multiple choice quiz on cell division', 'quiz_creator'),
+    ('faculty', 'Generate exam questions with an answer key for chapter 4', 'quiz_creator'),
+    ('faculty', 'Build a rubric for a persuasive writing assignment', 'rubric_builder'),
+    ('faculty', 'I need grading criteria for lab reports', 'rubric_builder'),
+    ('faculty', 'Write constructive feedback on this student work', 'feedback_generator'),
+    ('faculty', 'Compose an email to my class about the deadline extension', 'email_composer'),
+    ('staff', 'Prepare the enrollment report for this semester', 'report_generator'),
+    ('staff', 'Draft an announcement for the library closure', 'email_composer'),
+    ('admin', 'Build next term timetable without room conflicts', 'schedule_optimizer'),
+    ('admin', 'Fix the schedule for the science department', 'schedule_optimizer'),
+    ('admin', 'Analyze data on retention rate trends by department', 'data_analyzer'),
+    ('admin', 'Show statistics for course completion', 'data_analyzer'),
+    ('admin', 'Write the annual report for accreditation', 'report_generator'),
+    ('superadmin', 'Give me analytics on platform usage', 'data_analyzer'),
+    ('superadmin', 'Create a quiz on network security', 'quiz_creator'),
+    ('student', 'Hello, how are you today?', DEFAULT_TOOL),
+    ('faculty', 'Thanks, that was great', DEFAULT_TOOL),
+    # Role filtering: students cannot reach faculty tools
+    ('student', 'Make a rubric for my group project', DEFAULT_TOOL),
+]
+
+
+def seeded_tools():
+    return [{
+        'id': None, 'name': name, 'display_name': display_name, 'description': display_name,
+        'category': category, 'allowed_roles': roles, 'tags': [],
+        'keywords': DEFAULT_TOOL_KEYWORDS.get(name, []),
+    } for name, display_name, category, roles in SEEDED_TOOLS]
+
+
+def synthetic_tools(count, seed=11):
+    rng = random.Random(seed)
+    syllables = ['bio', 'geo', 'chem', 'lex', 'nova', 'stat', 'med', 'civ', 'astro', 'eco', 'psy', 'ling']
+    tools = []
+    for i in range(count):
+        stem = f"{rng.choice(syllables)}{rng.choice(syllables)}{i}"
+        tools.append({
+            'id': None, 'name': f'{stem}_tool', 'display_name': f'{stem.title()} Tool', 'description': stem,
+            'category': 'learning', 'allowed_roles': [rng.choice(['student', 'faculty', 'staff', 'admin'])],
+            'tags': [f'{stem} tag'], 'keywords': [f'{stem} {word}' for word in ('plan', 'review', 'report')],
+        })
+    return tools
+
+
+def naive_route(tools, message, role):
+    """Baseline: every keyword of every tool tested with its own regex"""
+    mask = mask_for(role)
+    best, best_score = DEFAULT_TOOL, 0
+    for tool in tools:
+        if not tool['mask'] & mask:
+            continue
+        score = sum(1 for pattern in tool['patterns'] if pattern.search(message))
+        if score > best_score:
+            best, best_score = tool['name'], score
+    return best
+
+
+def compile_naive(tools):
+    compiled = []
+    for tool in tools:
+        phrases = list(tool['keywords']) + list(tool['tags']) + [tool['name'].replace('_', ' ')]
+        compiled.append({
+            'name': tool['name'],
+            'mask': sum(mask_for(role) for role in tool['allowed_roles']),
+            'patterns': [re.compile(rf'\b{re.escape(phrase)}s?\b', re.IGNORECASE) for phrase in phrases],
+        })
+    return compiled
+
+
+def latencies(route, repeats):
+    samples = []
+    for _ in range(repeats):
+        for role, query, _ in LABELED_QUERIES:
+            start = time.perf_counter()
+            route(query, role)
+            samples.append((time.perf_counter() - start) * 1e6)
+    return np.array(samples)
+
+
+def describe(label, samples):
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    print(f"  {label:<28} p50={p50:7.1f}µs  p95={p95:7.1f}µs  p99={p99:7.1f}µs")
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    extra = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    router = ToolRouter(seeded_tools(), llm_fallback=None)
+    print(f"🧭 {len(router.matcher.names)} tools, {len(router.matcher.phrases)} compiled phrases")
+    print("=" * 72)
+
+    settled = correct = 0
+    for role, query, expected in LABELED_QUERIES:
+        decision = router.match(query, role)
+        if decision.method is None and decision.candidates:
+            # Not confident: this query would go to the LLM fallback
+            print(f"  ? [{role}] {query!r} -> LLM ({decision.tool} at {decision.confidence:.2f})")
+            continue
+        settled += 1
+        routed = decision.tool if decision.method else DEFAULT_TOOL
+        if routed == expected:
+            correct += 1
+        else:
+            print(f"  ✗ [{role}] {query!r} -> {routed} (expected {expected})")
+    total = len(LABELED_QUERIES)
+    print(f"  settled by rules {settled / total:.1%} ({total - settled} of {total} to the LLM), "
+          f"accuracy of those {correct / settled:.1%}")
+    print("-" * 72)
+
+    describe('compiled matcher', latencies(router.match, repeats))
+    naive = compile_naive(seeded_tools())
+    describe('naive keyword loop', latencies(lambda q, r: naive_route(naive, q, r), repeats))
+    print("-" * 72)
+
+    tools = seeded_tools() + synthetic_tools(extra)
+    big = ToolRouter(tools, llm_fallback=None)
+    print(f"  with {len(tools)} tools ({len(big.matcher.phrases)} phrases):")
+    describe('compiled matcher', latencies(big.match, max(1, repeats // 4)))
+    naive = compile_naive(tools)
+    describe('naive keyword loop', latencies(lambda q, r: naive_route(naive, q, r), max(1, repeats // 4)))
+
+
+if __name__ == "__main__":
+    main()
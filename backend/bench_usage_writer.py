@@ -0,0 +1,121 @@
+# bench_usage_writer.py
+"""
+Benchmark for ai_usage_logs writes under concurrent chat load.
+
+  per-row  : one transaction per usage row that also updates the user's
+             ai_budgets row (what the old track_ai_budget trigger did)
+  batched  : UsageLogWriter (multi-row INSERT + one aggregated budget upsert
+             per flush)
+
+Reports rows/sec and how often sessions were observed waiting on row locks
+(sampled from pg_stat_activity). Writes real rows for existing users, so run
+it against a scratch database.
+
+Usage: python bench_usage_writer.py [rows] [threads] [users]
+"""
+
+import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from sqlalchemy import text
+from models import engine
+from usage_logs import UsageLogWriter, usage_row, INSERT_USAGE_SQL, INSERT_USAGE_TEMPLATE, USAGE_COLUMNS
+
+load_dotenv()
+
+LEGACY_BUDGET_SQL = text("""
+    INSERT INTO ai_budgets (entity_type, entity_id, daily_usage, monthly_usage)
+    VALUES ('user', CAST(:user_id AS UUID), :cost, :cost)
+    ON CONFLICT (entity_type, entity_id) DO UPDATE SET
+        daily_usage = ai_budgets.daily_usage + EXCLUDED.daily_usage,
+        monthly_usage = ai_budgets.monthly_usage + EXCLUDED.monthly_usage
+""")
+
+
+class LockSampler:
+    """Samples pg_stat_activity for sessions blocked on locks"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.samples = 0
+        self.waiting = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        with engine.connect() as conn:
+            while not self._stop.is_set():
+                self.waiting += conn.execute(text(
+                    "SELECT COUNT(*) FROM pg_stat_activity WHERE wait_event_type = 'Lock'"
+                )).scalar()
+                self.samples += 1
+                time.sleep(self.interval)
+
+    @property
+    def mean_waiting(self):
+        return self.waiting / self.samples if self.samples else 0.0
+
+
+def sample_rows(user_ids, count):
+    usage = {'model': 'bench-model', 'promptTokens': 120, 'completionTokens': 380,
+             'totalTokens': 500, 'cost': 0.0004, 'executionTimeMs': 900}
+    return [usage_row(user_ids[i % len(user_ids)], usage, {'message': f'bench {i}'}) for i in range(count)]
+
+
+def write_per_row(row):
+    with engine.begin() as conn:
+        cursor = conn.connection.cursor()
+        cursor.execute(
+            INSERT_USAGE_SQL.replace('%s', INSERT_USAGE_TEMPLATE),
+            tuple(row[column] for column in USAGE_COLUMNS)
+        )
+        cursor.close()
+        conn.execute(LEGACY_BUDGET_SQL, {'user_id': row['user_id'], 'cost': row['cost']})
+
+
+def run(label, rows, threads, submit, finish=None):
+    with LockSampler() as sampler:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(submit, rows))
+        if finish:
+            finish()
+        elapsed = time.perf_counter() - start
+    print(f"{label:<10} {len(rows) / elapsed:>10.0f} rows/s   "
+          f"{elapsed:>7.2f} s   mean sessions waiting on locks: {sampler.mean_waiting:.2f}")
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    users = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    with engine.connect() as conn:
+        user_ids = [str(row[0]) for row in conn.execute(text("SELECT id FROM users LIMIT :n"), {'n': users})]
+    if not user_ids:
+        print("❌ No users found; create a few users first")
+        return
+
+    rows = sample_rows(user_ids, total)
+    print(f"📝 {total} usage rows, {threads} threads, {len(user_ids)} hot users")
+    print("=" * 72)
+
+    run('per-row', rows, threads, write_per_row)
+
+    writer = UsageLogWriter(engine, flush_interval=0.5, batch_size=1000)
+    run('batched', rows, threads, writer.submit, finish=writer.close)
+    print("=" * 72)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# bench_vector_index.py
+"""
+Benchmark for embedding retrieval: recall@k and latency at increasing sizes.
+
+Generates clustered synthetic vectors (uniform random vectors are an
+unrealistically hard case for ANN indexes), computes exact top-k neighbours
+by brute force, and reports p50/p95 query latency for:
+
+  * NumpyVectorIndex - exact in-process search (recall 1.0 by construction)
+  * pgvector HNSW    - one row per hnsw.ef_search value, when DATABASE_URL
+                       points at a database with the vector extension
+
+The pgvector run loads vectors into a scratch UNLOGGED table
+(bench_embeddings) with COPY, builds the index and drops the table afterwards;
+conversation_embeddings is never touched. At 1536 dimensions 1M vectors take
+~6 GB of RAM as float32; pass a smaller dimension to bench 1M on small hosts.
+
+Usage: python bench_vector_index.py [sizes] [dimensions] [queries] [k]
+       python bench_vector_index.py 10000,100000,1000000 1536 200 10
+"""
+
+import io
+import os
+import sys
+import time
+import numpy as np
+from dotenv import load_dotenv
+from vector_index import NumpyVectorIndex, vector_literal
+
+load_dotenv()
+
+EF_SEARCH_VALUES = (20, 40, 80, 160)
+CLUSTERS = 256
+GENERATE_CHUNK = 50000
+
+
+def generate(count, dimensions, seed):
+    """Vectors scattered around CLUSTERS random centres"""
+    rng = np.random.default_rng(seed)
+    centres = np.random.default_rng(0).standard_normal((CLUSTERS, dimensions)).astype(np.float32)
+    chunks = []
+    for start in range(0, count, GENERATE_CHUNK):
+        size = min(GENERATE_CHUNK, count - start)
+        noise = rng.standard_normal((size, dimensions)).astype(np.float32) * 0.6
+        chunks.append(centres[rng.integers(0, CLUSTERS, size)] + noise)
+    return np.vstack(chunks)
+
+
+def exact_neighbours(vectors, queries, k):
+    """Ground-truth top-k row numbers by cosine distance, chunked to bound memory"""
+    normalized = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    for start in range(0, len(vectors), GENERATE_CHUNK):
+        block = vectors[start:start + GENERATE_CHUNK]
+        block = block / np.linalg.norm(block, axis=1, keepdims=True)
+        scores = np.hstack([best_scores, normalized @ block.T])
+        rows = np.hstack([best_rows, np.arange(start, start + len(block))[None, :].repeat(len(queries), 0)])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_rows = np.take_along_axis(rows, top, axis=1)
+    return [set(row) for row in best_rows.tolist()]
+
+
+def percentiles(latencies):
+    latencies = np.array(latencies) * 1000
+    return np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def recall(results, truth, k):
+    return sum(len(set(found) & expected) for found, expected in zip(results, truth)) / (k * len(truth))
+
+
+def bench_numpy(vectors, queries, truth, k):
+    index = NumpyVectorIndex(dimensions=vectors.shape[1])
+    index.add_array(range(len(vectors)), vectors)
+    index.search(queries[0], k)  # folds the pending block into the matrix
+
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        found = index.search(query, k)
+        latencies.append(time.perf_counter() - start)
+        results.append([int(item_id) for item_id, _, _ in found])
+    p50, p95 = percentiles(latencies)
+    print(f"  {'numpy (exact)':<22} recall@{k}={recall(results, truth, k):.3f}  p50={p50:8.2f}ms  p95={p95:8.2f}ms")
+
+
+def bench_pgvector(engine, vectors, queries, truth, k):
+    from sqlalchemy import text
+
+    dimensions = vectors.shape[1]
+    with engine.connect() as conn:
+        if not conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'vector'")).scalar():
+            print("  ⚠️  pgvector not installed; skipping")
+            return
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS bench_embeddings"))
+        conn.execute(text(f"CREATE UNLOGGED TABLE bench_embeddings (id INTEGER PRIMARY KEY, embedding vector({dimensions}))"))
+        cursor = conn.connection.cursor()
+        load_start = time.perf_counter()
+        for start in range(0, len(vectors), GENERATE_CHUNK):
+            buffer = io.StringIO()
+            for row, vector in enumerate(vectors[start:start + GENERATE_CHUNK], start=start):
+                buffer.write(f"{row}\t{vector_literal(vector)}\n")
+            buffer.seek(0)
+            cursor.copy_expert("COPY bench_embeddings (id, embedding) FROM STDIN", buffer)
+        cursor.close()
+        loaded = time.perf_counter() - load_start
+
+    build_start = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL maintenance_work_mem = '2GB'"))
+        conn.execute(text(f"""
+            CREATE INDEX ON bench_embeddings USING hnsw (embedding vector_cosine_ops)
+            WITH (m = {int(os.getenv('VECTOR_HNSW_M', 16))},
+                  ef_construction = {int(os.getenv('VECTOR_HNSW_EF_CONSTRUCTION', 64))})
+        """))
+    print(f"  pgvector: COPY {loaded:.1f}s, HNSW build {time.perf_counter() - build_start:.1f}s")
+
+    try:
+        for ef_search in EF_SEARCH_VALUES:
+            results, latencies = [], []
+            with engine.connect() as conn:
+                conn.execute(text(f"SET hnsw.ef_search = {max(ef_search, k)}"))
+                for query in queries:
+                    start = time.perf_counter()
+                    rows = conn.execute(text("""
+                        SELECT id FROM bench_embeddings
+                        ORDER BY embedding <=> CAST(:vector AS vector) LIMIT :k
+                    """), {'vector': vector_literal(query), 'k': k}).fetchall()
+                    latencies.append(time.perf_counter() - start)
+                    results.append([row[0] for row in rows])
+                conn.rollback()
+            p50, p95 = percentiles(latencies)
+            print(f"  {f'hnsw ef_search={ef_search}':<22} recall@{k}={recall(results, truth, k):.3f}  "
+                  f"p50={p50:8.2f}ms  p95={p95:8.2f}ms")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS bench_embeddings"))
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1].split(',')] if len(sys.argv) > 1 else [10000, 100000, 1000000]
+    dimensions = int(sys.argv[2]) if len(sys.argv) > 2 else 1536
+    query_count = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+    k = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+
+    engine = None
+    if os.getenv('DATABASE_URL'):
+        from models import engine
+
+    print(f"📐 {dimensions} dimensions, {query_count} queries, k={k}")
+    print("=" * 72)
+    for size in sizes:
+        vectors = generate(size, dimensions, seed=size)
+        queries = generate(query_count, dimensions, seed=1)
+        truth = exact_neighbours(vectors, queries, k)
+
+        print(f"📊 {size:,} vectors")
+        bench_numpy(vectors, queries, truth, k)
+        if engine is not None:
+            bench_pgvector(engine, vectors, queries, truth, k)
+        print("-" * 72)
+        del vectors
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+# backend/budget_guard.py
+"""
+In-memory AI budget enforcement.
+
+Checks run against per-entity counters held in the process (sharded dicts,
+one lock per shard), so rejecting an over-budget call costs microseconds and
+never touches Postgres. A background thread reconciles the counters with
+ai_budgets, ai_usage_logs and the platform rollups every
+BUDGET_RECONCILE_INTERVAL seconds.
+
+Multiple gunicorn workers: each worker only sees its own spend between
+reconciliations, so at every reconcile a worker is granted 1/WEB_CONCURRENCY
+of each entity's remaining headroom. Together the workers can therefore never
+overshoot a limit by more than what was already spent when the limit was last
+reconciled, and the headroom is re-split as soon as the batched usage writer
+has flushed everyone's spend. Spend recorded here but still sitting in the
+writer's buffer is not in the database snapshot yet, so it is carried over
+on top of it at each reconcile instead of being reset.
+"""
+
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import text
+from rollups import PLATFORM_ENTITY_ID, AI_COST
+from llm import estimate_tokens, estimate_cost
+from usage_logs import add_usage_listener, add_flush_listener
+
+logger = logging.getLogger(__name__)
+
+# ai_budgets column defaults, used for entities without a row yet
+DEFAULT_DAILY_LIMIT = 5.00
+DEFAULT_MONTHLY_LIMIT = 150.00
+
+# Completion length assumed when pricing a call before it runs
+EXPECTED_COMPLETION_TOKENS = int(os.getenv('BUDGET_EXPECTED_COMPLETION_TOKENS', 500))
+
+# Usage rows that did not call the provider (response cache hits, coalesced duplicates)
+FREE_STATUSES = ('cache_hit', 'coalesced')
+
+
+def expected_cost(model, prompt):
+    return estimate_cost(model, estimate_tokens(prompt), EXPECTED_COMPLETION_TOKENS)
+
+
+class BudgetExceededError(Exception):
+    """Raised when a call would push an entity over one of its limits"""
+
+    def __init__(self, entity_type, entity_id, limit_name, limit, used):
+        super().__init__(f"{entity_type} {limit_name} limit reached ({used:.4f} of {limit:.4f})")
+        self.entity_type = entity_type
+        self.entity_id = entity_id
+        self.limit_name = limit_name
+        self.limit = limit
+        self.used = used
+
+    def to_dict(self):
+        return {
+            'error': 'budget_exceeded',
+            'message': str(self),
+            'entity': self.entity_type,
+            'limit': self.limit_name,
+        }
+
+
+class EntityBudget:
+    """Limits and usage for one (entity_type, entity_id)"""
+
+    __slots__ = ('daily_limit', 'monthly_limit', 'request_limit', 'daily_allowance', 'monthly_allowance',
+                 'request_allowance', 'daily_spent', 'monthly_spent', 'requests', 'day',
+                 'pending_daily', 'pending_monthly', 'pending_requests')
+
+    def __init__(self, daily_limit=None, monthly_limit=None, request_limit=None):
+        self.daily_limit = daily_limit
+        self.monthly_limit = monthly_limit
+        self.request_limit = request_limit
+        # This worker's share of the remaining headroom at the last reconcile
+        self.daily_allowance = daily_limit
+        self.monthly_allowance = monthly_limit
+        self.request_allowance = request_limit
+        # Local spend since the last reconcile
+        self.daily_spent = 0.0
+        self.monthly_spent = 0.0
+        self.requests = 0
+        # Recorded spend the usage writer has not committed yet (not in any database snapshot)
+        self.pending_daily = 0.0
+        self.pending_monthly = 0.0
+        self.pending_requests = 0
+        self.day = datetime.utcnow().date()
+
+    def roll_over(self, today):
+        if today != self.day:
+            if today.month != self.day.month or today.year != self.day.year:
+                self.monthly_allowance = self.monthly_limit
+                self.monthly_spent = 0.0
+                self.pending_monthly = 0.0
+            self.daily_allowance = self.daily_limit
+            self.request_allowance = self.request_limit
+            self.daily_spent = 0.0
+            self.requests = 0
+            self.pending_daily = 0.0
+            self.pending_requests = 0
+            self.day = today
+
+    def settle(self, cost, requests):
+        """Spend that has reached the database; clamped since a row may predate a membership"""
+        self.pending_daily = max(self.pending_daily - cost, 0.0)
+        self.pending_monthly = max(self.pending_monthly - cost, 0.0)
+        self.pending_requests = max(self.pending_requests - requests, 0)
+
+    def violation(self, cost):
+        """Name of the first limit this call would exceed, or None"""
+        if self.request_allowance is not None and self.requests + 1 > self.request_allowance:
+            return 'daily_requests', self.request_allowance, self.requests
+        if self.daily_allowance is not None and self.daily_spent + cost > self.daily_allowance:
+            return 'daily_cost', self.daily_allowance, self.daily_spent
+        if self.monthly_allowance is not None and self.monthly_spent + cost > self.monthly_allowance:
+            return 'monthly_cost', self.monthly_allowance, self.monthly_spent
+        return None
+
+
+class BudgetGuard:
+    """Sharded in-memory budget counters with periodic reconciliation"""
+
+    def __init__(self, engine, workers=1, reconcile_interval=30.0, shards=16,
+                 daily_request_limit=200, platform_monthly_limit=4.50):
+        self.engine = engine
+        self.workers = max(int(workers), 1)
+        self.reconcile_interval = reconcile_interval
+        self.daily_request_limit = daily_request_limit
+        self.platform_monthly_limit = platform_monthly_limit
+        self._shards = [({}, threading.Lock()) for _ in range(shards)]
+        # user_id -> (department_id, institution_id), filled in by reconcile
+        self._memberships = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.rejections = 0
+        self.reconciles = 0
+        self.last_reconcile_at = None
+
+        self._budget(('platform', PLATFORM_ENTITY_ID), create=True)
+
+    # ----- hot path -----
+
+    def _shard(self, key):
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _budget(self, key, create=False):
+        budgets, lock = self._shard(key)
+        with lock:
+            budget = budgets.get(key)
+            if budget is None and create:
+                budget = budgets[key] = self._default_budget(key[0])
+            return budget
+
+    def _default_budget(self, entity_type):
+        if entity_type == 'platform':
+            return EntityBudget(monthly_limit=self.platform_monthly_limit)
+        if entity_type == 'user':
+            return EntityBudget(DEFAULT_DAILY_LIMIT / self.workers, DEFAULT_MONTHLY_LIMIT / self.workers,
+                                self.daily_request_limit / self.workers if self.daily_request_limit else None)
+        return EntityBudget(DEFAULT_DAILY_LIMIT / self.workers, DEFAULT_MONTHLY_LIMIT / self.workers)
+
+    def _entities(self, user_id):
+        keys = [('platform', PLATFORM_ENTITY_ID)]
+        if user_id:
+            keys.append(('user', str(user_id)))
+            department_id, institution_id = self._memberships.get(str(user_id), (None, None))
+            if department_id:
+                keys.append(('department', department_id))
+            if institution_id:
+                keys.append(('institution', institution_id))
+        return keys
+
+    def check(self, user_id, estimated_cost=0.0):
+        """Raise BudgetExceededError if the call would exceed any limit; no I/O"""
+        today = datetime.utcnow().date()
+        for key in self._entities(user_id):
+            budgets, lock = self._shard(key)
+            with lock:
+                budget = budgets.get(key)
+                if budget is None:
+                    budget = budgets[key] = self._default_budget(key[0])
+                budget.roll_over(today)
+                violation = budget.violation(estimated_cost)
+            if violation:
+                self.rejections += 1
+                raise BudgetExceededError(key[0], key[1], *violation)
+
+    def record(self, user_id, cost, requests=1):
+        """Add completed spend to every entity the user rolls up to"""
+        today = datetime.utcnow().date()
+        for key in self._entities(user_id):
+            budgets, lock = self._shard(key)
+            with lock:
+                budget = budgets.get(key)
+                if budget is None:
+                    budget = budgets[key] = self._default_budget(key[0])
+                budget.roll_over(today)
+                budget.daily_spent += cost
+                budget.monthly_spent += cost
+                budget.requests += requests
+                budget.pending_daily += cost
+                budget.pending_monthly += cost
+                budget.pending_requests += requests
+
+    def on_usage(self, row):
+        """usage_logs listener: count every recorded usage row"""
+        if row.get('status') in FREE_STATUSES:
+            return
+        self.record(row.get('user_id'), float(row.get('cost') or 0))
+
+    def on_flush(self, rows):
+        """usage_logs flush listener: these rows are now part of what reconcile reads"""
+        today = datetime.utcnow().date()
+        for row in rows:
+            if row.get('status') in FREE_STATUSES:
+                continue
+            cost = float(row.get('cost') or 0)
+            for key in self._entities(row.get('user_id')):
+                budgets, lock = self._shard(key)
+                with lock:
+                    budget = budgets.get(key)
+                    if budget is not None:
+                        budget.roll_over(today)
+                        budget.settle(cost, 1)
+
+    # ----- reconciliation -----
+
+    def reconcile(self):
+        """Refresh limits and usage from Postgres and re-split headroom between workers"""
+        keys = [key for budgets, lock in self._shards for key in list(budgets)]
+        user_ids = [entity_id for entity_type, entity_id in keys if entity_type == 'user']
+        # Taken before the queries: a row flushed in between is counted twice until the next
+        # reconcile (conservative) rather than not at all
+        pending = self._pending()
+
+        with self.engine.connect() as conn:
+            if user_ids:
+                for user_id, department_id, institution_id in conn.execute(text("""
+                    SELECT CAST(id AS TEXT), CAST(department_id AS TEXT), CAST(institution_id AS TEXT)
+                    FROM users WHERE id = ANY(CAST(:ids AS UUID[]))
+                """), {'ids': user_ids}):
+                    self._memberships[user_id] = (department_id, institution_id)
+                    for key in (('department', department_id), ('institution', institution_id)):
+                        if key[1]:
+                            self._budget(key, create=True)
+                keys = [key for budgets, lock in self._shards for key in list(budgets)]
+
+            rows = conn.execute(text("""
+                SELECT b.entity_type, CAST(b.entity_id AS TEXT), b.daily_limit, b.monthly_limit,
+                       CASE WHEN b.daily_reset_at < CURRENT_DATE THEN 0 ELSE b.daily_usage END,
+                       CASE WHEN b.monthly_reset_at < DATE_TRUNC('month', CURRENT_DATE)::DATE
+                            THEN 0 ELSE b.monthly_usage END
+                FROM UNNEST(CAST(:types AS TEXT[]), CAST(:ids AS UUID[])) AS wanted(entity_type, entity_id)
+                JOIN ai_budgets b ON b.entity_type = wanted.entity_type AND b.entity_id = wanted.entity_id
+            """), {
+                'types': [key[0] for key in keys if key[0] != 'platform'],
+                'ids': [key[1] for key in keys if key[0] != 'platform'],
+            }).fetchall()
+            budgets_by_key = {(row[0], row[1]): row[2:] for row in rows}
+
+            requests_today = dict(conn.execute(text("""
+                SELECT CAST(user_id AS TEXT), COUNT(*)
+                FROM ai_usage_logs
+                WHERE user_id = ANY(CAST(:ids AS UUID[]))
+                  AND created_at >= CURRENT_DATE AND status NOT IN ('cache_hit', 'coalesced')
+                GROUP BY user_id
+            """), {'ids': user_ids}).fetchall()) if user_ids else {}
+
+            platform_month_cost = conn.execute(text("""
+                SELECT COALESCE(SUM(metric_value), 0) FROM performance_metrics
+                WHERE entity_type = 'platform' AND entity_id = CAST(:id AS UUID)
+                  AND metric_name = :metric AND period_type = 'daily'
+                  AND period_start >= DATE_TRUNC('month', CURRENT_DATE)::DATE
+            """), {'id': PLATFORM_ENTITY_ID, 'metric': AI_COST}).scalar()
+
+        today = datetime.utcnow().date()
+        for key in keys:
+            budgets, lock = self._shard(key)
+            with lock:
+                budget = budgets[key]
+                budget.roll_over(today)
+                # Entities first seen during this reconcile have nothing unflushed from before it
+                carried = self._carried(budget, pending.get(key, (0.0, 0.0, 0, 0.0, 0.0, 0)))
+                if key[0] == 'platform':
+                    self._apply(budget, None, self.platform_monthly_limit, 0.0, float(platform_month_cost),
+                                carried)
+                    continue
+                daily_limit, monthly_limit, daily_used, monthly_used = budgets_by_key.get(
+                    key, (DEFAULT_DAILY_LIMIT, DEFAULT_MONTHLY_LIMIT, 0, 0)
+                )
+                self._apply(budget, float(daily_limit), float(monthly_limit), float(daily_used), float(monthly_used),
+                            carried)
+                if key[0] == 'user' and self.daily_request_limit:
+                    budget.request_limit = self.daily_request_limit
+                    budget.request_allowance = max(
+                        self.daily_request_limit - requests_today.get(key[1], 0), 0
+                    ) / self.workers
+                    budget.requests = carried[2]
+
+        self.reconciles += 1
+        self.last_reconcile_at = time.time()
+
+    def _pending(self):
+        """Per entity: unflushed (daily, monthly, requests) and the local counters at the same moment"""
+        pending = {}
+        for budgets, lock in self._shards:
+            with lock:
+                for key, budget in budgets.items():
+                    pending[key] = (budget.pending_daily, budget.pending_monthly, budget.pending_requests,
+                                    budget.daily_spent, budget.monthly_spent, budget.requests)
+        return pending
+
+    @staticmethod
+    def _carried(budget, unflushed):
+        """Unflushed spend at the snapshot plus whatever was recorded while reconcile ran"""
+        daily, monthly, requests, daily_then, monthly_then, requests_then = unflushed
+        return (daily + max(budget.daily_spent - daily_then, 0.0),
+                monthly + max(budget.monthly_spent - monthly_then, 0.0),
+                requests + max(budget.requests - requests_then, 0))
+
+    def _apply(self, budget, daily_limit, monthly_limit, daily_used, monthly_used, carried):
+        """Grant this worker its share of the remaining headroom; local spend restarts from what is not in it"""
+        budget.daily_limit = daily_limit
+        budget.monthly_limit = monthly_limit
+        budget.daily_allowance = None if daily_limit is None else max(daily_limit - daily_used, 0) / self.workers
+        budget.monthly_allowance = None if monthly_limit is None else max(monthly_limit - monthly_used, 0) / self.workers
+        budget.daily_spent = carried[0]
+        budget.monthly_spent = carried[1]
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='budget-reconciler', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.warning(f"⚠️  Budget reconciliation failed: {e}")
+            if self._stop.wait(self.reconcile_interval):
+                return
+
+    def stats(self):
+        return {
+            'entities': sum(len(budgets) for budgets, lock in self._shards),
+            'workers': self.workers,
+            'rejections': self.rejections,
+            'reconciles': self.reconciles,
+            'lastReconcileAt': self.last_reconcile_at,
+        }
+
+
+def budget_guard_from_env(engine):
+    """Guard fed by record_usage() and reconciled in the background (in memory only without an engine)"""
+    guard = BudgetGuard(
+        engine,
+        workers=int(os.getenv('WEB_CONCURRENCY', 1)),
+        reconcile_interval=float(os.getenv('BUDGET_RECONCILE_INTERVAL', 30)),
+        daily_request_limit=int(os.getenv('DAILY_REQUEST_LIMIT', 200)),
+        platform_monthly_limit=float(os.getenv('MONTHLY_BUDGET_LIMIT', 4.50)),
+    )
+    add_usage_listener(guard.on_usage)
+    add_flush_listener(guard.on_flush)
+    return guard.start() if engine is not None else guard
@@ -0,0 +1,210 @@
+# backend/conversations.py
+"""
+Conversation storage over conversations / conversation_messages.
+
+Appends take the next sequence numbers from an atomic
+`UPDATE conversations ... RETURNING message_count`, so message_count and
+total_tokens never go through a read-modify-write in Python and concurrent
+writers to one conversation are serialized on its row. Reads walk
+idx_messages_sequence (conversation_id, sequence_number): the last N messages
+are one backward range scan bounded by LIMIT, and long histories are paged
+by sequence number instead of being loaded whole.
+"""
+
+import json
+from psycopg2.extras import execute_values
+from sqlalchemy import text
+from llm import estimate_tokens
+
+# LangChain message.type <-> conversation_role enum
+ROLE_BY_MESSAGE_TYPE = {'human': 'user', 'ai': 'assistant', 'system': 'system', 'function': 'function', 'tool': 'tool'}
+
+ENSURE_CONVERSATION_SQL = text("""
+    INSERT INTO conversations (id, user_id, title, metadata)
+    VALUES (CAST(:id AS UUID), CAST(:user_id AS UUID), :title, CAST(:metadata AS JSONB))
+    ON CONFLICT (id) DO NOTHING
+""")
+
+# Reserves sequence numbers (message_count - n + 1 .. message_count) under the row lock
+RESERVE_SEQUENCE_SQL = text("""
+    UPDATE conversations SET
+        message_count = COALESCE(message_count, 0) + :count,
+        total_tokens = COALESCE(total_tokens, 0) + :tokens,
+        last_message_at = CURRENT_TIMESTAMP,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE id = CAST(:id AS UUID)
+    RETURNING message_count
+""")
+
+INSERT_MESSAGES_SQL = """
+    INSERT INTO conversation_messages (conversation_id, role, content, tokens, metadata, sequence_number)
+    VALUES %s
+"""
+INSERT_MESSAGES_TEMPLATE = "(%s::uuid, %s::conversation_role, %s, %s, %s::jsonb, %s)"
+
+
+class ConversationNotFoundError(LookupError):
+    """Raised when appending to a conversation that does not exist"""
+
+
+class ConversationAccessError(PermissionError):
+    """Raised when a conversation belongs to another user"""
+
+
+def message_row(role, content, tokens=None, metadata=None):
+    return {
+        'role': role,
+        'content': content,
+        'tokens': tokens if tokens is not None else estimate_tokens(content),
+        'metadata': metadata or {},
+    }
+
+
+def from_langchain(messages):
+    """message_row()s for LangChain messages"""
+    return [message_row(ROLE_BY_MESSAGE_TYPE.get(message.type, 'user'), message.content) for message in messages]
+
+
+def to_langchain(rows):
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+    message_class = {'user': HumanMessage, 'assistant': AIMessage, 'system': SystemMessage}
+    return [message_class.get(row['role'], HumanMessage)(content=row['content']) for row in rows]
+
+
+class ConversationRepository:
+    """Batched appends and sequence-ordered reads of conversation messages"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def ensure(self, conversation_id, user_id, title=None, metadata=None, conn=None):
+        params = {
+            'id': str(conversation_id),
+            'user_id': str(user_id),
+            'title': title,
+            'metadata': json.dumps(metadata or {}),
+        }
+        if conn is not None:
+            conn.execute(ENSURE_CONVERSATION_SQL, params)
+            return
+        with self.engine.begin() as own:
+            own.execute(ENSURE_CONVERSATION_SQL, params)
+
+    def owner(self, conversation_id, conn=None):
+        """user_id of the conversation as text, or None if it does not exist"""
+        if conn is None:
+            with self.engine.connect() as own:
+                return self.owner(conversation_id, conn=own)
+        return conn.execute(
+            text("SELECT CAST(user_id AS TEXT) FROM conversations WHERE id = CAST(:id AS UUID)"),
+            {'id': str(conversation_id)}
+        ).scalar()
+
+    def check_owner(self, conversation_id, user_id, conn=None):
+        """Raise ConversationAccessError unless the conversation is missing or `user_id`'s"""
+        owner = self.owner(conversation_id, conn=conn)
+        if owner is not None and owner != str(user_id):
+            raise ConversationAccessError(f"Conversation {conversation_id} belongs to another user")
+
+    def append(self, conversation_id, messages, conn=None):
+        """
+        Append message_row()s in one transaction; returns their sequence numbers.
+
+        Pass `conn` to join the caller's transaction.
+        """
+        if not messages:
+            return []
+        if conn is None:
+            with self.engine.begin() as own:
+                return self.append(conversation_id, messages, conn=own)
+
+        last = conn.execute(RESERVE_SEQUENCE_SQL, {
+            'id': str(conversation_id),
+            'count': len(messages),
+            'tokens': sum(message['tokens'] or 0 for message in messages),
+        }).scalar()
+        if last is None:
+            raise ConversationNotFoundError(f"Conversation {conversation_id} not found")
+
+        first = last - len(messages) + 1
+        cursor = conn.connection.cursor()
+        execute_values(cursor, INSERT_MESSAGES_SQL, [
+            (str(conversation_id), message['role'], message['content'], message['tokens'],
+             json.dumps(message['metadata']), first + offset)
+            for offset, message in enumerate(messages)
+        ], template=INSERT_MESSAGES_TEMPLATE, page_size=1000)
+        cursor.close()
+        return list(range(first, last + 1))
+
+    def page(self, conversation_id, before=None, limit=50):
+        """Up to `limit` messages older than sequence `before` (newest page if None), oldest first"""
+        bound = "AND sequence_number < :before" if before is not None else ""
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT sequence_number, role, content, tokens, created_at
+                FROM conversation_messages
+                WHERE conversation_id = CAST(:id AS UUID) {bound}
+                ORDER BY sequence_number DESC
+                LIMIT :limit
+            """), {'id': str(conversation_id), 'before': before, 'limit': limit}).mappings().fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def recent(self, conversation_id, limit=20):
+        """The last `limit` messages, oldest first"""
+        return self.page(conversation_id, limit=limit)
+
+    def recent_within(self, conversation_id, max_tokens, after=0, page_size=20):
+        """
+        Newest messages (sequence > `after`) whose tokens fit in `max_tokens`,
+        paging backwards only as far as needed
+        """
+        selected, used, before = [], 0, None
+        while True:
+            page = self.page(conversation_id, before=before, limit=page_size)
+            for row in reversed(page):
+                used += row['tokens'] or estimate_tokens(row['content'])
+                if row['sequence_number'] <= after or used > max_tokens:
+                    return list(reversed(selected))
+                selected.append(row)
+            if len(page) < page_size:
+                return list(reversed(selected))
+            before = page[0]['sequence_number']
+
+    def add_summary(self, conversation_id, summary, range_start, range_end, tokens_summarized):
+        """Record a conversation_summaries row covering sequences range_start..range_end"""
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO conversation_summaries
+                    (conversation_id, summary, message_range_start, message_range_end, tokens_summarized)
+                VALUES (CAST(:id AS UUID), :summary, :start, :end, :tokens)
+            """), {'id': str(conversation_id), 'summary': summary, 'start': range_start,
+                   'end': range_end, 'tokens': tokens_summarized})
+
+    def latest_summary(self, conversation_id):
+        """(summary, message_range_end) of the newest summary, or (None, 0)"""
+        with self.engine.connect() as conn:
+            row = conn.execute(text("""
+                SELECT summary, message_range_end FROM conversation_summaries
+                WHERE conversation_id = CAST(:id AS UUID)
+                ORDER BY message_range_end DESC
+                LIMIT 1
+            """), {'id': str(conversation_id)}).fetchone()
+        return (row[0], row[1]) if row else (None, 0)
+
+    def iter_messages(self, conversation_id, after=0, page_size=200):
+        """Lazily yield the whole history in sequence order, one page per query"""
+        while True:
+            with self.engine.connect() as conn:
+                rows = conn.execute(text("""
+                    SELECT sequence_number, role, content, tokens, created_at
+                    FROM conversation_messages
+                    WHERE conversation_id = CAST(:id AS UUID) AND sequence_number > :after
+                    ORDER BY sequence_number
+                    LIMIT :limit
+                """), {'id': str(conversation_id), 'after': after, 'limit': page_size}).mappings().fetchall()
+            for row in rows:
+                yield dict(row)
+            if len(rows) < page_size:
+                return
+            after = rows[-1]['sequence_number']
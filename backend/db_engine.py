@@ -0,0 +1,226 @@
+# backend/db_engine.py
+"""
+Shared SQLAlchemy engine factory with connection pool instrumentation.
+
+Both the web app (models.py) and the schema tooling (apply_schema.py) build
+their engines here, so pool sizing, pre-ping, recycling, timeouts and SSL are
+configured in one place. Pool pressure is recorded in PoolMetrics and exposed
+through pool_status().
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+from urllib.parse import urlparse
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+def is_neon_url(database_url):
+    hostname = urlparse(database_url).hostname or ''
+    return 'neon.tech' in hostname or 'neondb.com' in hostname
+
+
+def is_pooler_url(database_url):
+    """PgBouncer endpoints (Neon's -pooler hosts) reject the `options` startup parameter"""
+    return '-pooler' in (urlparse(database_url).hostname or '')
+
+
+def engine_settings_from_env():
+    """Pool and session settings, overridable through environment variables"""
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 3600)),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true',
+        'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 30)),
+        'statement_timeout': os.getenv('DB_STATEMENT_TIMEOUT', '30s'),
+        'lock_timeout': os.getenv('DB_LOCK_TIMEOUT', '10s'),
+        'application_name': os.getenv('DB_APPLICATION_NAME', 'academic_ai_platform'),
+        'slow_checkout_ms': float(os.getenv('DB_SLOW_CHECKOUT_MS', 100)),
+    }
+
+
+class PoolMetrics:
+    """Thread-safe counters for pool checkout waits and new connection latency"""
+
+    def __init__(self, window=1024, slow_checkout_ms=100.0):
+        self._lock = threading.Lock()
+        self.slow_checkout_ms = slow_checkout_ms
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.slow_checkouts = 0
+        self.wait_ms_total = 0.0
+        self.wait_ms_max = 0.0
+        self.connects = 0
+        self.connect_errors = 0
+        self.connect_ms_total = 0.0
+        self.connect_ms_max = 0.0
+        self._recent_waits = deque(maxlen=window)
+        self._recent_connects = deque(maxlen=window)
+
+    def record_wait(self, wait_ms, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.checkout_timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_ms_total += wait_ms
+            self.wait_ms_max = max(self.wait_ms_max, wait_ms)
+            self._recent_waits.append(wait_ms)
+            slow = wait_ms >= self.slow_checkout_ms
+            if slow:
+                self.slow_checkouts += 1
+        return slow
+
+    def record_connect(self, connect_ms, failed=False):
+        with self._lock:
+            if failed:
+                self.connect_errors += 1
+                return
+            self.connects += 1
+            self.connect_ms_total += connect_ms
+            self.connect_ms_max = max(self.connect_ms_max, connect_ms)
+            self._recent_connects.append(connect_ms)
+
+    @staticmethod
+    def _percentile(values, fraction):
+        if not values:
+            return 0.0
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def snapshot(self):
+        with self._lock:
+            waits = list(self._recent_waits)
+            connects = list(self._recent_connects)
+            total_waits = self.checkouts + self.checkout_timeouts
+            return {
+                'checkouts': self.checkouts,
+                'checkoutTimeouts': self.checkout_timeouts,
+                'slowCheckouts': self.slow_checkouts,
+                'waitMs': {
+                    'mean': round(self.wait_ms_total / total_waits, 3) if total_waits else 0.0,
+                    'p95': round(self._percentile(waits, 0.95), 3),
+                    'max': round(self.wait_ms_max, 3),
+                },
+                'connects': self.connects,
+                'connectErrors': self.connect_errors,
+                'connectMs': {
+                    'mean': round(self.connect_ms_total / self.connects, 3) if self.connects else 0.0,
+                    'p95': round(self._percentile(connects, 0.95), 3),
+                    'max': round(self.connect_ms_max, 3),
+                },
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that times how long callers block waiting for a connection"""
+
+    # Set per engine on a generated subclass so it survives pool.recreate()
+    metrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.record_wait((time.perf_counter() - start) * 1000, timed_out=True)
+            logger.error(f"❌ DB pool exhausted after {self._timeout}s wait: {self.status()}")
+            raise
+
+        wait_ms = (time.perf_counter() - start) * 1000
+        if self.metrics.record_wait(wait_ms):
+            logger.warning(f"⚠️  Slow DB pool checkout ({wait_ms:.1f} ms): {self.status()}")
+        return connection
+
+
+def create_db_engine(database_url=None, **overrides):
+    """
+    Create an instrumented engine.
+
+    Keyword overrides take precedence over engine_settings_from_env(), e.g.
+    create_db_engine(statement_timeout='300s') for long-running schema work.
+    """
+    database_url = database_url or os.getenv('DATABASE_URL')
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable not found!")
+
+    settings = engine_settings_from_env()
+    settings.update(overrides)
+
+    metrics = PoolMetrics(slow_checkout_ms=settings['slow_checkout_ms'])
+    pool_class = type('InstrumentedQueuePool', (InstrumentedQueuePool,), {'metrics': metrics})
+
+    connect_args = {
+        'connect_timeout': settings['connect_timeout'],
+        'application_name': settings['application_name'],
+    }
+    # SSL is mandatory on Neon
+    if is_neon_url(database_url):
+        connect_args['sslmode'] = 'require'
+    # Session defaults as startup options, so no transaction or pool rollback can undo them
+    set_timeouts_per_connection = is_pooler_url(database_url)
+    if not set_timeouts_per_connection:
+        connect_args['options'] = (f"-c statement_timeout={settings['statement_timeout']} "
+                                   f"-c lock_timeout={settings['lock_timeout']}")
+
+    engine = create_engine(
+        database_url,
+        poolclass=pool_class,
+        pool_size=settings['pool_size'],
+        max_overflow=settings['max_overflow'],
+        pool_timeout=settings['pool_timeout'],
+        pool_recycle=settings['pool_recycle'],
+        pool_pre_ping=settings['pool_pre_ping'],
+        connect_args=connect_args,
+    )
+    engine.pool_metrics = metrics
+
+    @event.listens_for(engine, "do_connect")
+    def timed_connect(dialect, connection_record, cargs, cparams):
+        start = time.perf_counter()
+        try:
+            dbapi_connection = dialect.connect(*cargs, **cparams)
+        except Exception:
+            metrics.record_connect(0.0, failed=True)
+            raise
+        metrics.record_connect((time.perf_counter() - start) * 1000)
+        return dbapi_connection
+
+    if set_timeouts_per_connection:
+        @event.listens_for(engine, "connect")
+        def set_session_timeouts(dbapi_connection, connection_record):
+            # Committed, otherwise the pool's rollback on return would undo the SETs
+            try:
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f"SET statement_timeout = '{settings['statement_timeout']}'")
+                    cursor.execute(f"SET lock_timeout = '{settings['lock_timeout']}'")
+                dbapi_connection.commit()
+            except Exception as e:
+                logger.warning(f"Could not set connection timeouts: {e}")
+
+    return engine
+
+
+def pool_status(engine):
+    """Point-in-time pool gauges plus cumulative wait/connect metrics"""
+    pool = engine.pool
+    status = {
+        'size': pool.size(),
+        'checkedIn': pool.checkedin(),
+        'checkedOut': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+        'maxOverflow': pool._max_overflow,
+        'timeoutSeconds': pool._timeout,
+    }
+    metrics = getattr(engine, 'pool_metrics', None)
+    if metrics is not None:
+        status.update(metrics.snapshot())
+    return status
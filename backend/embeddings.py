@@ -0,0 +1,166 @@
+# backend/embeddings.py
+"""
+Embedding providers.
+
+Every provider is a callable `embed(texts) -> (len(texts), dimensions) float32
+array`, which is what the vector index and the response cache similarity
+tier expect. EMBEDDING_PROVIDER selects the implementation:
+
+  * local  - HashingEmbeddingProvider: hashing-trick vectors computed with
+             NumPy, deterministic across processes and machines, no network.
+             Texts that share words land close together, so the semantic
+             cache and retrieval can be load-tested offline.
+  * openai - any OpenAI-compatible /embeddings endpoint, called in batches.
+
+Both produce EMBEDDING_DIMENSIONS (1536) vectors to match
+conversation_embeddings.embedding.
+"""
+
+import os
+import re
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMENSIONS = 1536
+
+_TOKEN = re.compile(r'\w+')
+
+
+class EmbeddingProvider:
+    """Interface: batch text -> unit-length float32 vectors"""
+
+    dimensions = EMBEDDING_DIMENSIONS
+    name = 'base'
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+    def __call__(self, texts):
+        return self.embed(texts)
+
+    def stats(self):
+        return {'provider': self.name, 'dimensions': self.dimensions}
+
+
+@lru_cache(maxsize=65536)
+def _feature_slot(feature, dimensions, seed):
+    """(index, sign) of a feature; blake2b keeps it stable, unlike the salted built-in hash()"""
+    digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8, salt=seed.to_bytes(8, 'little')).digest()
+    value = int.from_bytes(digest, 'little')
+    return value % dimensions, 1.0 if value >> 63 else -1.0
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Signed hashing trick over word unigrams, word bigrams and character
+    trigrams, L2-normalized. Equivalent to a sparse random projection of the
+    bag-of-features vector; lexical, not semantic, similarity.
+    """
+
+    name = 'local'
+
+    def __init__(self, dimensions=EMBEDDING_DIMENSIONS, seed=0, char_ngrams=3):
+        self.dimensions = dimensions
+        self.seed = seed
+        self.char_ngrams = char_ngrams
+        self.texts_embedded = 0
+
+    def features(self, content):
+        words = _TOKEN.findall(content.casefold())
+        features = [f'w:{word}' for word in words]
+        features += [f'b:{a} {b}' for a, b in zip(words, words[1:])]
+        if self.char_ngrams:
+            joined = f" {' '.join(words)} "
+            n = self.char_ngrams
+            features += [f'c:{joined[i:i + n]}' for i in range(len(joined) - n + 1)]
+        return features
+
+    def embed(self, texts):
+        rows, columns, signs = [], [], []
+        for row, content in enumerate(texts):
+            for feature in self.features(content):
+                column, sign = _feature_slot(feature, self.dimensions, self.seed)
+                rows.append(row)
+                columns.append(column)
+                signs.append(sign)
+
+        # One bincount over flattened (row, column) slots scatters the whole batch
+        flat = np.array(rows, dtype=np.int64) * self.dimensions + np.array(columns, dtype=np.int64)
+        vectors = np.bincount(flat, weights=signs, minlength=len(texts) * self.dimensions)
+        vectors = vectors.astype(np.float32).reshape(len(texts), self.dimensions)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        self.texts_embedded += len(texts)
+        return vectors
+
+    def stats(self):
+        return dict(super().stats(), textsEmbedded=self.texts_embedded, seed=self.seed)
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI-compatible /embeddings endpoint, requested in batches over one pooled session"""
+
+    name = 'openai'
+
+    def __init__(self, api_key, model='text-embedding-3-small', base_url='https://api.openai.com/v1',
+                 dimensions=EMBEDDING_DIMENSIONS, batch_size=256, timeout=30):
+        import requests
+
+        self.model = model
+        self.url = f"{base_url.rstrip('/')}/embeddings"
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.requests = 0
+        self._session = requests.Session()
+        self._session.headers['Authorization'] = f'Bearer {api_key}'
+
+    def embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self._session.post(self.url, timeout=self.timeout, json={
+                'model': self.model,
+                'input': list(texts[start:start + self.batch_size]),
+                'dimensions': self.dimensions,
+            })
+            response.raise_for_status()
+            self.requests += 1
+            data = sorted(response.json()['data'], key=lambda item: item['index'])
+            vectors.extend(item['embedding'] for item in data)
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dimensions)
+
+    def stats(self):
+        return dict(super().stats(), model=self.model, requests=self.requests)
+
+
+def embedding_provider_from_env():
+    """Provider selected by EMBEDDING_PROVIDER (local | openai)"""
+    provider = os.getenv('EMBEDDING_PROVIDER', 'local')
+    if provider == 'openai':
+        api_key = os.getenv('EMBEDDING_API_KEY') or os.getenv('OPENAI_API_KEY')
+        if api_key:
+            return OpenAIEmbeddingProvider(
+                api_key,
+                model=os.getenv('EMBEDDING_MODEL', 'text-embedding-3-small'),
+                base_url=os.getenv('EMBEDDING_API_URL', 'https://api.openai.com/v1'),
+            )
+        logger.warning("⚠️  EMBEDDING_PROVIDER=openai but no API key set; using local hashing embeddings")
+    return HashingEmbeddingProvider(seed=int(os.getenv('EMBEDDING_SEED', 0)))
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_embedding_provider():
+    """Process-wide embedding provider"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = embedding_provider_from_env()
+        return _provider
@@ -33,6 +33,7 @@ CREATE TABLE users (
     email VARCHAR(255) UNIQUE NOT NULL,
     username VARCHAR(100) UNIQUE NOT NULL,
     password_hash VARCHAR(255), -- For local auth
+    password_reset_required BOOLEAN NOT NULL DEFAULT FALSE, -- invite-pending: login refused until a password is set
     first_name VARCHAR(100) NOT NULL,
     last_name VARCHAR(100) NOT NULL,
     display_name VARCHAR(200),
@@ -330,6 +331,18 @@ CREATE TABLE conversation_embeddings (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Prompt embeddings for the response cache's similarity tier (response_cache.py)
+CREATE TABLE response_cache_embeddings (
+    id BIGSERIAL PRIMARY KEY,
+    scope CHAR(64) NOT NULL, -- hash of (tool, model settings)
+    tool VARCHAR(100),
+    prompt TEXT NOT NULL,
+    response TEXT NOT NULL,
+    embedding vector(1536) NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Memory checkpoints for conversation replay
 CREATE TABLE memory_checkpoints (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -893,6 +906,7 @@ CREATE TABLE ai_tools (
     
     -- Metadata
     tags TEXT[],
+    keywords TEXT[] DEFAULT '{}', -- routing phrases (tool_router.py)
     documentation_url TEXT,
     
     is_active BOOLEAN DEFAULT TRUE,
@@ -979,9 +993,9 @@ CREATE TABLE ai_budgets (
     daily_limit DECIMAL(10,2) DEFAULT 5.00,
     monthly_limit DECIMAL(10,2) DEFAULT 150.00,
     
-    -- Current usage
-    daily_usage DECIMAL(10,2) DEFAULT 0.00,
-    monthly_usage DECIMAL(10,2) DEFAULT 0.00,
+    -- Current usage (maintained in batches by the backend usage log writer)
+    daily_usage DECIMAL(12,6) DEFAULT 0.00,
+    monthly_usage DECIMAL(12,6) DEFAULT 0.00,
     
     -- Reset tracking
     daily_reset_at DATE NOT NULL DEFAULT CURRENT_DATE,
@@ -1545,6 +1559,7 @@ CREATE TABLE attendance_records (
 CREATE TABLE audit_logs (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     user_id UUID REFERENCES users(id),
+    institution_id UUID, -- copied from the user on insert (set_audit_institution)
     
     -- Action
     action VARCHAR(100) NOT NULL,
@@ -1595,6 +1610,11 @@ CREATE INDEX idx_users_username ON users(username);
 CREATE INDEX idx_users_role ON users(role);
 CREATE INDEX idx_users_institution ON users(institution_id);
 CREATE INDEX idx_users_status ON users(status);
+-- Keyset pagination of user listings on (created_at, id), optionally filtered
+CREATE INDEX idx_users_created_id ON users(created_at DESC, id DESC);
+CREATE INDEX idx_users_institution_created_id ON users(institution_id, created_at DESC, id DESC);
+CREATE INDEX idx_users_role_created_id ON users(role, created_at DESC, id DESC);
+CREATE INDEX idx_users_search_trgm ON users USING gin ((email || ' ' || first_name || ' ' || last_name) gin_trgm_ops);
 
 -- Authentication indexes
 CREATE INDEX idx_sessions_user ON user_sessions(user_id);
@@ -1606,6 +1626,11 @@ CREATE INDEX idx_conversations_user ON conversations(user_id);
 CREATE INDEX idx_messages_conversation ON conversation_messages(conversation_id);
 CREATE INDEX idx_messages_sequence ON conversation_messages(conversation_id, sequence_number);
 CREATE INDEX idx_embeddings_conversation ON conversation_embeddings(conversation_id);
+-- Approximate nearest-neighbour search (tune recall per query with hnsw.ef_search)
+CREATE INDEX idx_embeddings_ann ON conversation_embeddings USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+CREATE INDEX idx_response_cache_scope ON response_cache_embeddings(scope, expires_at);
+CREATE INDEX idx_response_cache_expires ON response_cache_embeddings(expires_at);
+CREATE INDEX idx_response_cache_ann ON response_cache_embeddings USING hnsw (embedding vector_cosine_ops);
 
 -- Google Workspace indexes
 CREATE INDEX idx_google_connections_user ON google_workspace_connections(user_id);
@@ -1650,6 +1675,7 @@ CREATE INDEX idx_metrics_period ON performance_metrics(period_start, period_end)
 CREATE INDEX idx_audit_user ON audit_logs(user_id);
 CREATE INDEX idx_audit_resource ON audit_logs(resource_type, resource_id);
 CREATE INDEX idx_audit_created ON audit_logs(created_at);
+CREATE INDEX idx_audit_institution_created ON audit_logs(institution_id, created_at DESC);
 
 -- =====================================================
 -- TRIGGERS
@@ -1681,6 +1707,46 @@ BEGIN
     END LOOP;
 END $$;
 
+-- Tool registry change tracking: workers poll the version or LISTEN on tool_registry_changed
+CREATE TABLE tool_registry_version (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    version BIGINT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO tool_registry_version (id) VALUES (TRUE);
+
+CREATE OR REPLACE FUNCTION bump_tool_registry_version()
+RETURNS TRIGGER AS $$
+DECLARE
+    new_version BIGINT;
+BEGIN
+    UPDATE tool_registry_version
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    RETURNING version INTO new_version;
+    PERFORM pg_notify('tool_registry_changed', new_version::text);
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER ai_tools_registry_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ai_tools
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_tool_registry_version();
+CREATE TRIGGER ai_agents_registry_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ai_agents
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_tool_registry_version();
+
+-- Audit rows carry the acting user's institution for per-institution activity feeds
+CREATE OR REPLACE FUNCTION set_audit_institution()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.institution_id IS NULL AND NEW.user_id IS NOT NULL THEN
+        SELECT institution_id INTO NEW.institution_id FROM users WHERE id = NEW.user_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE TRIGGER audit_logs_institution BEFORE INSERT ON audit_logs
+    FOR EACH ROW EXECUTE FUNCTION set_audit_institution();
+
 -- Enrollment count trigger
 CREATE OR REPLACE FUNCTION update_enrollment_count()
 RETURNS TRIGGER AS $$
@@ -1710,55 +1776,10 @@ CREATE TRIGGER update_enrollment_count_trigger
 AFTER INSERT OR UPDATE OR DELETE ON enrollments
 FOR EACH ROW EXECUTE FUNCTION update_enrollment_count();
 
--- AI budget tracking trigger
-CREATE OR REPLACE FUNCTION track_ai_budget()
-RETURNS TRIGGER AS $$
-DECLARE
-    current_daily_usage DECIMAL(10,2);
-    current_monthly_usage DECIMAL(10,2);
-    budget_record ai_budgets%ROWTYPE;
-BEGIN
-    -- Get or create budget record for user
-    SELECT * INTO budget_record 
-    FROM ai_budgets 
-    WHERE entity_type = 'user' AND entity_id = NEW.user_id;
-    
-    IF NOT FOUND THEN
-        INSERT INTO ai_budgets (entity_type, entity_id)
-        VALUES ('user', NEW.user_id)
-        RETURNING * INTO budget_record;
-    END IF;
-    
-    -- Check if we need to reset daily/monthly usage
-    IF budget_record.daily_reset_at < CURRENT_DATE THEN
-        UPDATE ai_budgets 
-        SET daily_usage = 0, daily_reset_at = CURRENT_DATE
-        WHERE id = budget_record.id;
-        budget_record.daily_usage := 0;
-    END IF;
-    
-    IF budget_record.monthly_reset_at < DATE_TRUNC('month', CURRENT_DATE)::DATE THEN
-        UPDATE ai_budgets 
-        SET monthly_usage = 0, monthly_reset_at = DATE_TRUNC('month', CURRENT_DATE)::DATE
-        WHERE id = budget_record.id;
-        budget_record.monthly_usage := 0;
-    END IF;
-    
-    -- Update usage
-    UPDATE ai_budgets 
-    SET daily_usage = daily_usage + NEW.cost,
-        monthly_usage = monthly_usage + NEW.cost
-    WHERE id = budget_record.id;
-    
-    RETURN NEW;
-END;
-$$ language 'plpgsql';
-
-CREATE TRIGGER track_ai_budget_trigger
-AFTER INSERT ON ai_usage_logs
-FOR EACH ROW 
-WHEN (NEW.cost IS NOT NULL AND NEW.cost > 0)
-EXECUTE FUNCTION track_ai_budget();
+-- AI budget tracking
+-- Usage is applied to ai_budgets by the backend's batched usage log writer
+-- (one aggregated upsert per flush) rather than a per-row trigger, which
+-- serialized every ai_usage_logs insert on the user's budget row.
 
 -- =====================================================
 -- INITIAL DATA
@@ -0,0 +1,219 @@
+# backend/health.py
+"""
+Health subsystem: cheap liveness plus cached, bounded readiness probes.
+
+Readiness probes run at most once per TTL no matter how often the load
+balancer polls, each with its own timeout. The database probe uses a
+dedicated single-connection engine so health checks never take a slot from
+the serving pool.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime
+import requests
+from flask import Blueprint, jsonify
+from sqlalchemy import text
+from db_engine import create_db_engine
+from llm_limiter import limiter_stats
+from llm_providers import PROVIDERS, client_pool, provider_settings
+
+logger = logging.getLogger(__name__)
+
+# Create Blueprint
+health_bp = Blueprint('health', __name__, url_prefix='/api/health')
+
+STARTED_AT = time.time()
+
+
+class HealthProbe:
+    """A dependency check whose result is cached for `ttl` seconds"""
+
+    def __init__(self, name, check, ttl=5.0, timeout=2.0, critical=False):
+        self.name = name
+        self.check = check
+        self.ttl = ttl
+        self.timeout = timeout
+        self.critical = critical
+        self._refresh_lock = threading.Lock()
+        self._result = {'status': 'unknown', 'latencyMs': None, 'checkedAt': None}
+        self._expires_at = 0.0
+
+    @property
+    def cached_result(self):
+        """Last result without triggering a refresh"""
+        return self._result
+
+    def result(self, executor):
+        """Return the cached result, refreshing it if stale"""
+        if time.monotonic() < self._expires_at:
+            return self._result
+
+        # Only one caller refreshes; everyone else gets the previous result
+        if not self._refresh_lock.acquire(blocking=False):
+            return self._result
+        try:
+            self._result = self._run(executor)
+            self._expires_at = time.monotonic() + self.ttl
+        finally:
+            self._refresh_lock.release()
+        return self._result
+
+    def _run(self, executor):
+        start = time.perf_counter()
+        result = {'status': 'up', 'checkedAt': datetime.utcnow().isoformat() + 'Z'}
+        try:
+            detail = executor.submit(self.check, self.timeout).result(timeout=self.timeout)
+            if detail:
+                result.update(detail)
+        except FutureTimeoutError:
+            result.update({'status': 'down', 'error': f'timed out after {self.timeout}s'})
+        except Exception as e:
+            result.update({'status': 'down', 'error': str(e)})
+        result['latencyMs'] = round((time.perf_counter() - start) * 1000, 2)
+        return result
+
+
+class HealthMonitor:
+    """Aggregates probes into liveness and readiness reports"""
+
+    def __init__(self, probes):
+        self.probes = probes
+        self._executor = ThreadPoolExecutor(max_workers=max(len(probes), 1), thread_name_prefix='health')
+
+    def liveness(self):
+        """No I/O: the process is up and able to answer"""
+        return {
+            'status': 'alive',
+            'uptimeSeconds': round(time.time() - STARTED_AT, 1),
+        }
+
+    def readiness(self):
+        checks = {probe.name: probe.result(self._executor) for probe in self.probes}
+        critical_down = any(
+            checks[probe.name]['status'] == 'down' for probe in self.probes if probe.critical
+        )
+        degraded = any(check['status'] == 'down' for check in checks.values())
+
+        if critical_down:
+            status = 'unavailable'
+        elif degraded:
+            status = 'degraded'
+        else:
+            status = 'ready'
+        return {'status': status, 'ready': not critical_down, 'checks': checks}
+
+    def availability(self):
+        """Percentage of configured dependencies up, from cached results only (never probes)"""
+        checks = [p.cached_result for p in self.probes if p.cached_result['status'] not in ('unknown', 'not_configured')]
+        if not checks:
+            return 100.0
+        return round(100.0 * sum(1 for c in checks if c['status'] == 'up') / len(checks), 1)
+
+
+# =====================================================
+# DEPENDENCY CHECKS
+# =====================================================
+
+_probe_engine = None
+_probe_engine_lock = threading.Lock()
+
+
+def _get_probe_engine(timeout):
+    """Single-connection engine reserved for health checks"""
+    global _probe_engine
+    with _probe_engine_lock:
+        if _probe_engine is None:
+            _probe_engine = create_db_engine(
+                pool_size=1,
+                max_overflow=0,
+                pool_timeout=timeout,
+                connect_timeout=max(int(timeout), 1),
+                statement_timeout=f'{int(timeout * 1000)}ms',
+                application_name='academic_ai_health',
+            )
+        return _probe_engine
+
+
+def check_database(timeout):
+    with _get_probe_engine(timeout).connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+def _check_http(url, timeout, headers=None):
+    response = requests.get(url, headers=headers or {}, timeout=timeout)
+    # Any non-5xx answer means the dependency is reachable
+    if response.status_code >= 500:
+        raise RuntimeError(f"HTTP {response.status_code}")
+    return {'httpStatus': response.status_code}
+
+
+def check_llm_provider(timeout):
+    """GET {LLM_BASE_URL}/models on the configured provider's pooled client"""
+    provider, base_url, api_key = provider_settings()
+    if PROVIDERS[provider][1] and not api_key:
+        return {'status': 'not_configured', 'provider': provider}
+    headers = {'Authorization': f'Bearer {api_key}'} if api_key else {}
+    response = client_pool.client(base_url).get('/models', headers=headers, timeout=timeout)
+    # Any non-5xx answer means the provider is reachable
+    if response.status_code >= 500:
+        raise RuntimeError(f"HTTP {response.status_code}")
+    return {'httpStatus': response.status_code, 'provider': provider}
+
+
+def check_mcp_server(timeout):
+    url = os.getenv('MCP_SERVER_URL')
+    if not url:
+        return {'status': 'not_configured'}
+    return _check_http(url, timeout)
+
+
+def build_health_monitor():
+    timeout = float(os.getenv('HEALTH_PROBE_TIMEOUT', 2))
+    ttl = float(os.getenv('HEALTH_PROBE_TTL', 5))
+    return HealthMonitor([
+        HealthProbe('database', check_database, ttl=ttl, timeout=timeout, critical=True),
+        # External APIs are polled less often so health checks don't burn quota
+        HealthProbe('llm_provider', check_llm_provider, ttl=max(ttl, 30), timeout=timeout),
+        HealthProbe('mcp_server', check_mcp_server, ttl=ttl, timeout=timeout),
+    ])
+
+
+monitor = build_health_monitor()
+
+
+# =====================================================
+# ROUTES
+# =====================================================
+
+@health_bp.route('', methods=['GET'])
+def health_check():
+    """Detailed health check (readiness with per-dependency latency)"""
+    report = monitor.readiness()
+    checks = report['checks']
+    return jsonify({
+        "status": "healthy" if report['ready'] else "unhealthy",
+        "services": {
+            "flask": "running",
+            "llm_provider": checks['llm_provider']['status'],
+            "database": "connected" if checks['database']['status'] == 'up' else "disconnected",
+            "mcp_server": checks['mcp_server']['status'],
+        },
+        "checks": checks,
+        # Adaptive limit, queue depth and circuit state per provider/model
+        "upstream": limiter_stats()
+    }), 200 if report['ready'] else 503
+
+
+@health_bp.route('/live', methods=['GET'])
+def liveness():
+    return jsonify(monitor.liveness()), 200
+
+
+@health_bp.route('/ready', methods=['GET'])
+def readiness():
+    report = monitor.readiness()
+    return jsonify(report), 200 if report['ready'] else 503
@@ -0,0 +1,135 @@
+# backend/institutions.py
+"""
+In-process email domain -> institution directory.
+
+Loaded in full at startup (institutions are few and rarely change) and
+reloaded every INSTITUTION_CACHE_TTL seconds. A domain missing from the
+snapshot falls through to one indexed query, so institutions created by
+another worker are picked up on first use; institutions created here are
+added as soon as their transaction commits. Domains the database does not
+know are remembered for INSTITUTION_NEGATIVE_TTL seconds, and when the
+snapshot expires one caller reloads it while the rest keep reading the old
+one.
+"""
+
+import os
+import time
+import logging
+import threading
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+class InstitutionDirectory:
+    """Thread-safe domain -> {'id', 'name'} map over the institutions table"""
+
+    def __init__(self, engine, ttl=300.0, negative_ttl=60.0):
+        self.engine = engine
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._by_domain = {}
+        self._missing = {}  # domain -> monotonic time the negative entry expires
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    def load(self):
+        """Replace the snapshot with every institution"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(text("SELECT CAST(id AS TEXT), name, lower(domain) FROM institutions")).fetchall()
+        snapshot = {domain: {'id': institution_id, 'name': name} for institution_id, name, domain in rows}
+        with self._lock:
+            self._by_domain = snapshot
+            self._missing = {domain: expires for domain, expires in self._missing.items() if domain not in snapshot}
+            self._loaded_at = time.monotonic()
+        logger.info(f"🏫 Loaded {len(snapshot)} institution domains")
+        return len(snapshot)
+
+    def lookup(self, domain):
+        """Institution for an email domain, or None"""
+        domain = domain.lower()
+        now = time.monotonic()
+        # Only one caller reloads; the others keep serving the current snapshot meanwhile
+        if now - self._loaded_at > self.ttl and self._reload_lock.acquire(blocking=False):
+            try:
+                if time.monotonic() - self._loaded_at > self.ttl:
+                    self.load()
+            except Exception as e:
+                logger.warning(f"⚠️  Institution directory reload failed: {e}")
+            finally:
+                self._reload_lock.release()
+
+        with self._lock:
+            institution = self._by_domain.get(domain)
+            if institution is not None:
+                self.hits += 1
+                return institution
+            if self._missing.get(domain, 0.0) > now:
+                self.negative_hits += 1
+                return None
+            self.misses += 1
+
+        with self.engine.connect() as conn:
+            row = conn.execute(text(
+                "SELECT CAST(id AS TEXT), name FROM institutions WHERE lower(domain) = :domain"
+            ), {'domain': domain}).fetchone()
+        if row is None:
+            with self._lock:
+                self._missing[domain] = time.monotonic() + self.negative_ttl
+            return None
+        return self.add(row[0], row[1], domain)
+
+    def lookup_many(self, domains):
+        """Resolve a set of domains once each; unknown domains are left out"""
+        resolved = {}
+        for domain in set(d.lower() for d in domains):
+            institution = self.lookup(domain)
+            if institution is not None:
+                resolved[domain] = institution
+        return resolved
+
+    def add(self, institution_id, name, domain):
+        """Record an institution (call after the creating transaction commits)"""
+        institution = {'id': str(institution_id), 'name': name}
+        with self._lock:
+            self._by_domain[domain.lower()] = institution
+            self._missing.pop(domain.lower(), None)
+        return institution
+
+    def invalidate(self, domain=None):
+        """Forget one domain, or everything (forces a reload on next lookup)"""
+        with self._lock:
+            if domain is None:
+                self._by_domain = {}
+                self._missing = {}
+                self._loaded_at = 0.0
+            else:
+                self._by_domain.pop(domain.lower(), None)
+                self._missing.pop(domain.lower(), None)
+
+    def stats(self):
+        with self._lock:
+            return {'domains': len(self._by_domain), 'hits': self.hits, 'misses': self.misses,
+                    'negativeHits': self.negative_hits, 'knownMissing': len(self._missing)}
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_institution_directory():
+    """Process-wide directory over the shared engine"""
+    global _directory
+    with _directory_lock:
+        if _directory is None:
+            from models import engine
+            _directory = InstitutionDirectory(
+                engine,
+                ttl=float(os.getenv('INSTITUTION_CACHE_TTL', 300)),
+                negative_ttl=float(os.getenv('INSTITUTION_NEGATIVE_TTL', 60)),
+            )
+        return _directory
@@ -0,0 +1,102 @@
+# backend/llm.py
+"""
+Shared LLM helpers: chat model construction, token/cost accounting and
+Server-Sent Events framing for streamed completions.
+"""
+
+import os
+import json
+import time
+from functools import lru_cache
+
+DEFAULT_MODEL = os.getenv('LLM_MODEL', 'mistral-saba-24b')
+DEFAULT_TEMPERATURE = float(os.getenv('LLM_TEMPERATURE', 0.7))
+
+# USD per 1K (prompt, completion) tokens
+MODEL_PRICING = {
+    'mistral-saba-24b': (0.00079, 0.00079),
+    'llama-3.1-8b-instant': (0.00005, 0.00008),
+    'llama-3.3-70b-versatile': (0.00059, 0.00079),
+}
+
+
+@lru_cache(maxsize=8)
+def get_chat_model(model=None, temperature=None, priority='interactive'):
+    """
+    LangChain chat model for LLM_PROVIDER (groq | openai | stub); HTTP clients
+    are pooled per provider. Background work passes priority='batch' so it
+    queues behind interactive chat in the upstream limiter.
+    """
+    from llm_providers import create_chat_model
+
+    return create_chat_model(
+        model or DEFAULT_MODEL,
+        DEFAULT_TEMPERATURE if temperature is None else temperature,
+        priority=priority,
+    )
+
+
+def estimate_tokens(content):
+    """Cheap token estimate (~4 characters per token) for budgeting"""
+    return max(1, len(content) // 4)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prompt_rate, completion_rate = MODEL_PRICING.get(model, (
+        float(os.getenv('LLM_PRICE_PER_1K_PROMPT', 0.001)),
+        float(os.getenv('LLM_PRICE_PER_1K_COMPLETION', 0.002)),
+    ))
+    return round(prompt_tokens / 1000 * prompt_rate + completion_tokens / 1000 * completion_rate, 6)
+
+
+class UsageMeter:
+    """Accumulates a (possibly streamed) completion and reports its usage"""
+
+    def __init__(self, model, prompt):
+        self.model = model
+        self.prompt_tokens = estimate_tokens(prompt)
+        self.reported = None
+        self.parts = []
+        self.started = time.perf_counter()
+
+    def add(self, chunk):
+        """Record a streamed chunk and return its text"""
+        content = chunk.content if hasattr(chunk, 'content') else str(chunk)
+        self.parts.append(content)
+        # Providers that report real usage attach it to (usually) the last chunk
+        usage = getattr(chunk, 'usage_metadata', None)
+        if not usage:
+            # OpenAI-style counts from llm_providers.OpenAICompatibleChat
+            token_usage = (getattr(chunk, 'response_metadata', None) or {}).get('token_usage')
+            if token_usage:
+                usage = {'input_tokens': token_usage.get('prompt_tokens', self.prompt_tokens),
+                         'output_tokens': token_usage.get('completion_tokens', 0)}
+        if usage:
+            self.reported = usage
+        return content
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
+
+    def summary(self):
+        if self.reported:
+            prompt_tokens = self.reported.get('input_tokens', self.prompt_tokens)
+            completion_tokens = self.reported.get('output_tokens', 0)
+        else:
+            prompt_tokens = self.prompt_tokens
+            completion_tokens = estimate_tokens(self.text) if self.parts else 0
+        return {
+            'model': self.model,
+            'promptTokens': prompt_tokens,
+            'completionTokens': completion_tokens,
+            'totalTokens': prompt_tokens + completion_tokens,
+            'cost': estimate_cost(self.model, prompt_tokens, completion_tokens),
+            'executionTimeMs': int((time.perf_counter() - self.started) * 1000),
+        }
+
+
+def sse_event(payload, event=None):
+    """Format one Server-Sent Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(payload)}\n\n"
@@ -0,0 +1,403 @@
+# backend/llm_limiter.py
+"""
+Adaptive concurrency limiting, retries and circuit breaking for upstream LLM calls.
+
+Each provider/model pair gets an AdaptiveLimiter:
+
+  * AIMD limit - grows by ~1 per limit's worth of successful calls while
+    callers are actually saturating it, and is cut by LLM_LIMIT_BACKOFF
+    (at most once per second) on 429s, 5xx and timeouts, so a brownout
+    sheds concurrency instead of piling up blocked workers.
+  * Priority queues - callers over the limit wait in per-priority FIFO
+    queues; interactive chat is always admitted before batch work
+    (summaries, imports). Queues are bounded in length and wait time.
+  * Retries - overload errors are retried with full-jitter exponential
+    backoff (honouring Retry-After), re-acquiring a slot per attempt.
+    Streams are only retried before their first token.
+  * Circuit breaker - after LLM_BREAKER_FAILURES consecutive overload
+    errors calls fail fast for LLM_BREAKER_COOLDOWN seconds, then a single
+    probe decides whether to close it again.
+
+Works from threads (Flask) and coroutines (FastAPI); state is in stats().
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+import httpx
+
+PRIORITIES = ('interactive', 'batch')
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class LimiterRejected(RuntimeError):
+    """The call was not admitted (queue full, queue timeout or open circuit)"""
+
+    status_code = 503
+
+
+class CircuitOpenError(LimiterRejected):
+    """The provider's circuit breaker is open"""
+
+
+def is_overload(error):
+    """429s, 5xx, timeouts and connection failures mean the upstream is struggling"""
+    status = getattr(error, 'status_code', None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError, TimeoutError))
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker; not thread-safe on its own (guarded by the limiter lock)"""
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.trips = 0
+
+    def allow(self, now):
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def on_success(self):
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.probing = False
+
+    def on_failure(self, now):
+        """Record an overload failure; returns True if this opened the circuit"""
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            opened = self.state != OPEN
+            self.state = OPEN
+            self.opened_at = now
+            self.probing = False
+            self.trips += opened
+            return opened
+        return False
+
+    def on_ignored(self):
+        # A half-open probe that ended without a verdict lets the next call probe
+        self.probing = False
+
+
+class _Waiter:
+    __slots__ = ('priority', 'granted', 'cancelled', 'error', '_event', '_loop', '_future')
+
+    def __init__(self, priority, loop=None):
+        self.priority = priority
+        self.granted = False
+        self.cancelled = False
+        self.error = None
+        self._loop = loop
+        self._event = None if loop else threading.Event()
+        self._future = loop.create_future() if loop else None
+
+    def _wake(self):
+        if self._loop is None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(lambda: self._future.done() or self._future.set_result(None))
+
+    def grant(self):
+        self.granted = True
+        self._wake()
+
+    def reject(self, error):
+        self.error = error
+        self._wake()
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with priority queues, retries and a circuit breaker"""
+
+    def __init__(self, name, initial_limit=16, min_limit=1, max_limit=256, backoff=0.7,
+                 max_queue=1000, queue_timeout=30.0, max_retries=3, base_delay=0.5, max_delay=20.0,
+                 breaker=None):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self._queues = {priority: deque() for priority in PRIORITIES}
+        self._lock = threading.Lock()
+        self._last_decrease = 0.0
+        self.latency_ewma = None
+        self.counts = {'success': 0, 'overload': 0, 'retries': 0, 'rejected': 0, 'timeouts': 0}
+
+    # ----- admission -----
+
+    def _admit_locked(self, priority):
+        if not self.breaker.allow(time.monotonic()):
+            self.counts['rejected'] += 1
+            raise CircuitOpenError(f"Circuit open for {self.name}; retry in {self.breaker.cooldown:.0f}s")
+        ahead = any(self._queues[p] for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        if not ahead and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return None
+        if sum(len(queue) for queue in self._queues.values()) >= self.max_queue:
+            self.counts['rejected'] += 1
+            raise LimiterRejected(f"{self.name} queue is full")
+        return priority
+
+    def _dispatch_locked(self):
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self.in_flight < int(self.limit):
+                waiter = queue.popleft()
+                if not waiter.cancelled:
+                    self.in_flight += 1
+                    waiter.grant()
+
+    def _reject_queued_locked(self, error):
+        for queue in self._queues.values():
+            while queue:
+                queue.popleft().reject(error)
+
+    def _abandon_locked(self, waiter):
+        """Waiter gave up; returns True if it had already been granted a slot"""
+        if waiter.granted:
+            return True
+        waiter.cancelled = True
+        if waiter in self._queues[waiter.priority]:
+            self._queues[waiter.priority].remove(waiter)
+        self.counts['timeouts'] += 1
+        return False
+
+    def acquire(self, priority='interactive'):
+        with self._lock:
+            queued = self._admit_locked(priority)
+            if queued is None:
+                return
+            waiter = _Waiter(priority)
+            self._queues[priority].append(waiter)
+        waiter._event.wait(self.queue_timeout)
+        with self._lock:
+            if waiter.error is not None:
+                raise waiter.error
+            if self._abandon_locked(waiter):
+                return
+        raise LimiterRejected(f"Waited {self.queue_timeout:.0f}s for a {self.name} slot")
+
+    async def acquire_async(self, priority='interactive'):
+        with self._lock:
+            queued = self._admit_locked(priority)
+            if queued is None:
+                return
+            waiter = _Waiter(priority, loop=asyncio.get_running_loop())
+            self._queues[priority].append(waiter)
+        try:
+            await asyncio.wait_for(waiter._future, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                granted = self._abandon_locked(waiter)
+            if granted:
+                # Granted just as we gave up: hand the slot back
+                self.release('ignored')
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise LimiterRejected(f"Waited {self.queue_timeout:.0f}s for a {self.name} slot")
+        if waiter.error is not None:
+            raise waiter.error
+
+    def release(self, outcome, latency=None):
+        """Return a slot; outcome is 'success', 'overload' or 'ignored' (neither signal)"""
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            if outcome == 'success':
+                self.counts['success'] += 1
+                self.breaker.on_success()
+                # Additive increase, only while the limit is actually what holds callers back
+                if self.in_flight + 1 >= int(self.limit):
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                if latency is not None:
+                    self.latency_ewma = latency if self.latency_ewma is None else 0.9 * self.latency_ewma + 0.1 * latency
+            elif outcome == 'overload':
+                self.counts['overload'] += 1
+                if now - self._last_decrease >= 1.0:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+                if self.breaker.on_failure(now):
+                    self._reject_queued_locked(CircuitOpenError(f"Circuit opened for {self.name}"))
+            else:
+                self.breaker.on_ignored()
+            self._dispatch_locked()
+
+    # ----- calls with retries -----
+
+    def retry_delay(self, attempt, error):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after:
+            delay = max(delay, min(float(retry_after), self.max_delay))
+        return delay
+
+    def _should_retry(self, error, attempt):
+        if is_overload(error) and attempt < self.max_retries:
+            with self._lock:
+                self.counts['retries'] += 1
+            return True
+        return False
+
+    def call(self, fn, priority='interactive'):
+        attempt = 0
+        while True:
+            self.acquire(priority)
+            start = time.monotonic()
+            try:
+                result = fn()
+            except Exception as e:
+                self.release('overload' if is_overload(e) else 'ignored')
+                if not self._should_retry(e, attempt):
+                    raise
+                time.sleep(self.retry_delay(attempt, e))
+                attempt += 1
+                continue
+            self.release('success', time.monotonic() - start)
+            return result
+
+    async def acall(self, fn, priority='interactive'):
+        attempt = 0
+        while True:
+            await self.acquire_async(priority)
+            start = time.monotonic()
+            try:
+                result = await fn()
+            except Exception as e:
+                self.release('overload' if is_overload(e) else 'ignored')
+                if not self._should_retry(e, attempt):
+                    raise
+                await asyncio.sleep(self.retry_delay(attempt, e))
+                attempt += 1
+                continue
+            except BaseException:
+                self.release('ignored')
+                raise
+            self.release('success', time.monotonic() - start)
+            return result
+
+    def stream(self, open_stream, priority='interactive'):
+        """Yield from open_stream() holding one slot; retried only before the first item"""
+        attempt = 0
+        while True:
+            self.acquire(priority)
+            start = time.monotonic()
+            outcome, first_item_at, error = 'ignored', None, None
+            chunks = open_stream()
+            try:
+                for item in chunks:
+                    if first_item_at is None:
+                        first_item_at = time.monotonic()
+                    yield item
+                outcome = 'success'
+            except Exception as e:
+                outcome, error = ('overload' if is_overload(e) else 'ignored'), e
+                if first_item_at is not None or not self._should_retry(e, attempt):
+                    raise
+            finally:
+                chunks.close()
+                self.release(outcome, first_item_at - start if first_item_at else None)
+            if error is None:
+                return
+            time.sleep(self.retry_delay(attempt, error))
+            attempt += 1
+
+    async def astream(self, open_stream, priority='interactive'):
+        attempt = 0
+        while True:
+            await self.acquire_async(priority)
+            start = time.monotonic()
+            outcome, first_item_at, error = 'ignored', None, None
+            chunks = open_stream()
+            try:
+                async for item in chunks:
+                    if first_item_at is None:
+                        first_item_at = time.monotonic()
+                    yield item
+                outcome = 'success'
+            except Exception as e:
+                outcome, error = ('overload' if is_overload(e) else 'ignored'), e
+                if first_item_at is not None or not self._should_retry(e, attempt):
+                    raise
+            finally:
+                await chunks.aclose()
+                self.release(outcome, first_item_at - start if first_item_at else None)
+            if error is None:
+                return
+            await asyncio.sleep(self.retry_delay(attempt, error))
+            attempt += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'limit': round(self.limit, 2),
+                'inFlight': self.in_flight,
+                'queued': {priority: len(queue) for priority, queue in self._queues.items()},
+                'circuit': self.breaker.state,
+                'circuitTrips': self.breaker.trips,
+                'consecutiveFailures': self.breaker.consecutive_failures,
+                'latencyMs': round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+                **self.counts,
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_from_env(name):
+    return AdaptiveLimiter(
+        name,
+        initial_limit=int(os.getenv('LLM_LIMIT_INITIAL', 16)),
+        min_limit=int(os.getenv('LLM_LIMIT_MIN', 1)),
+        max_limit=int(os.getenv('LLM_LIMIT_MAX', 256)),
+        backoff=float(os.getenv('LLM_LIMIT_BACKOFF', 0.7)),
+        max_queue=int(os.getenv('LLM_QUEUE_MAX', 1000)),
+        queue_timeout=float(os.getenv('LLM_QUEUE_TIMEOUT', 30)),
+        max_retries=int(os.getenv('LLM_MAX_RETRIES', 3)),
+        base_delay=float(os.getenv('LLM_RETRY_BASE_DELAY', 0.5)),
+        max_delay=float(os.getenv('LLM_RETRY_MAX_DELAY', 20)),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv('LLM_BREAKER_FAILURES', 5)),
+            cooldown=float(os.getenv('LLM_BREAKER_COOLDOWN', 30)),
+        ),
+    )
+
+
+def get_limiter(provider, model):
+    """Process-wide limiter for one provider/model pair"""
+    name = f"{provider}:{model}"
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = limiter_from_env(name)
+        return _limiters[name]
+
+
+def limiter_stats():
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.stats() for limiter in limiters}
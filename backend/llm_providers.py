@@ -0,0 +1,263 @@
+# backend/llm_providers.py
+"""
+LLM provider layer over OpenAI-compatible chat completion APIs.
+
+Groq, OpenAI and the local stub server (llm_stub_server.py) all speak the
+same /chat/completions protocol, so one LangChain chat model serves them
+all; a provider is just a base URL and an API key variable. HTTP clients
+are pooled per base URL and process (keep-alive connections are reused
+across requests and chains) with separate connect/read timeouts, so a hung
+upstream fails the request instead of pinning a worker, and every call is
+admitted, retried and circuit-broken by the provider/model's llm_limiter.
+The provider's token usage (streams ask for it with stream_options) is passed
+on as response_metadata['token_usage'], where llm.UsageMeter picks it up.
+"""
+
+import os
+import json
+import threading
+from typing import Iterator, AsyncIterator, Optional
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from llm_limiter import get_limiter
+
+# name -> (default base URL, API key variable)
+PROVIDERS = {
+    'groq': ('https://api.groq.com/openai/v1', 'GROQ_API_KEY'),
+    'openai': ('https://api.openai.com/v1', 'OPENAI_API_KEY'),
+    'stub': ('http://127.0.0.1:8089/v1', None),
+}
+
+# LangChain message.type -> chat completions role
+ROLES = {'human': 'user', 'ai': 'assistant', 'system': 'system', 'tool': 'tool', 'function': 'function'}
+
+
+class UpstreamError(RuntimeError):
+    """Non-2xx response from the provider"""
+
+    def __init__(self, provider, status_code, message, retry_after=None):
+        super().__init__(f"{provider} returned {status_code}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def timeout_from_env():
+    return httpx.Timeout(
+        connect=float(os.getenv('LLM_CONNECT_TIMEOUT', 5)),
+        read=float(os.getenv('LLM_READ_TIMEOUT', 60)),
+        write=float(os.getenv('LLM_WRITE_TIMEOUT', 10)),
+        pool=float(os.getenv('LLM_POOL_TIMEOUT', 10)),
+    )
+
+
+def limits_from_env():
+    return httpx.Limits(
+        max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', 100)),
+        max_keepalive_connections=int(os.getenv('LLM_MAX_KEEPALIVE', 20)),
+        keepalive_expiry=float(os.getenv('LLM_KEEPALIVE_EXPIRY', 30)),
+    )
+
+
+class ClientPool:
+    """One sync and one async httpx client per base URL, created on first use"""
+
+    def __init__(self):
+        self._sync = {}
+        self._async = {}
+        self._lock = threading.Lock()
+
+    def client(self, base_url):
+        with self._lock:
+            if base_url not in self._sync:
+                self._sync[base_url] = httpx.Client(base_url=base_url, timeout=timeout_from_env(),
+                                                    limits=limits_from_env())
+            return self._sync[base_url]
+
+    def async_client(self, base_url):
+        with self._lock:
+            if base_url not in self._async:
+                self._async[base_url] = httpx.AsyncClient(base_url=base_url, timeout=timeout_from_env(),
+                                                          limits=limits_from_env())
+            return self._async[base_url]
+
+    def close(self):
+        with self._lock:
+            for client in self._sync.values():
+                client.close()
+            self._sync.clear()
+            # Async clients are dropped; their connections close with the event loop
+
+    def stats(self):
+        with self._lock:
+            return {'syncClients': list(self._sync), 'asyncClients': list(self._async)}
+
+
+client_pool = ClientPool()
+
+
+def check_response(provider, response):
+    if response.status_code < 400:
+        return
+    body = response.read() if hasattr(response, 'read') else b''
+    try:
+        message = json.loads(body)['error']['message']
+    except (ValueError, KeyError, TypeError):
+        message = body[:200].decode('utf-8', 'replace') if body else response.reason_phrase
+    try:
+        retry_after = float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        retry_after = None
+    raise UpstreamError(provider, response.status_code, message, retry_after=retry_after)
+
+
+async def acheck_response(provider, response):
+    if response.status_code >= 400:
+        await response.aread()
+        check_response(provider, response)
+
+
+def parse_stream_line(line):
+    """(delta text, usage) of one SSE `data:` line; (None, None) for keep-alives and [DONE]"""
+    if not line.startswith('data:'):
+        return None, None
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return None, None
+    event = json.loads(data)
+    choices = event.get('choices') or [{}]
+    # Usage arrives on the final chunk; Groq also reports it under x_groq
+    usage = event.get('usage') or (event.get('x_groq') or {}).get('usage')
+    return choices[0].get('delta', {}).get('content'), usage
+
+
+class OpenAICompatibleChat(BaseChatModel):
+    """Chat model for any OpenAI-compatible /chat/completions endpoint"""
+
+    model_name: str = 'mistral-saba-24b'
+    temperature: float = 0.7
+    max_tokens: Optional[int] = None
+    provider: str = 'groq'
+    base_url: str = PROVIDERS['groq'][0]
+    api_key: Optional[str] = None
+    priority: str = 'interactive'  # llm_limiter queue: 'interactive' or 'batch'
+
+    @property
+    def _llm_type(self):
+        return 'openai-compatible'
+
+    @property
+    def _identifying_params(self):
+        return {'provider': self.provider, 'model_name': self.model_name, 'temperature': self.temperature}
+
+    def _request(self, messages, stop, stream, **kwargs):
+        payload = {
+            'model': self.model_name,
+            'messages': [{'role': ROLES.get(m.type, 'user'), 'content': m.content} for m in messages],
+            'temperature': self.temperature,
+            'stream': stream,
+        }
+        if stream:
+            payload['stream_options'] = {'include_usage': True}
+        if self.max_tokens:
+            payload['max_tokens'] = self.max_tokens
+        if stop:
+            payload['stop'] = stop
+        payload.update(kwargs)
+        headers = {'Authorization': f'Bearer {self.api_key}'} if self.api_key else {}
+        return payload, headers
+
+    def _result(self, data):
+        message = data['choices'][0]['message']
+        usage = data.get('usage') or {}
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(
+                content=message.get('content') or '',
+                response_metadata={'token_usage': usage, 'model_name': self.model_name},
+            ))],
+            llm_output={'token_usage': usage, 'model_name': self.model_name},
+        )
+
+    def _chunk(self, content, usage):
+        metadata = {'token_usage': usage, 'model_name': self.model_name} if usage else {}
+        return ChatGenerationChunk(message=AIMessageChunk(content=content, response_metadata=metadata))
+
+    @property
+    def limiter(self):
+        return get_limiter(self.provider, self.model_name)
+
+    def _post(self, payload, headers):
+        response = client_pool.client(self.base_url).post('/chat/completions', json=payload, headers=headers)
+        check_response(self.provider, response)
+        return response.json()
+
+    async def _apost(self, payload, headers):
+        response = await client_pool.async_client(self.base_url).post('/chat/completions', json=payload,
+                                                                       headers=headers)
+        await acheck_response(self.provider, response)
+        return response.json()
+
+    def _stream_lines(self, payload, headers):
+        with client_pool.client(self.base_url).stream('POST', '/chat/completions', json=payload,
+                                                      headers=headers) as response:
+            check_response(self.provider, response)
+            for line in response.iter_lines():
+                content, usage = parse_stream_line(line)
+                if content or usage:
+                    yield content or '', usage
+
+    async def _astream_lines(self, payload, headers):
+        async with client_pool.async_client(self.base_url).stream('POST', '/chat/completions', json=payload,
+                                                                  headers=headers) as response:
+            await acheck_response(self.provider, response)
+            async for line in response.aiter_lines():
+                content, usage = parse_stream_line(line)
+                if content or usage:
+                    yield content or '', usage
+
+    # Every upstream call goes through the provider/model's adaptive limiter (llm_limiter.py)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        payload, headers = self._request(messages, stop, False, **kwargs)
+        return self._result(self.limiter.call(lambda: self._post(payload, headers), self.priority))
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        payload, headers = self._request(messages, stop, False, **kwargs)
+        return self._result(await self.limiter.acall(lambda: self._apost(payload, headers), self.priority))
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        payload, headers = self._request(messages, stop, True, **kwargs)
+        for content, usage in self.limiter.stream(lambda: self._stream_lines(payload, headers), self.priority):
+            if run_manager and content:
+                run_manager.on_llm_new_token(content)
+            yield self._chunk(content, usage)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        payload, headers = self._request(messages, stop, True, **kwargs)
+        async for content, usage in self.limiter.astream(lambda: self._astream_lines(payload, headers), self.priority):
+            if run_manager and content:
+                await run_manager.on_llm_new_token(content)
+            yield self._chunk(content, usage)
+
+
+def provider_settings(provider=None):
+    """(provider, base URL, API key) from LLM_PROVIDER / LLM_BASE_URL / the provider's key variable"""
+    provider = provider or os.getenv('LLM_PROVIDER', 'groq')
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown LLM_PROVIDER {provider!r}; expected one of {', '.join(PROVIDERS)}")
+    base_url, key_variable = PROVIDERS[provider]
+    return (
+        provider,
+        os.getenv('LLM_BASE_URL') or base_url,
+        os.getenv(key_variable) if key_variable else None,
+    )
+
+
+def create_chat_model(model, temperature, provider=None, max_tokens=None, priority='interactive'):
+    provider, base_url, api_key = provider_settings(provider)
+    return OpenAICompatibleChat(
+        model_name=model, temperature=temperature, max_tokens=max_tokens,
+        provider=provider, base_url=base_url, api_key=api_key, priority=priority,
+    )
@@ -0,0 +1,250 @@
+# llm_stub_server.py
+"""
+Local OpenAI/Groq-compatible LLM stub for load testing.
+
+Serves /v1/chat/completions (plain and streamed), /v1/embeddings and
+/v1/models with simulated upstream behaviour, so the chat endpoints can be
+driven end to end on one box without spending quota:
+
+  * time to first token drawn from a lognormal (median --ttft-ms, --ttft-sigma)
+  * completion length around --mean-tokens, streamed at --tokens-per-second
+  * --error-rate 500s, --rate-limit-rate 429s (with Retry-After),
+    --hang-rate requests that stall past client timeouts, and
+    --drop-rate streams cut off mid-response
+
+Responses are derived from the prompt, so identical prompts get identical
+text (useful with the response cache and request coalescing). Counters are
+at GET /stats. Standard library only (plus numpy for /v1/embeddings).
+
+Usage: python llm_stub_server.py [--port 8089] [--ttft-ms 300] [--error-rate 0.01] ...
+       LLM_PROVIDER=stub python ../main.py   # or the Flask app, then bench_chat_concurrency.py
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+VOCABULARY = (
+    'the student learning course lecture assignment quiz answer question concept example theory '
+    'practice review summary chapter notes exam result analysis method data model research topic '
+    'explains because therefore however first second finally important key idea also which'
+).split()
+
+
+class StubStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def leave(self, outcome, tokens=0):
+        with self._lock:
+            self.in_flight -= 1
+            self.counts[outcome] += 1
+            self.counts['completion_tokens'] += tokens
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts, in_flight=self.in_flight, peak_in_flight=self.peak_in_flight)
+
+
+def completion_words(prompt, count):
+    rng = random.Random(hashlib.blake2b(prompt.encode('utf-8'), digest_size=8).digest())
+    return [rng.choice(VOCABULARY) for _ in range(count)]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so client connection pooling is exercised
+    settings = None
+    stats = None
+
+    def log_message(self, format, *args):
+        if self.settings.verbose:
+            super().log_message(format, *args)
+
+    def _json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._json(200, self.stats.snapshot())
+        elif self.path == '/v1/models':
+            self._json(200, {'object': 'list', 'data': [{'id': self.settings.model, 'object': 'model'}]})
+        else:
+            self._json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        body = self._read_json()
+        if self.path == '/v1/chat/completions':
+            self.stats.enter()
+            outcome, tokens = 'error', 0
+            try:
+                outcome, tokens = self._chat(body)
+            finally:
+                self.stats.leave(outcome, tokens)
+        elif self.path == '/v1/embeddings':
+            self._embeddings(body)
+        else:
+            self._json(404, {'error': {'message': 'Not found'}})
+
+    def _injected_failure(self):
+        """Send a simulated failure and return its outcome name, or None to proceed"""
+        settings = self.settings
+        roll = random.random()
+        if roll < settings.error_rate:
+            self._json(500, {'error': {'message': 'Simulated upstream error', 'type': 'server_error'}})
+            return 'server_error'
+        roll -= settings.error_rate
+        if roll < settings.rate_limit_rate:
+            self._json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit'}},
+                       headers={'Retry-After': str(settings.retry_after)})
+            return 'rate_limited'
+        roll -= settings.rate_limit_rate
+        if roll < settings.hang_rate:
+            time.sleep(settings.hang_seconds)
+            self._json(504, {'error': {'message': 'Simulated timeout'}})
+            return 'hung'
+        return None
+
+    def _chat(self, body):
+        settings = self.settings
+        failure = self._injected_failure()
+        if failure:
+            return failure, 0
+
+        prompt = '\n'.join(str(message.get('content', '')) for message in body.get('messages', []))
+        prompt_tokens = max(1, len(prompt) // 4)
+        count = max(1, int(random.gauss(settings.mean_tokens, settings.mean_tokens * 0.3)))
+        if body.get('max_tokens'):
+            count = min(count, int(body['max_tokens']))
+        words = completion_words(prompt, count)
+        model = body.get('model', settings.model)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': count, 'total_tokens': prompt_tokens + count}
+
+        ttft = random.lognormvariate(math.log(settings.ttft_ms / 1000), settings.ttft_sigma)
+        time.sleep(ttft)
+
+        if not body.get('stream'):
+            time.sleep(count / settings.tokens_per_second)
+            self._json(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ' '.join(words)},
+                             'finish_reason': 'stop'}],
+                'usage': usage,
+            })
+            return 'ok', count
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        drop_at = random.randrange(count) if random.random() < settings.drop_rate else None
+        interval = 1 / settings.tokens_per_second
+        for position, word in enumerate(words):
+            if position == drop_at:
+                self.close_connection = True
+                return 'dropped', position
+            delta = {'content': word if position == 0 else f' {word}'}
+            if position == 0:
+                delta['role'] = 'assistant'
+            self._chunk(self._event({'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                                     'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]}))
+            time.sleep(interval)
+
+        final = {'id': completion_id, 'object': 'chat.completion.chunk', 'model': model,
+                 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        if (body.get('stream_options') or {}).get('include_usage'):
+            final['usage'] = usage
+        self._chunk(self._event(final))
+        self._chunk(b'data: [DONE]\n\n')
+        self._chunk(b'')
+        return 'ok', count
+
+    @staticmethod
+    def _event(payload):
+        return f"data: {json.dumps(payload)}\n\n".encode('utf-8')
+
+    def _embeddings(self, body):
+        from embeddings import HashingEmbeddingProvider
+
+        inputs = body.get('input', [])
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        provider = HashingEmbeddingProvider(dimensions=int(body.get('dimensions') or 1536))
+        vectors = provider(inputs)
+        self._json(200, {
+            'object': 'list', 'model': body.get('model', 'stub-embedding'),
+            'data': [{'object': 'embedding', 'index': i, 'embedding': vector.tolist()} for i, vector in enumerate(vectors)],
+            'usage': {'prompt_tokens': sum(len(text) // 4 for text in inputs), 'total_tokens': 0},
+        })
+
+
+def parse_args():
+    env = os.getenv
+    parser = argparse.ArgumentParser(description='OpenAI-compatible LLM stub server')
+    parser.add_argument('--host', default=env('STUB_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(env('STUB_PORT', 8089)))
+    parser.add_argument('--model', default=env('LLM_MODEL', 'mistral-saba-24b'))
+    parser.add_argument('--ttft-ms', type=float, default=float(env('STUB_TTFT_MS', 300)))
+    parser.add_argument('--ttft-sigma', type=float, default=float(env('STUB_TTFT_SIGMA', 0.5)))
+    parser.add_argument('--tokens-per-second', type=float, default=float(env('STUB_TOKENS_PER_SECOND', 80)))
+    parser.add_argument('--mean-tokens', type=int, default=int(env('STUB_MEAN_TOKENS', 150)))
+    parser.add_argument('--error-rate', type=float, default=float(env('STUB_ERROR_RATE', 0)))
+    parser.add_argument('--rate-limit-rate', type=float, default=float(env('STUB_RATE_LIMIT_RATE', 0)))
+    parser.add_argument('--retry-after', type=int, default=int(env('STUB_RETRY_AFTER', 1)))
+    parser.add_argument('--hang-rate', type=float, default=float(env('STUB_HANG_RATE', 0)))
+    parser.add_argument('--hang-seconds', type=float, default=float(env('STUB_HANG_SECONDS', 120)))
+    parser.add_argument('--drop-rate', type=float, default=float(env('STUB_DROP_RATE', 0)))
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args()
+
+
+def serve(settings):
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'settings': settings, 'stats': StubStats()})
+    # A deep accept backlog so bursts of load-test connections are queued, not refused
+    server_class = type('StubServer', (ThreadingHTTPServer,), {'request_queue_size': 1024, 'daemon_threads': True})
+    server = server_class((settings.host, settings.port), handler)
+    print(f"🧪 LLM stub on http://{settings.host}:{settings.port}/v1 "
+          f"(ttft≈{settings.ttft_ms:.0f}ms, {settings.tokens_per_second:.0f} tok/s, "
+          f"errors {settings.error_rate:.1%}, 429s {settings.rate_limit_rate:.1%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    serve(parse_args())
@@ -0,0 +1,331 @@
+# backend/migrations.py
+"""
+Versioned schema migrations for the Academic AI Platform.
+
+Migrations are applied once at startup (or via `python migrations.py`) and
+recorded in the `schema_migrations` table, so request handlers never touch
+the catalog.
+"""
+
+import os
+import logging
+import sys
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION_TABLE = 'schema_migrations'
+
+# Arbitrary but stable key so concurrent gunicorn workers migrate one at a time
+MIGRATION_LOCK_KEY = 727361001
+
+# Registered migrations as (version, description, function) tuples
+MIGRATIONS = []
+
+
+class SchemaNotReadyError(RuntimeError):
+    """Raised when the database schema is behind the version the code expects"""
+
+
+def migration(version, description):
+    """Register a migration function for the given schema version"""
+    def decorator(func):
+        if any(existing[0] == version for existing in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version: {version}")
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return decorator
+
+
+def latest_version():
+    """Schema version the current code expects"""
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+# =====================================================
+# MIGRATIONS
+# =====================================================
+
+@migration(1, 'Baseline ORM tables (institutions, users, conversations)')
+def baseline_tables(conn):
+    from models import Base
+    Base.metadata.create_all(bind=conn)
+
+
+@migration(2, 'Batched AI budget tracking replaces the per-row track_ai_budget trigger')
+def batched_budget_tracking(conn):
+    # Budgets are now applied once per flush by usage_logs.UsageLogWriter
+    conn.execute(text("""
+        DO $$
+        BEGIN
+            IF to_regclass('ai_usage_logs') IS NOT NULL THEN
+                DROP TRIGGER IF EXISTS track_ai_budget_trigger ON ai_usage_logs;
+            END IF;
+            IF to_regclass('ai_budgets') IS NOT NULL THEN
+                -- Per-request costs are fractions of a cent; 2 decimals rounded them away
+                ALTER TABLE ai_budgets
+                    ALTER COLUMN daily_usage TYPE DECIMAL(12,6),
+                    ALTER COLUMN monthly_usage TYPE DECIMAL(12,6);
+            END IF;
+        END $$;
+    """))
+
+
+@migration(3, 'Keyset pagination and search indexes on users')
+def user_listing_indexes(conn):
+    # Each filter is paired with the (created_at, id) sort key so a page is one index range scan
+    conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_users_created_id ON users (created_at DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS idx_users_institution_created_id ON users (institution_id, created_at DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS idx_users_role_created_id ON users (role, created_at DESC, id DESC);
+    """))
+    # Substring search on name/email (pg_trgm ships with full_schema.sql)
+    conn.execute(text("""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX IF NOT EXISTS idx_users_search_trgm ON users USING gin (
+                    (email || ' ' || first_name || ' ' || last_name) gin_trgm_ops
+                );
+            END IF;
+        END $$;
+    """))
+
+
+@migration(4, 'Stored password hashes for local auth')
+def password_hashes(conn):
+    # Already present when the database was created from full_schema.sql
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS password_hash VARCHAR(255)"))
+
+
+@migration(5, 'ANN index on conversation_embeddings')
+def embedding_ann_index(conn):
+    if not conn.execute(text("SELECT to_regclass('conversation_embeddings') IS NOT NULL")).scalar():
+        return
+    has_vector = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'vector'")).scalar()
+    if not has_vector:
+        logger.warning("⚠️  pgvector not installed; skipping the embedding index (NumPy fallback only)")
+        return
+    # HNSW needs pgvector >= 0.5.0; older installs get IVFFlat
+    if conn.execute(text("SELECT 1 FROM pg_am WHERE amname = 'hnsw'")).scalar():
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS idx_embeddings_ann ON conversation_embeddings
+            USING hnsw (embedding vector_cosine_ops)
+            WITH (m = {int(os.getenv('VECTOR_HNSW_M', 16))},
+                  ef_construction = {int(os.getenv('VECTOR_HNSW_EF_CONSTRUCTION', 64))})
+        """))
+    else:
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS idx_embeddings_ann ON conversation_embeddings
+            USING ivfflat (embedding vector_cosine_ops)
+            WITH (lists = {int(os.getenv('VECTOR_IVFFLAT_LISTS', 100))})
+        """))
+
+
+@migration(6, 'Routing keywords on ai_tools')
+def tool_keywords(conn):
+    if not conn.execute(text("SELECT to_regclass('ai_tools') IS NOT NULL")).scalar():
+        return
+    from tool_router import DEFAULT_TOOL_KEYWORDS
+
+    conn.execute(text("ALTER TABLE ai_tools ADD COLUMN IF NOT EXISTS keywords TEXT[] DEFAULT '{}'"))
+    # Seed the default tools; keywords edited since are left alone
+    for name, keywords in DEFAULT_TOOL_KEYWORDS.items():
+        conn.execute(
+            text("""
+                UPDATE ai_tools SET keywords = :keywords
+                WHERE name = :name AND COALESCE(cardinality(keywords), 0) = 0
+            """),
+            {'name': name, 'keywords': keywords}
+        )
+
+
+@migration(7, 'Change tracking for the tool registry (ai_tools, ai_agents)')
+def tool_registry_version(conn):
+    # One row, bumped (and announced on tool_registry_changed) by every statement that changes either table
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS tool_registry_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version BIGINT NOT NULL DEFAULT 1,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO tool_registry_version (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;
+
+        CREATE OR REPLACE FUNCTION bump_tool_registry_version()
+        RETURNS TRIGGER AS $$
+        DECLARE
+            new_version BIGINT;
+        BEGIN
+            UPDATE tool_registry_version
+            SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+            RETURNING version INTO new_version;
+            PERFORM pg_notify('tool_registry_changed', new_version::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """))
+    for table in ('ai_tools', 'ai_agents'):
+        if not conn.execute(text("SELECT to_regclass(:table) IS NOT NULL"), {'table': table}).scalar():
+            continue
+        conn.execute(text(f"""
+            DROP TRIGGER IF EXISTS {table}_registry_version ON {table};
+            CREATE TRIGGER {table}_registry_version
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_tool_registry_version();
+        """))
+
+
+@migration(8, 'Dedicated table for response cache embeddings')
+def response_cache_embeddings(conn):
+    if not conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'vector'")).scalar():
+        logger.warning("⚠️  pgvector not installed; skipping the response cache similarity table")
+        return
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS response_cache_embeddings (
+            id BIGSERIAL PRIMARY KEY,
+            scope CHAR(64) NOT NULL,
+            tool VARCHAR(100),
+            prompt TEXT NOT NULL,
+            response TEXT NOT NULL,
+            embedding vector(1536) NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_response_cache_scope ON response_cache_embeddings(scope, expires_at);
+        CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache_embeddings(expires_at);
+    """))
+    if conn.execute(text("SELECT 1 FROM pg_am WHERE amname = 'hnsw'")).scalar():
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_response_cache_ann ON response_cache_embeddings
+            USING hnsw (embedding vector_cosine_ops)
+        """))
+    # Cache entries used to live in conversation_embeddings, where they polluted retrieval
+    if conn.execute(text("SELECT to_regclass('conversation_embeddings') IS NOT NULL")).scalar():
+        conn.execute(text("DELETE FROM conversation_embeddings WHERE metadata->>'kind' = 'response_cache'"))
+
+
+@migration(9, 'Institution-scoped index for recent audit activity')
+def audit_institution(conn):
+    # Copied from the acting user on insert so the dashboard's per-institution
+    # "recent activity" reads one index instead of joining every audit row to users
+    conn.execute(text("""
+        ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS institution_id UUID;
+
+        CREATE OR REPLACE FUNCTION set_audit_institution()
+        RETURNS TRIGGER AS $$
+        BEGIN
+            IF NEW.institution_id IS NULL AND NEW.user_id IS NOT NULL THEN
+                SELECT institution_id INTO NEW.institution_id FROM users WHERE id = NEW.user_id;
+            END IF;
+            RETURN NEW;
+        END;
+        $$ language 'plpgsql';
+
+        DROP TRIGGER IF EXISTS audit_logs_institution ON audit_logs;
+        CREATE TRIGGER audit_logs_institution BEFORE INSERT ON audit_logs
+            FOR EACH ROW EXECUTE FUNCTION set_audit_institution();
+
+        UPDATE audit_logs a SET institution_id = u.institution_id
+        FROM users u
+        WHERE u.id = a.user_id AND a.institution_id IS NULL AND u.institution_id IS NOT NULL;
+
+        CREATE INDEX IF NOT EXISTS idx_audit_institution_created ON audit_logs(institution_id, created_at DESC);
+    """))
+
+
+@migration(10, 'Seed dashboard rollups from existing users and usage')
+def seed_dashboard_rollups(conn):
+    # userCount sums new_users rollup rows, so a deployment that predates the
+    # rollups would under-count until backfilled; `python rollups.py` rebuilds later
+    from rollups import rebuild
+
+    rows = rebuild(conn)
+    logger.info(f"📊 Seeded {rows} dashboard rollup rows")
+
+
+@migration(11, 'Invite-pending accounts from bulk provisioning')
+def password_reset_required(conn):
+    # Provisioned without a password: no hash, and login is refused until one is set
+    conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS password_reset_required BOOLEAN NOT NULL DEFAULT FALSE"))
+
+
+# =====================================================
+# RUNNER
+# =====================================================
+
+def ensure_version_table(conn):
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+
+def current_version(conn):
+    """Highest applied migration version, 0 if none (or no version table yet)"""
+    exists = conn.execute(
+        text("SELECT to_regclass(:table) IS NOT NULL"),
+        {'table': SCHEMA_VERSION_TABLE}
+    ).scalar()
+    if not exists:
+        return 0
+    return conn.execute(text(f"SELECT COALESCE(MAX(version), 0) FROM {SCHEMA_VERSION_TABLE}")).scalar()
+
+
+def run_migrations(engine):
+    """Apply all pending migrations in a single transaction and return the new version"""
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': MIGRATION_LOCK_KEY})
+        ensure_version_table(conn)
+        version = current_version(conn)
+
+        for target, description, func in MIGRATIONS:
+            if target <= version:
+                continue
+            logger.info(f"⬆️  Applying migration {target}: {description}")
+            func(conn)
+            conn.execute(
+                text(f"INSERT INTO {SCHEMA_VERSION_TABLE} (version, description) VALUES (:version, :description)"),
+                {'version': target, 'description': description}
+            )
+            version = target
+
+    return version
+
+
+def check_schema(engine):
+    """Verify the database is at the expected schema version, raise otherwise"""
+    with engine.connect() as conn:
+        version = current_version(conn)
+
+    expected = latest_version()
+    if version < expected:
+        raise SchemaNotReadyError(
+            f"Database schema is at version {version}, expected {expected}. "
+            f"Run `python migrations.py` to apply pending migrations."
+        )
+    return version
+
+
+def prepare_schema(engine, auto_migrate=True):
+    """Startup hook: migrate (optionally) and then verify the schema version"""
+    if auto_migrate:
+        run_migrations(engine)
+    version = check_schema(engine)
+    logger.info(f"✅ Database schema at version {version}")
+    return version
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from models import engine
+
+    try:
+        applied = run_migrations(engine)
+        logger.info(f"🎉 Schema is up to date (version {applied})")
+    except Exception as e:
+        logger.error(f"❌ Migration failed: {e}")
+        sys.exit(1)
@@ -1,18 +1,18 @@
 # models.py
-import os
 import uuid
 from datetime import datetime
-from sqlalchemy import create_engine, Column, String, Boolean, DateTime, ForeignKey, Text, Integer, Float
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Text, Integer, Float
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship  # Updated import
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from dotenv import load_dotenv
+from db_engine import create_db_engine
 
 # Load environment
 load_dotenv()
 
 # SQLAlchemy setup
 Base = declarative_base()  # This is the correct 2.0 way
-engine = create_engine(os.getenv('DATABASE_URL'))
+engine = create_db_engine()  # Pooled, instrumented engine shared by the web app
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 # Base model
@@ -42,6 +42,8 @@ class User(BaseModel):
     first_name = Column(String(100), nullable=False)
     last_name = Column(String(100), nullable=False)
     role = Column(String(50), nullable=False, default='student')  # admin, faculty, staff, student
+    password_hash = Column(String(255))  # scrypt$n$r$p$salt$hash, see passwords.py
+    password_reset_required = Column(Boolean, nullable=False, default=False)  # invite-pending, see provisioning.py
     
     # Relationships
     institution_id = Column(UUID(as_uuid=True), ForeignKey('institutions.id'))
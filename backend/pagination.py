@@ -0,0 +1,41 @@
+# backend/pagination.py
+"""
+Keyset (cursor) pagination helpers.
+
+Cursors are opaque URL-safe tokens wrapping the sort key of the last row on a
+page, so the next page is a range scan on the index instead of an OFFSET that
+re-reads every earlier row.
+"""
+
+import json
+import uuid
+import base64
+from datetime import datetime
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def encode_cursor(created_at, row_id):
+    payload = json.dumps([created_at.isoformat(), str(row_id)])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (created_at, id) from a cursor produced by encode_cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        # Checked here so a tampered id is a bad cursor, not a database error
+        return datetime.fromisoformat(created_at), str(uuid.UUID(row_id))
+    except (ValueError, TypeError, AttributeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+
+
+def page_limit(value, default=50, maximum=200):
+    """Clamp a ?limit= query parameter"""
+    try:
+        return min(max(int(value), 1), maximum) if value else default
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,149 @@
+# backend/passwords.py
+"""
+Password hashing for local auth.
+
+Hashes use scrypt from the standard library with cost parameters taken from
+PASSWORD_SCRYPT_N / _R / _P, and are stored self-describing as
+
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+
+so the parameters can be raised later: a hash made with older parameters still
+verifies, and `needs_rehash()` tells login to upgrade it. The CPU-bound work
+runs in a bounded process pool (PASSWORD_HASH_WORKERS) instead of Flask
+request threads, and callers are turned away with HashingBusyError once
+PASSWORD_HASH_MAX_PENDING hashes are queued. Bulk imports hash on a separate,
+smaller pool (PASSWORD_BULK_HASH_WORKERS) with a bounded number of hashes in
+flight, so a large roster cannot queue ahead of logins.
+"""
+
+import os
+import hmac
+import base64
+import atexit
+import hashlib
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+SCHEME = 'scrypt'
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class HashingBusyError(RuntimeError):
+    """Raised when the hashing pool already has too much work queued"""
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode('ascii')
+
+
+def _scrypt(password, salt, n, r, p):
+    # Runs in a worker process; maxmem must cover scrypt's 128 * n * r * p bytes
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r * p, dklen=KEY_BYTES)
+
+
+def parse_hash(encoded):
+    """Return (n, r, p, salt, key) or None if the value is not one of ours"""
+    try:
+        scheme, n, r, p, salt, key = encoded.split('$')
+        if scheme != SCHEME:
+            return None
+        return int(n), int(r), int(p), base64.b64decode(salt), base64.b64decode(key)
+    except (AttributeError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """scrypt hashing and verification on a bounded worker pool"""
+
+    def __init__(self, n=2 ** 14, r=8, p=1, workers=None, max_pending=256, executor='process', bulk_workers=None):
+        self.n = n
+        self.r = r
+        self.p = p
+        self.workers = workers or os.cpu_count() or 1
+        self.bulk_workers = bulk_workers or max(1, self.workers // 2)
+        pool_class = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+        self._pool = pool_class(max_workers=self.workers)
+        # hash_many() never touches the login pool or its slots
+        self._bulk_pool = pool_class(max_workers=self.bulk_workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        # Verified against when the account does not exist, so timing does not reveal it
+        self._dummy_hash = self._encode(os.urandom(SALT_BYTES), os.urandom(KEY_BYTES), n, r, p)
+
+    def _encode(self, salt, key, n, r, p):
+        return f"{SCHEME}${n}${r}${p}${_b64(salt)}${_b64(key)}"
+
+    def _run(self, password, salt, n, r, p):
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusyError("Too many password hashes in progress")
+        try:
+            return self._pool.submit(_scrypt, password, salt, n, r, p).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        salt = os.urandom(SALT_BYTES)
+        key = self._run(password, salt, self.n, self.r, self.p)
+        return self._encode(salt, key, self.n, self.r, self.p)
+
+    def hash_many(self, passwords):
+        """Hash a batch on the bulk pool, at most 2 * bulk_workers in flight; None entries stay None"""
+        hashes = [None] * len(passwords)
+        in_flight = deque()
+
+        def collect():
+            index, salt, future = in_flight.popleft()
+            hashes[index] = self._encode(salt, future.result(), self.n, self.r, self.p)
+
+        for index, password in enumerate(passwords):
+            if not password:
+                continue
+            if len(in_flight) >= 2 * self.bulk_workers:
+                collect()
+            salt = os.urandom(SALT_BYTES)
+            in_flight.append((index, salt, self._bulk_pool.submit(_scrypt, password, salt, self.n, self.r, self.p)))
+        while in_flight:
+            collect()
+        return hashes
+
+    def verify(self, password, encoded):
+        """Constant-time check of `password` against a stored hash (None counts as a miss)"""
+        stored = parse_hash(encoded)
+        n, r, p, salt, expected = stored or parse_hash(self._dummy_hash)
+        key = self._run(password, salt, n, r, p)
+        return stored is not None and hmac.compare_digest(key, expected)
+
+    def needs_rehash(self, encoded):
+        parsed = parse_hash(encoded)
+        return parsed is None or parsed[:3] != (self.n, self.r, self.p)
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._bulk_pool.shutdown(wait=False, cancel_futures=True)
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def get_password_hasher():
+    """Process-wide hasher configured from PASSWORD_SCRYPT_* and PASSWORD_HASH_* settings"""
+    global _hasher
+    with _hasher_lock:
+        if _hasher is None:
+            _hasher = PasswordHasher(
+                n=int(os.getenv('PASSWORD_SCRYPT_N', 2 ** 14)),
+                r=int(os.getenv('PASSWORD_SCRYPT_R', 8)),
+                p=int(os.getenv('PASSWORD_SCRYPT_P', 1)),
+                workers=int(os.getenv('PASSWORD_HASH_WORKERS', 0)) or None,
+                max_pending=int(os.getenv('PASSWORD_HASH_MAX_PENDING', 256)),
+                executor=os.getenv('PASSWORD_HASH_EXECUTOR', 'process'),
+                bulk_workers=int(os.getenv('PASSWORD_BULK_HASH_WORKERS', 0)) or None,
+            )
+            atexit.register(_hasher.close)
+        return _hasher
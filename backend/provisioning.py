@@ -0,0 +1,202 @@
+# backend/provisioning.py
+"""
+Streaming bulk user provisioning.
+
+Reads a CSV or NDJSON roster batch by batch (memory is bounded by
+PROVISION_BATCH_SIZE, plus the set of emails already seen in the file),
+validates each batch (roles capped at the caller's), drops emails that
+already exist with one set-based query per batch, and COPYs the survivors
+into a temporary staging table. A single INSERT ... SELECT then merges
+staging into users, so the whole roster lands in one transaction or not at all.
+
+The password column is optional. Rows without one become invite-pending
+accounts (no hash, password_reset_required set, refused at login), which
+costs nothing to provision. Rows with one are hashed on the hasher's bulk
+pool at the full PASSWORD_SCRYPT_* cost: about 80 ms of CPU each at the
+default N=2**14, i.e. over two CPU-hours per 100k rows, spread over
+PASSWORD_BULK_HASH_WORKERS processes. Large rosters should be sent without
+passwords.
+
+`RosterProvisioner.run()` yields progress, per-row error and completion
+events, which the API streams back to the caller as NDJSON.
+"""
+
+import io
+import csv
+import json
+import uuid
+import codecs
+from collections import Counter
+from rollups import record_new_user
+from user_import import normalize_row, validate_row
+
+STAGING_COLUMNS = ('row_number', 'id', 'email', 'first_name', 'last_name', 'role', 'institution_id', 'password_hash')
+
+CREATE_STAGING_SQL = """
+    CREATE TEMP TABLE provision_staging (
+        row_number INTEGER NOT NULL,
+        id UUID NOT NULL,
+        email VARCHAR(255) NOT NULL,
+        first_name VARCHAR(100) NOT NULL,
+        last_name VARCHAR(100) NOT NULL,
+        role VARCHAR(50) NOT NULL,
+        institution_id UUID NOT NULL,
+        password_hash VARCHAR(255)
+    ) ON COMMIT DROP
+"""
+
+# Empty names are real values, only an empty password_hash means NULL
+COPY_STAGING_SQL = (
+    f"COPY provision_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN "
+    "WITH (FORMAT csv, FORCE_NOT_NULL (first_name, last_name))"
+)
+
+MERGE_SQL = """
+    WITH inserted AS (
+        INSERT INTO users (id, email, first_name, last_name, role, institution_id,
+                           password_hash, password_reset_required, is_active, created_at, updated_at)
+        SELECT id, email, first_name, last_name, role, institution_id, password_hash, password_hash IS NULL, TRUE,
+               NOW() AT TIME ZONE 'utc', NOW() AT TIME ZONE 'utc'
+        FROM provision_staging
+        ORDER BY row_number
+        ON CONFLICT (email) DO NOTHING
+        RETURNING institution_id
+    )
+    SELECT CAST(institution_id AS TEXT), COUNT(*) FROM inserted GROUP BY institution_id
+"""
+
+# Rows that lost a race with a concurrent signup between dedupe and merge
+CONFLICTS_SQL = """
+    SELECT s.row_number, s.email FROM provision_staging s
+    WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = s.id)
+    ORDER BY s.row_number
+"""
+
+
+def read_csv(binary):
+    for raw in csv.DictReader(codecs.getreader('utf-8-sig')(binary)):
+        yield raw
+
+
+def read_ndjson(binary):
+    for line in codecs.getreader('utf-8')(binary):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None  # reported as an unparsable row
+
+
+def read_roster(binary, fmt):
+    return read_csv(binary) if fmt == 'csv' else read_ndjson(binary)
+
+
+class RosterProvisioner:
+    """Validates, dedupes and COPY-loads a roster into users in one transaction"""
+
+    def __init__(self, engine, directory, hasher, batch_size=5000, max_role='student', allowed_institution_id=None):
+        self.engine = engine
+        self.max_role = max_role  # the caller's role: nothing ranked above it is provisioned
+        self.directory = directory
+        self.hasher = hasher
+        self.batch_size = batch_size
+        self.allowed_institution_id = str(allowed_institution_id) if allowed_institution_id else None
+        self.counts = Counter()
+        self._seen = set()
+
+    def _progress(self, kind='progress'):
+        return dict(self.counts, type=kind)
+
+    def _error(self, row_number, email, message):
+        self.counts['invalid'] += 1
+        return {'type': 'error', 'row': row_number, 'email': email, 'error': message}
+
+    def run(self, binary, fmt):
+        """Yield progress/error events; the final event has type 'done'"""
+        # A client disconnect closes this generator (GeneratorExit) and rolls everything back
+        with self.engine.begin() as conn:
+            cursor = conn.connection.cursor()
+            cursor.execute(CREATE_STAGING_SQL)
+
+            batch = []
+            for row_number, raw in enumerate(read_roster(binary, fmt), start=1):
+                self.counts['read'] += 1
+                if not isinstance(raw, dict):
+                    yield self._error(row_number, None, 'Unparsable row')
+                    continue
+                batch.append((row_number, normalize_row(raw)))
+                if len(batch) >= self.batch_size:
+                    yield from self._stage(cursor, batch)
+                    yield self._progress()
+                    batch = []
+            if batch:
+                yield from self._stage(cursor, batch)
+                yield self._progress()
+
+            cursor.execute(MERGE_SQL)
+            created = cursor.fetchall()
+            for institution_id, count in created:
+                self.counts['created'] += count
+
+            cursor.execute(CONFLICTS_SQL)
+            for row_number, email in cursor.fetchall():
+                self.counts['duplicates'] += 1
+                yield {'type': 'error', 'row': row_number, 'email': email,
+                       'error': 'User with this email already exists'}
+            cursor.close()
+
+        # Counted only once the roster has committed
+        for institution_id, count in created:
+            record_new_user(institution_id, count)
+        yield self._progress('done')
+
+    def _stage(self, cursor, batch):
+        """Validate one batch, drop known emails and COPY the rest into staging"""
+        domains = {row['email'].split('@')[-1] for _, row in batch if '@' in row['email']}
+        institutions = self.directory.lookup_many(domains)
+
+        valid = []
+        for row_number, row in batch:
+            error = validate_row(row, self.max_role, require_password=False)
+            institution = institutions.get(row['email'].split('@')[-1]) if not error else None
+            if not error and institution is None:
+                error = 'Institution not found for this email domain'
+            elif not error and self.allowed_institution_id and institution['id'] != self.allowed_institution_id:
+                error = 'Email domain belongs to another institution'
+            elif not error and row['email'] in self._seen:
+                error = 'Duplicate email in roster'
+            if error:
+                yield self._error(row_number, row['email'], error)
+                continue
+            self._seen.add(row['email'])
+            valid.append((row_number, row, institution['id']))
+
+        if not valid:
+            return
+
+        cursor.execute("SELECT email FROM users WHERE email = ANY(%s)", ([row['email'] for _, row, _ in valid],))
+        existing = {email for (email,) in cursor.fetchall()}
+
+        fresh = []
+        for row_number, row, institution_id in valid:
+            if row['email'] in existing:
+                self.counts['duplicates'] += 1
+                yield {'type': 'error', 'row': row_number, 'email': row['email'],
+                       'error': 'User with this email already exists'}
+            else:
+                fresh.append((row_number, row, institution_id))
+
+        # Passwordless rows stay None (invite-pending) and cost no hashing
+        password_hashes = self.hasher.hash_many([row.get('password') for _, row, _ in fresh])
+        self.counts['invited'] += sum(1 for password_hash in password_hashes if password_hash is None)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for (row_number, row, institution_id), password_hash in zip(fresh, password_hashes):
+            writer.writerow((row_number, uuid.uuid4(), row['email'], row['first_name'], row['last_name'],
+                             row['role'], institution_id, password_hash or ''))
+        buffer.seek(0)
+        cursor.copy_expert(COPY_STAGING_SQL, buffer)
+        self.counts['staged'] += len(fresh)
@@ -0,0 +1,263 @@
+# backend/response_cache.py
+"""
+Response cache in front of stateless LLM calls.
+
+Exact tier: in-process LRU keyed on (tool, model settings, normalized prompt)
+with per-tool TTLs and a byte budget. Optional similarity tier: prompt
+embeddings stored in their own table, response_cache_embeddings (migration 8),
+and matched by cosine distance with pgvector, so near-identical prompts
+("create a quiz on photosynthesis" vs "Create a quiz on Photosynthesis!")
+share one answer across workers. Lookups filter on (tool, model settings)
+scope and expiry inside the index scan (pgvector >= 0.8 iterative scans), and
+expired rows are deleted in small batches as new ones are added.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import text
+from vector_index import vector_literal
+
+logger = logging.getLogger(__name__)
+
+ENTRY_OVERHEAD_BYTES = 256
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = re.compile(r'[\s.!?;:,]+$')
+
+
+def normalize_prompt(prompt):
+    """Case-fold, collapse whitespace and drop trailing punctuation"""
+    normalized = _WHITESPACE.sub(' ', prompt.casefold()).strip()
+    return _TRAILING_PUNCTUATION.sub('', normalized)
+
+
+def cache_key(prompt, tool, model_settings):
+    payload = json.dumps([tool, model_settings, normalize_prompt(prompt)], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def similarity_scope(tool, model_settings):
+    """Prompts are only matched against others cached for the same tool and settings"""
+    payload = json.dumps([tool, model_settings], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class CacheEntry:
+    __slots__ = ('key', 'tool', 'response', 'expires_at', 'size')
+
+    def __init__(self, key, tool, response, expires_at):
+        self.key = key
+        self.tool = tool
+        self.response = response
+        self.expires_at = expires_at
+        self.size = len(response.encode('utf-8')) + ENTRY_OVERHEAD_BYTES
+
+
+class ResponseCache:
+    """Size-bounded LRU with per-tool TTLs, an optional similarity tier and hit-rate metrics"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, default_ttl=86400, tool_ttls=None, similarity=None):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.tool_ttls = tool_ttls or {}
+        self.similarity = similarity
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def ttl_for(self, tool):
+        return self.tool_ttls.get(tool, self.default_ttl)
+
+    def get(self, prompt, tool, model_settings):
+        """Return (response, tier) on a hit, None on a miss"""
+        key = cache_key(prompt, tool, model_settings)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.exact_hits += 1
+                    return entry.response, 'exact'
+                self._remove_locked(key)
+
+        if self.similarity is not None:
+            try:
+                response = self.similarity.lookup(prompt, tool, model_settings)
+            except Exception as e:
+                logger.warning(f"⚠️  Similarity cache lookup failed: {e}")
+                response = None
+            if response is not None:
+                with self._lock:
+                    self.similar_hits += 1
+                self._store(key, tool, response, now + self.ttl_for(tool))
+                return response, 'similar'
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, prompt, tool, model_settings, response):
+        key = cache_key(prompt, tool, model_settings)
+        expires_at = time.time() + self.ttl_for(tool)
+        self._store(key, tool, response, expires_at)
+
+        if self.similarity is not None:
+            try:
+                self.similarity.add(prompt, tool, model_settings, response, expires_at)
+            except Exception as e:
+                logger.warning(f"⚠️  Could not index cache entry: {e}")
+
+    def _store(self, key, tool, response, expires_at):
+        entry = CacheEntry(key, tool, response, expires_at)
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove_locked(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                self._remove_locked(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove_locked(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.similar_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'maxBytes': self.max_bytes,
+                'exactHits': self.exact_hits,
+                'similarHits': self.similar_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': round((self.exact_hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+            }
+
+
+class PgVectorSimilarityTier:
+    """Nearest-neighbour prompt matching over response_cache_embeddings"""
+
+    def __init__(self, engine, embed, max_distance=0.05, purge_interval=300.0, purge_batch=1000):
+        self.engine = engine
+        self.embed = embed  # embeddings.EmbeddingProvider or any callable: list[str] -> vectors
+        self.max_distance = max_distance
+        self.purge_interval = purge_interval
+        self.purge_batch = purge_batch
+        self._iterative_scan = None  # pgvector >= 0.8, checked on first lookup
+        self._next_purge = 0.0
+        self._purge_lock = threading.Lock()
+        self.purged = 0
+
+    def _supports_iterative_scan(self, conn):
+        if self._iterative_scan is None:
+            version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+            try:
+                self._iterative_scan = tuple(int(part) for part in version.split('.')[:2]) >= (0, 8)
+            except (AttributeError, ValueError):
+                self._iterative_scan = False
+        return self._iterative_scan
+
+    def lookup(self, prompt, tool, model_settings):
+        vector = self.embed([normalize_prompt(prompt)])[0]
+        with self.engine.begin() as conn:
+            if self._supports_iterative_scan(conn):
+                # Keep walking the HNSW graph until a row passes the scope/expiry filter
+                conn.execute(text("SET LOCAL hnsw.iterative_scan = strict_order"))
+            row = conn.execute(text("""
+                SELECT response, embedding <=> CAST(:vector AS vector) AS distance
+                FROM response_cache_embeddings
+                WHERE scope = :scope AND expires_at > NOW()
+                ORDER BY embedding <=> CAST(:vector AS vector)
+                LIMIT 1
+            """), {
+                'vector': vector_literal(vector),
+                'scope': similarity_scope(tool, model_settings),
+            }).fetchone()
+        if row is not None and row[1] <= self.max_distance:
+            return row[0]
+        return None
+
+    def add(self, prompt, tool, model_settings, response, expires_at):
+        normalized = normalize_prompt(prompt)
+        vector = self.embed([normalized])[0]
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO response_cache_embeddings (scope, tool, prompt, response, embedding, expires_at)
+                VALUES (:scope, :tool, :prompt, :response, CAST(:vector AS vector), to_timestamp(:expires_at))
+            """), {
+                'scope': similarity_scope(tool, model_settings),
+                'tool': tool,
+                'prompt': normalized,
+                'response': response,
+                'vector': vector_literal(vector),
+                'expires_at': expires_at,
+            })
+        self.maybe_purge()
+
+    def maybe_purge(self):
+        """Delete a batch of expired rows, at most once per purge_interval per process"""
+        now = time.monotonic()
+        if now < self._next_purge or not self._purge_lock.acquire(blocking=False):
+            return 0
+        try:
+            self._next_purge = now + self.purge_interval
+            with self.engine.begin() as conn:
+                deleted = conn.execute(text("""
+                    DELETE FROM response_cache_embeddings
+                    WHERE id IN (
+                        SELECT id FROM response_cache_embeddings
+                        WHERE expires_at <= NOW()
+                        LIMIT :batch
+                        FOR UPDATE SKIP LOCKED
+                    )
+                """), {'batch': self.purge_batch}).rowcount
+            if deleted == self.purge_batch:
+                # More to go: come back on the next add instead of waiting a full interval
+                self._next_purge = now
+            self.purged += deleted
+            return deleted
+        except Exception as e:
+            logger.warning(f"⚠️  Could not purge expired cache embeddings: {e}")
+            return 0
+        finally:
+            self._purge_lock.release()
+
+
+def similarity_tier_from_env(engine):
+    """pgvector similarity tier when RESPONSE_CACHE_SIMILARITY is on, otherwise None"""
+    if os.getenv('RESPONSE_CACHE_SIMILARITY', 'False').lower() != 'true':
+        return None
+    from embeddings import get_embedding_provider
+
+    return PgVectorSimilarityTier(
+        engine, get_embedding_provider(),
+        max_distance=float(os.getenv('RESPONSE_CACHE_MAX_DISTANCE', 0.05)),
+        purge_interval=float(os.getenv('RESPONSE_CACHE_PURGE_INTERVAL', 300)),
+    )
+
+
+def response_cache_from_env(similarity=None):
+    """Cache configured from CACHE_TTL_HOURS, RESPONSE_CACHE_MAX_BYTES and RESPONSE_CACHE_TOOL_TTLS"""
+    tool_ttls = json.loads(os.getenv('RESPONSE_CACHE_TOOL_TTLS', '{}'))
+    return ResponseCache(
+        max_bytes=int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+        default_ttl=float(os.getenv('CACHE_TTL_HOURS', 24)) * 3600,
+        tool_ttls={tool: float(ttl) for tool, ttl in tool_ttls.items()},
+        similarity=similarity,
+    )
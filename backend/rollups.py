@@ -0,0 +1,364 @@
+# backend/rollups.py
+"""
+Incremental dashboard rollups stored in performance_metrics.
+
+Writers bump per-institution and platform-wide daily counters with a single
+upsert on the UNIQUE(entity_type, entity_id, metric_name, period_type,
+period_start) key. Usage counters are applied in the usage writer's batched
+flush (usage_logs.py). Signups are added to an in-process RollupBuffer once
+their transaction commits and written every ROLLUP_FLUSH_INTERVAL seconds,
+so request transactions never wait on the shared platform row. The
+dashboard reads a handful of pre-aggregated rows instead of scanning users,
+ai_usage_logs and audit_logs. Migration 10 seeds the rollups from existing
+rows; `python rollups.py [days]` rebuilds them on demand.
+"""
+
+import os
+import sys
+import time
+import atexit
+import logging
+import calendar
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Platform-wide aggregates use a fixed entity id
+PLATFORM_ENTITY_ID = '00000000-0000-0000-0000-000000000000'
+
+# Metric names
+NEW_USERS = 'new_users'
+AI_REQUESTS = 'ai_requests'
+AI_ERRORS = 'ai_errors'
+AI_COST = 'ai_cost'
+
+UPSERT_INCREMENT_SQL = text("""
+    INSERT INTO performance_metrics
+        (entity_type, entity_id, metric_name, metric_value, period_type, period_start, period_end)
+    VALUES
+        (:entity_type, CAST(:entity_id AS UUID), :metric_name, :delta, 'daily', :day, :day)
+    ON CONFLICT (entity_type, entity_id, metric_name, period_type, period_start)
+    DO UPDATE SET metric_value = performance_metrics.metric_value + EXCLUDED.metric_value
+""")
+
+UPSERT_REPLACE_SQL = text("""
+    INSERT INTO performance_metrics
+        (entity_type, entity_id, metric_name, metric_value, period_type, period_start, period_end)
+    VALUES
+        (:entity_type, CAST(:entity_id AS UUID), :metric_name, :delta, 'daily', :day, :day)
+    ON CONFLICT (entity_type, entity_id, metric_name, period_type, period_start)
+    DO UPDATE SET metric_value = EXCLUDED.metric_value
+""")
+
+# One query per scope so each walks its own index backwards and stops after
+# five rows: idx_audit_created for the platform, idx_audit_institution_created
+# (audit_logs.institution_id is filled from the user by a trigger) for an institution
+RECENT_ACTIVITY_PLATFORM_SQL = text("""
+    SELECT u.first_name || ' ' || u.last_name, a.action, a.created_at
+    FROM audit_logs a
+    JOIN users u ON u.id = a.user_id
+    ORDER BY a.created_at DESC
+    LIMIT 5
+""")
+
+RECENT_ACTIVITY_INSTITUTION_SQL = text("""
+    SELECT u.first_name || ' ' || u.last_name, a.action, a.created_at
+    FROM audit_logs a
+    JOIN users u ON u.id = a.user_id
+    WHERE a.institution_id = CAST(:institution_id AS UUID)
+    ORDER BY a.created_at DESC
+    LIMIT 5
+""")
+
+
+def _entities(institution_id):
+    entities = [('platform', PLATFORM_ENTITY_ID)]
+    if institution_id:
+        entities.append(('institution', str(institution_id)))
+    return entities
+
+
+def increment(conn, institution_id, deltas, day=None):
+    """
+    Add `deltas` ({metric_name: amount}) to today's institution and platform rows.
+
+    `conn` is a Session or Connection; the caller owns the transaction so the
+    rollup commits atomically with the event it counts.
+    """
+    day = day or datetime.utcnow().date()
+    params = [
+        {'entity_type': entity_type, 'entity_id': entity_id, 'metric_name': name, 'delta': delta, 'day': day}
+        for entity_type, entity_id in _entities(institution_id)
+        for name, delta in deltas.items()
+        if delta
+    ]
+    if params:
+        conn.execute(UPSERT_INCREMENT_SQL, params)
+
+
+class RollupBuffer:
+    """Rollup deltas summed in process and written in one batched upsert per interval"""
+
+    def __init__(self, engine, flush_interval=5.0):
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self._deltas = defaultdict(float)  # (entity_type, entity_id, metric_name, day) -> amount
+        self._condition = threading.Condition()
+        self._closed = False
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rows_written = 0
+        self._thread = threading.Thread(target=self._run, name='rollup-buffer', daemon=True)
+        self._thread.start()
+
+    def add(self, institution_id, deltas, day=None):
+        """Queue `deltas` ({metric_name: amount}) for today's institution and platform rows"""
+        day = day or datetime.utcnow().date()
+        with self._condition:
+            for entity_type, entity_id in _entities(institution_id):
+                for name, delta in deltas.items():
+                    if delta:
+                        self._deltas[(entity_type, entity_id, name, day)] += delta
+
+    def flush(self):
+        with self._condition:
+            pending, self._deltas = self._deltas, defaultdict(float)
+        if not pending:
+            return 0
+        # Sorted so concurrent workers lock performance_metrics rows in the same order
+        params = [
+            {'entity_type': entity_type, 'entity_id': entity_id, 'metric_name': name, 'delta': delta, 'day': day}
+            for (entity_type, entity_id, name, day), delta in sorted(pending.items())
+        ]
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(UPSERT_INCREMENT_SQL, params)
+        except Exception as e:
+            # Keep the counts for the next flush
+            with self._condition:
+                for key, delta in pending.items():
+                    self._deltas[key] += delta
+                self.failed_flushes += 1
+            logger.warning(f"⚠️  Rollup flush failed, will retry: {e}")
+            return 0
+        with self._condition:
+            self.flushes += 1
+            self.rows_written += len(params)
+        return len(params)
+
+    def close(self, timeout=5.0):
+        """Stop the background thread and flush what is left (registered with atexit)"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed:
+                    self._condition.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'pending': len(self._deltas),
+                'flushes': self.flushes,
+                'failedFlushes': self.failed_flushes,
+                'rowsWritten': self.rows_written,
+            }
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_rollup_buffer(engine=None):
+    """Process-wide buffer over the shared engine, flushed at interpreter shutdown"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            if engine is None:
+                from models import engine
+            _buffer = RollupBuffer(engine, flush_interval=float(os.getenv('ROLLUP_FLUSH_INTERVAL', 5)))
+            atexit.register(_buffer.close)
+        return _buffer
+
+
+def record_new_user(institution_id, count=1):
+    """Count signups; call after the creating transaction commits"""
+    get_rollup_buffer().add(institution_id, {NEW_USERS: count})
+
+
+# =====================================================
+# DASHBOARD READS
+# =====================================================
+
+class DashboardStatsService:
+    """Serves dashboard stats from rollup rows, with a short per-entity cache"""
+
+    def __init__(self, engine, ttl=10.0):
+        self.engine = engine
+        self.ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get_stats(self, institution_id=None):
+        key = str(institution_id) if institution_id else PLATFORM_ENTITY_ID
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                return cached[1]
+
+        stats = self._load(institution_id)
+        with self._lock:
+            self._cache[key] = (now + self.ttl, stats)
+        return stats
+
+    def invalidate(self, institution_id=None):
+        with self._lock:
+            self._cache.pop(str(institution_id) if institution_id else PLATFORM_ENTITY_ID, None)
+
+    def _load(self, institution_id):
+        entity_type, entity_id = ('institution', str(institution_id)) if institution_id else ('platform', PLATFORM_ENTITY_ID)
+        today = datetime.utcnow().date()
+        params = {'entity_type': entity_type, 'entity_id': entity_id, 'today': today}
+
+        with self.engine.connect() as conn:
+            # Today's counters: one row per metric, served by the unique key
+            today_rows = conn.execute(text("""
+                SELECT metric_name, metric_value
+                FROM performance_metrics
+                WHERE entity_type = :entity_type AND entity_id = CAST(:entity_id AS UUID)
+                  AND period_type = 'daily' AND period_start = :today
+            """), params).fetchall()
+            today_metrics = {row[0]: float(row[1]) for row in today_rows}
+
+            # Running total: one row per day, not per user
+            user_count = conn.execute(text("""
+                SELECT COALESCE(SUM(metric_value), 0)
+                FROM performance_metrics
+                WHERE entity_type = :entity_type AND entity_id = CAST(:entity_id AS UUID)
+                  AND metric_name = 'new_users' AND period_type = 'daily'
+            """), params).scalar()
+
+            daily_cap = self._daily_cap(conn, entity_type, entity_id, today)
+
+            recent_activity = conn.execute(
+                RECENT_ACTIVITY_INSTITUTION_SQL if institution_id else RECENT_ACTIVITY_PLATFORM_SQL,
+                {'institution_id': entity_id}
+            ).fetchall()
+
+        requests_today = today_metrics.get(AI_REQUESTS, 0)
+        errors_today = today_metrics.get(AI_ERRORS, 0)
+        api_health = 100.0 if not requests_today else 100.0 * (1 - errors_today / requests_today)
+
+        return {
+            "userCount": int(user_count),
+            "newToday": int(today_metrics.get(NEW_USERS, 0)),
+            "dailyCost": round(today_metrics.get(AI_COST, 0.0), 2),
+            "dailyCap": round(daily_cap, 2),
+            "apiHealth": round(api_health, 1),
+            "recentActivity": [
+                {"user": name, "action": action, "timestamp": created_at.isoformat() + 'Z'}
+                for name, action, created_at in recent_activity
+            ]
+        }
+
+    def _daily_cap(self, conn, entity_type, entity_id, today):
+        if entity_type == 'institution':
+            cap = conn.execute(text("""
+                SELECT daily_limit FROM ai_budgets
+                WHERE entity_type = 'institution' AND entity_id = CAST(:entity_id AS UUID)
+            """), {'entity_id': entity_id}).scalar()
+            if cap is not None:
+                return float(cap)
+        # Platform (or institutions without a budget row): spread the monthly budget evenly
+        monthly_limit = float(os.getenv('MONTHLY_BUDGET_LIMIT', 4.50))
+        return monthly_limit / calendar.monthrange(today.year, today.month)[1]
+
+
+# =====================================================
+# BACKFILL
+# =====================================================
+
+def backfill(engine, days=30):
+    """Rebuild the last `days` of rollups from the source tables (one-off, not on the request path)"""
+    with engine.begin() as conn:
+        return rebuild(conn, days=days)
+
+
+def rebuild(conn, days=30):
+    """Backfill inside an existing transaction; migration 10 seeds new deployments with it"""
+    # Imported here: usage_logs itself imports this module
+    from usage_logs import FAILED_STATUSES
+
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    new_users = conn.execute(text("""
+        SELECT institution_id, created_at::date AS day, COUNT(*)
+        FROM users
+        WHERE created_at >= :since
+        GROUP BY institution_id, created_at::date
+    """), {'since': since}).fetchall()
+
+    usage = conn.execute(text("""
+        SELECT u.institution_id, l.created_at::date AS day, COUNT(*),
+               COUNT(*) FILTER (WHERE l.status = ANY(:failed)), COALESCE(SUM(l.cost), 0)
+        FROM ai_usage_logs l
+        JOIN users u ON u.id = l.user_id
+        WHERE l.created_at >= :since
+        GROUP BY u.institution_id, l.created_at::date
+    """), {'since': since, 'failed': list(FAILED_STATUSES)}).fetchall()
+
+    totals = {}
+    for institution_id, day, count in new_users:
+        for entity in _entities(institution_id):
+            totals[(entity, NEW_USERS, day)] = totals.get((entity, NEW_USERS, day), 0) + count
+    for institution_id, day, requests, errors, cost in usage:
+        for entity in _entities(institution_id):
+            for name, value in ((AI_REQUESTS, requests), (AI_ERRORS, errors), (AI_COST, float(cost))):
+                totals[(entity, name, day)] = totals.get((entity, name, day), 0) + value
+
+    # Users created before the window still count towards the running total,
+    # collapsed into a single baseline row per entity
+    older = conn.execute(text("""
+        SELECT institution_id, COUNT(*) FROM users WHERE created_at < :since GROUP BY institution_id
+    """), {'since': since}).fetchall()
+    baseline_day = since - timedelta(days=1)
+    for institution_id, count in older:
+        for entity in _entities(institution_id):
+            key = (entity, NEW_USERS, baseline_day)
+            totals[key] = totals.get(key, 0) + count
+
+    conn.execute(text("""
+        DELETE FROM performance_metrics
+        WHERE metric_name = 'new_users' AND period_type = 'daily' AND period_start < :since
+    """), {'since': since})
+
+    params = [
+        {'entity_type': entity[0], 'entity_id': str(entity[1]), 'metric_name': name, 'delta': value, 'day': day}
+        for (entity, name, day), value in totals.items()
+    ]
+    if params:
+        conn.execute(UPSERT_REPLACE_SQL, params)
+
+    return len(totals)
+
+
+if __name__ == "__main__":
+    from models import engine
+
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    print(f"📊 Backfilling dashboard rollups for the last {days} days...")
+    rows = backfill(engine, days=days)
+    print(f"✅ Wrote {rows} rollup rows")
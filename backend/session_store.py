@@ -0,0 +1,314 @@
+# backend/session_store.py
+"""
+Bounded conversation memory for the chat service.
+
+Sessions live in an LRU map with an idle TTL, a per-session token budget and
+a global byte budget. Sessions are keyed by (user_id, session_id), so a
+client-chosen session_id never reaches another user's history. Evicted
+sessions can optionally be spilled to
+conversation_messages and rehydrated the next time the session is used; with
+spill enabled, messages are also persisted before the token budget truncates
+them, and `sequence_offset` is re-anchored on the sequence numbers the
+database hands out.
+"""
+
+import os
+import time
+import asyncio
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from llm import estimate_tokens
+from conversations import ConversationRepository, from_langchain, to_langchain
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message bookkeeping cost on top of the UTF-8 payload
+MESSAGE_OVERHEAD_BYTES = 200
+
+# Deterministic conversation ids so a user's session maps to the same row every time
+SESSION_NAMESPACE = uuid.UUID('5b0c1f0e-8d4a-4f7e-9a57-3c1d2b6e8f10')
+
+
+def session_key(session_id, user_id=None):
+    """Store, lock and conversation key: the same session_id under two users is two sessions"""
+    return f"{user_id or ''}:{session_id}"
+
+
+def conversation_id_for(session_id, user_id):
+    return uuid.uuid5(SESSION_NAMESPACE, session_key(session_id, user_id))
+
+
+class ChatSession:
+    """A session's LangChain memory/chain plus its accounting"""
+
+    def __init__(self, session_id, memory, chain=None, user_id=None):
+        self.session_id = session_id
+        self.memory = memory
+        self.chain = chain
+        self.user_id = user_id
+        self.token_count = 0
+        self.byte_size = 0
+        self.accounted_bytes = 0  # what the store currently counts for this session
+        self.persisted_count = 0  # leading messages already stored in conversation_messages
+        self.sequence_offset = 0  # messages before messages[0] (summarized, truncated or not loaded)
+        self.last_access = time.monotonic()
+
+    @property
+    def key(self):
+        return session_key(self.session_id, self.user_id)
+
+    @property
+    def messages(self):
+        return self.memory.chat_memory.messages
+
+    def recount(self):
+        summary = getattr(self.memory, 'summary', '')
+        self.token_count = sum(estimate_tokens(m.content) for m in self.messages) + (estimate_tokens(summary) if summary else 0)
+        self.byte_size = sum(len(m.content.encode('utf-8')) + MESSAGE_OVERHEAD_BYTES for m in self.messages)
+
+
+class BaseSessionStore:
+    """Interface for chat session stores"""
+
+    def get(self, session_id, user_id=None):
+        raise NotImplementedError
+
+    def commit(self, session):
+        """Called after a turn so the store can enforce budgets and account memory"""
+        raise NotImplementedError
+
+    def discard(self, session_id, user_id=None):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class InMemorySessionStore(BaseSessionStore):
+    """LRU + idle-TTL session store with per-session token and global byte budgets"""
+
+    def __init__(self, build_session, max_sessions=1000, ttl_seconds=3600,
+                 max_total_bytes=64 * 1024 * 1024, max_tokens_per_session=2000, spill=None):
+        self.build_session = build_session
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_total_bytes = max_total_bytes
+        self.max_tokens_per_session = max_tokens_per_session
+        self.spill = spill
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.rehydrations = 0
+        self.truncated_messages = 0
+
+    def get(self, session_id, user_id=None):
+        key = session_key(session_id, user_id)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                session.last_access = time.monotonic()
+                self._sessions.move_to_end(key)
+                return session
+
+        # Miss: rebuild, rehydrating the user's own history from the spill table when possible
+        messages, summary, offset = ([], None, 0)
+        if self.spill and user_id:
+            messages, summary, offset = self.spill.load(session_id, user_id, self.max_tokens_per_session)
+        session = self.build_session(session_id, messages)
+        session.user_id = user_id
+        session.persisted_count = len(messages)
+        session.sequence_offset = offset
+        if summary and hasattr(session.memory, 'summary'):
+            session.memory.summary = summary
+        session.recount()
+
+        with self._lock:
+            existing = self._sessions.get(key)
+            if existing is not None:
+                # Another request created it while we were loading
+                self._sessions.move_to_end(key)
+                return existing
+            if messages:
+                self.rehydrations += 1
+            self._sessions[key] = session
+            self._total_bytes += session.byte_size
+            session.accounted_bytes = session.byte_size
+            evicted = self._evict_locked(keep=key)
+
+        self._spill_evicted(evicted)
+        return session
+
+    def commit(self, session):
+        messages = session.messages
+        session.recount()
+
+        # Drop whole turns (user + assistant) from the front until under budget
+        truncated = 0
+        if session.token_count > self.max_tokens_per_session and len(messages) > 2:
+            self._persist(session)
+        while session.token_count > self.max_tokens_per_session and len(messages) > 2:
+            del messages[:2]
+            truncated += 2
+            session.persisted_count = max(session.persisted_count - 2, 0)
+            session.sequence_offset += 2
+            session.recount()
+
+        session.last_access = time.monotonic()
+
+        with self._lock:
+            self.truncated_messages += truncated
+            if self._sessions.get(session.key) is session:
+                self._total_bytes += session.byte_size - session.accounted_bytes
+                session.accounted_bytes = session.byte_size
+            evicted = self._evict_locked(keep=session.key)
+
+        self._spill_evicted(evicted)
+
+    def discard(self, session_id, user_id=None):
+        with self._lock:
+            session = self._sessions.pop(session_key(session_id, user_id), None)
+            if session is not None:
+                self._total_bytes -= session.accounted_bytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self._sessions),
+                'maxSessions': self.max_sessions,
+                'totalBytes': self._total_bytes,
+                'maxTotalBytes': self.max_total_bytes,
+                'evictions': self.evictions,
+                'rehydrations': self.rehydrations,
+                'truncatedMessages': self.truncated_messages,
+            }
+
+    def _evict_locked(self, keep=None):
+        """Evict expired, then least-recently-used sessions; return the evicted ones"""
+        evicted = []
+        cutoff = time.monotonic() - self.ttl_seconds
+
+        # Ordered by recency, so stop at the first session that is still fresh
+        for key, session in list(self._sessions.items()):
+            if session.last_access >= cutoff:
+                break
+            if key != keep:
+                evicted.append(self._sessions.pop(key))
+                self._total_bytes -= session.accounted_bytes
+
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self._total_bytes > self.max_total_bytes
+        ):
+            oldest_id = next(iter(self._sessions))
+            if oldest_id == keep:
+                self._sessions.move_to_end(oldest_id)
+                continue
+            evicted.append(self._sessions.pop(oldest_id))
+            self._total_bytes -= evicted[-1].accounted_bytes
+
+        self.evictions += len(evicted)
+        return evicted
+
+    def _persist(self, session):
+        """Spill unpersisted messages so truncation does not lose them"""
+        if not self.spill or not session.user_id or session.persisted_count >= len(session.messages):
+            return
+        try:
+            self.spill.save(session)
+        except Exception as e:
+            logger.warning(f"⚠️  Could not persist session {session.session_id} before truncating: {e}")
+
+    def _spill_evicted(self, evicted):
+        if not self.spill:
+            return
+        for session in evicted:
+            if session.user_id and session.messages:
+                try:
+                    self.spill.save(session)
+                except Exception as e:
+                    logger.warning(f"⚠️  Could not spill session {session.session_id}: {e}")
+
+
+class ConversationSpill:
+    """Persists evicted sessions to conversations/conversation_messages"""
+
+    def __init__(self, engine):
+        self.repository = ConversationRepository(engine)
+
+    @staticmethod
+    def conversation_id(session):
+        return conversation_id_for(session.session_id, session.user_id)
+
+    def save(self, session):
+        """Append only the messages not stored yet (earlier spills or rehydration)"""
+        new_messages = session.messages[session.persisted_count:]
+        if not new_messages:
+            return
+        conversation_id = self.conversation_id(session)
+        with self.repository.engine.begin() as conn:
+            self.repository.ensure(
+                conversation_id, session.user_id,
+                title=f"Chat session {session.session_id}",
+                metadata={'session_id': session.session_id},
+                conn=conn
+            )
+            self.repository.check_owner(conversation_id, session.user_id, conn=conn)
+            sequences = self.repository.append(conversation_id, from_langchain(new_messages), conn=conn)
+        session.persisted_count = len(session.messages)
+        # The last message now holds sequences[-1]; keep offsets in step with message_count
+        session.sequence_offset = sequences[-1] - len(session.messages)
+
+    def load(self, session_id, user_id, max_tokens):
+        """
+        (messages, summary, sequence_offset) for a user's session: the latest
+        summary plus the newest messages after it that fit the token budget
+        """
+        conversation_id = conversation_id_for(session_id, user_id)
+        self.repository.check_owner(conversation_id, user_id)
+        summary, summarized_through = self.repository.latest_summary(conversation_id)
+        budget = max_tokens - (estimate_tokens(summary) if summary else 0)
+        rows = self.repository.recent_within(conversation_id, budget, after=summarized_through)
+        offset = rows[0]['sequence_number'] - 1 if rows else summarized_through
+        return to_langchain(rows), summary, offset
+
+
+def session_store_from_env(build_session, engine=None):
+    """Store configured from CHAT_* variables; spill is enabled only with an engine"""
+    spill = None
+    if engine is not None and os.getenv('CHAT_SPILL_ENABLED', 'False').lower() == 'true':
+        spill = ConversationSpill(engine)
+    return InMemorySessionStore(
+        build_session,
+        max_sessions=int(os.getenv('CHAT_MAX_SESSIONS', 1000)),
+        ttl_seconds=float(os.getenv('CHAT_SESSION_TTL', 3600)),
+        max_total_bytes=int(os.getenv('CHAT_MEMORY_MAX_BYTES', 64 * 1024 * 1024)),
+        max_tokens_per_session=int(os.getenv('CHAT_SESSION_TOKEN_BUDGET', 2000)),
+        spill=spill,
+    )
+
+
+class SessionLocks:
+    """Per-session asyncio locks, dropped once no request holds or waits on them"""
+
+    def __init__(self):
+        self._locks = {}
+
+    @asynccontextmanager
+    async def hold(self, session_id):
+        entry = self._locks.get(session_id)
+        if entry is None:
+            entry = self._locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._locks)
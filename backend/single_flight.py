@@ -0,0 +1,218 @@
+# backend/single_flight.py
+"""
+Single-flight coalescing of identical in-flight LLM prompts.
+
+Requests that share a response-cache key (tool, model settings, normalized
+prompt) while one of them is already waiting on the provider join that
+call instead of making their own. The first request (the leader) makes the
+upstream call; followers receive the same text, or replay and then follow
+the same token stream. Streams are pumped by a background thread, so a
+participant disconnecting never cuts off the others; the upstream stream is
+closed once nobody is listening. If the leader's call fails, each follower
+gets a copy of its exception (same type, chained to the original), so they
+fail with the same status as the leader.
+
+Usage attribution: the leader's ai_usage_logs row carries the real tokens
+and cost; each follower gets its own row with status 'coalesced' and zero
+cost, like a cache hit. Coalescing is per worker process.
+"""
+
+import os
+import copy
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+COALESCED_STATUS = 'coalesced'
+
+
+class FlightError(RuntimeError):
+    """Raised to listeners when the shared call ended without the provider failing (e.g. abandoned)"""
+
+
+class Flight:
+    """One upstream call and everything it has produced so far"""
+
+    def __init__(self, key, on_done):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.usage = None
+        self.followers = 0
+        self.subscribers = 0
+        self._condition = threading.Condition()
+        self._on_done = on_done
+
+    @property
+    def text(self):
+        return ''.join(self.chunks)
+
+    def publish(self, content):
+        with self._condition:
+            self.chunks.append(content)
+            self._condition.notify_all()
+
+    def finish(self, usage=None, error=None):
+        with self._condition:
+            if self.done:
+                return
+            self.done = True
+            self.usage = usage
+            self.error = error
+            self._condition.notify_all()
+        self._on_done(self)
+
+    def wait(self, timeout):
+        """Block until the call completes; returns the full text"""
+        with self._condition:
+            # Counts as listening, so a streamed flight is not cancelled under a plain waiter
+            self.subscribers += 1
+            try:
+                if not self._condition.wait_for(lambda: self.done, timeout):
+                    raise TimeoutError(f"Timed out after {timeout}s waiting for a coalesced LLM call")
+            finally:
+                self.subscribers -= 1
+        if self.error is not None:
+            self._raise_error()
+        return self.text
+
+    def _raise_error(self):
+        # A fresh copy per listener, chained to the leader's exception: raising the shared
+        # object from several threads would splice their tracebacks together. The copy keeps
+        # the leader's type, so followers map it to the same response (LimiterRejected -> 503).
+        try:
+            error = copy.copy(self.error)
+        except Exception:
+            error = FlightError(f"Coalesced LLM call failed: {self.error!r}")
+        raise error.with_traceback(None) from self.error
+
+    def subscribe(self, timeout):
+        """
+        Iterator over every chunk, replaying those already produced, until the
+        call completes. Registers the listener immediately, before iteration.
+        """
+        with self._condition:
+            self.subscribers += 1
+        return self._follow(timeout)
+
+    def _follow(self, timeout):
+        position = 0
+        try:
+            while True:
+                with self._condition:
+                    if not self._condition.wait_for(lambda: len(self.chunks) > position or self.done, timeout):
+                        raise TimeoutError(f"No tokens for {timeout}s from a coalesced LLM stream")
+                    pending = self.chunks[position:]
+                    finished = self.done
+                position += len(pending)
+                yield from pending
+                if finished:
+                    break
+            if self.error is not None:
+                self._raise_error()
+        finally:
+            with self._condition:
+                self.subscribers -= 1
+
+
+class SingleFlight:
+    """Registry of in-flight calls keyed by response-cache key"""
+
+    def __init__(self, wait_timeout=120):
+        self.wait_timeout = wait_timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.collapsed = 0
+        self.failures = 0
+
+    def join(self, key):
+        """(flight, is_leader); the leader must make the call and finish() the flight"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.collapsed += 1
+                return flight, False
+            flight = self._flights[key] = Flight(key, self._forget)
+            self.leaders += 1
+            return flight, True
+
+    def _forget(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            if flight.error is not None:
+                self.failures += 1
+
+    def call(self, flight, invoke, meter, on_success=None):
+        """
+        Leader side of a plain call: invoke(), then publish the text and finish
+        the flight. on_success(text) runs first, so a response cached there is
+        visible before the flight stops accepting followers.
+        """
+        try:
+            meter.add(invoke())
+            if on_success is not None:
+                on_success(meter.text)
+        except Exception as e:
+            flight.finish(error=e)
+            raise
+        flight.publish(meter.text)
+        flight.finish(usage=meter.summary())
+        return meter.text
+
+    def pump(self, flight, open_stream, meter, on_complete=None):
+        """
+        Leader side of a streamed call: drain open_stream() into the flight from
+        a background thread. on_complete(status, meter, error) runs when the
+        upstream stream ends, whoever is still listening. Subscribe the leader
+        before calling this, or the first chunk finds nobody listening.
+        """
+        def run():
+            status, error = 'success', None
+            chunks = None
+            try:
+                chunks = open_stream()
+                for chunk in chunks:
+                    content = meter.add(chunk)
+                    if content:
+                        flight.publish(content)
+                    if flight.subscribers == 0:
+                        status = 'cancelled'
+                        break
+            except Exception as e:
+                status, error = 'error', e
+            finally:
+                if chunks is not None and hasattr(chunks, 'close'):
+                    chunks.close()
+                # Before finishing, so a response cached by the hook is visible to the next request
+                if on_complete is not None:
+                    try:
+                        on_complete(status, meter, error)
+                    except Exception as e:
+                        logger.warning(f"⚠️  Coalesced stream completion hook failed: {e}")
+                if status == 'cancelled':
+                    error = FlightError('Every listener disconnected')
+                flight.finish(usage=meter.summary(), error=error if status != 'success' else None)
+
+        thread = threading.Thread(target=run, name='single-flight-pump', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._lock:
+            calls = self.leaders + self.collapsed
+            return {
+                'inFlight': len(self._flights),
+                'upstreamCalls': self.leaders,
+                'collapsedDuplicates': self.collapsed,
+                'collapseRate': round(self.collapsed / calls, 4) if calls else 0.0,
+                'failedCalls': self.failures,
+            }
+
+
+def single_flight_from_env():
+    return SingleFlight(wait_timeout=float(os.getenv('SINGLE_FLIGHT_WAIT_TIMEOUT', 120)))
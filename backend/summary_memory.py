@@ -0,0 +1,168 @@
+# backend/summary_memory.py
+"""
+Summary-buffer conversation memory.
+
+Prompts are built from a rolling summary of older turns plus a window of
+recent messages, so prompt size stays roughly flat however long a session
+runs. Once a session's messages pass CHAT_SUMMARY_TRIGGER_TOKENS, the oldest
+whole turns outside the CHAT_SUMMARY_RECENT_TOKENS window are folded into the
+summary by a background task; the turn that crossed the threshold is not
+delayed. With a database, summaries are persisted to conversation_summaries
+with the message sequence range they cover and restored on rehydration.
+"""
+
+import os
+import asyncio
+import logging
+from collections import defaultdict
+from langchain.memory import ConversationBufferMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain_core.messages import get_buffer_string
+from llm import estimate_tokens, UsageMeter
+
+logger = logging.getLogger(__name__)
+
+# Prompt-size metrics are bucketed by turn number to show they stay flat
+TURN_BUCKETS = ((1, 5), (6, 10), (11, 20), (21, 50), (51, None))
+
+
+class SummaryBufferMemory(ConversationBufferMemory):
+    """ConversationBufferMemory whose history starts with a rolling summary"""
+
+    summary: str = ''
+
+    def load_memory_variables(self, inputs):
+        variables = super().load_memory_variables(inputs)
+        if self.summary and not self.return_messages:
+            variables[self.memory_key] = (
+                f"Summary of the earlier conversation:\n{self.summary}\n\n{variables[self.memory_key]}"
+            ).rstrip()
+        return variables
+
+
+class PromptSizeMetrics:
+    """Prompt tokens per turn, aggregated into turn-number buckets"""
+
+    def __init__(self):
+        self._totals = defaultdict(lambda: [0, 0])
+
+    def record(self, turn, prompt_tokens):
+        for low, high in TURN_BUCKETS:
+            if turn >= low and (high is None or turn <= high):
+                bucket = self._totals[f"{low}-{high}" if high else f"{low}+"]
+                bucket[0] += 1
+                bucket[1] += prompt_tokens
+                return
+
+    def stats(self):
+        return {
+            label: {'turns': turns, 'meanPromptTokens': round(tokens / turns, 1)}
+            for label, (turns, tokens) in self._totals.items()
+        }
+
+
+class SummaryManager:
+    """Schedules background summarization of sessions that outgrow the trigger"""
+
+    def __init__(self, llm, session_locks, trigger_tokens=1200, recent_tokens=600, concurrency=4,
+                 spill=None, on_usage=None):
+        self.llm = llm
+        self.session_locks = session_locks
+        self.trigger_tokens = trigger_tokens
+        self.recent_tokens = recent_tokens
+        self.spill = spill  # ConversationSpill: persists summarized messages and the summary itself
+        self.on_usage = on_usage  # callable(session, usage summary, (start, end))
+        self._slots = asyncio.Semaphore(concurrency)
+        self._in_flight = set()
+        self._tasks = set()
+        self.prompt_metrics = PromptSizeMetrics()
+        self.summarized_turns = 0
+        self.summaries_written = 0
+        self.failures = 0
+
+    def record_turn(self, session, prompt):
+        """Count the prompt tokens of the turn about to be sent"""
+        turn = (session.sequence_offset + len(session.messages)) // 2 + 1
+        self.prompt_metrics.record(turn, estimate_tokens(prompt))
+
+    def maybe_schedule(self, session):
+        """Start a background summarization if the session passed the trigger (call after commit)"""
+        if session.key in self._in_flight or session.token_count <= self.trigger_tokens:
+            return None
+        count = self._prefix_to_summarize(session.messages)
+        if not count:
+            return None
+        self._in_flight.add(session.key)
+        task = asyncio.create_task(self._summarize(session, list(session.messages[:count])))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _prefix_to_summarize(self, messages):
+        """Number of leading messages (whole turns) outside the recent window"""
+        kept, index = 0, len(messages)
+        while index > 0 and kept + estimate_tokens(messages[index - 1].content) <= self.recent_tokens:
+            index -= 1
+            kept += estimate_tokens(messages[index].content)
+        return index - index % 2
+
+    async def _summarize(self, session, batch):
+        try:
+            async with self._slots:
+                prompt = SUMMARY_PROMPT.format(summary=session.memory.summary, new_lines=get_buffer_string(batch))
+                meter = UsageMeter(self.llm.model_name, prompt)
+                meter.add(await self.llm.ainvoke(prompt))
+
+            async with self.session_locks.hold(session.key):
+                # Turns may have been truncated away meanwhile; only fold in what is still at the front
+                if len(session.messages) < len(batch) or any(a is not b for a, b in zip(session.messages, batch)):
+                    return
+                if self.spill is not None and session.user_id:
+                    # Saving re-anchors sequence_offset, so take the range afterwards
+                    await asyncio.to_thread(self.spill.save, session)
+                start = session.sequence_offset + 1
+                end = session.sequence_offset + len(batch)
+                del session.messages[:len(batch)]
+                session.memory.summary = meter.text.strip()
+                session.sequence_offset = end
+                session.persisted_count = max(session.persisted_count - len(batch), 0)
+                session.recount()
+                self.summarized_turns += len(batch) // 2
+
+                if self.spill is not None and session.user_id:
+                    await asyncio.to_thread(
+                        self.spill.repository.add_summary, self.spill.conversation_id(session),
+                        session.memory.summary, start, end, sum(estimate_tokens(m.content) for m in batch)
+                    )
+                    self.summaries_written += 1
+
+            if self.on_usage is not None:
+                self.on_usage(session, meter.summary(), (start, end))
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"⚠️  Summarizing session {session.session_id} failed: {e}")
+        finally:
+            self._in_flight.discard(session.key)
+
+    def stats(self):
+        return {
+            'triggerTokens': self.trigger_tokens,
+            'recentTokens': self.recent_tokens,
+            'inFlight': len(self._in_flight),
+            'summarizedTurns': self.summarized_turns,
+            'summariesWritten': self.summaries_written,
+            'failures': self.failures,
+            'promptTokensByTurn': self.prompt_metrics.stats(),
+        }
+
+
+def summary_manager_from_env(llm, session_locks, spill=None, on_usage=None):
+    """Manager configured from CHAT_SUMMARY_* variables; summaries are persisted when spill is enabled"""
+    return SummaryManager(
+        llm, session_locks,
+        trigger_tokens=int(os.getenv('CHAT_SUMMARY_TRIGGER_TOKENS', 1200)),
+        recent_tokens=int(os.getenv('CHAT_SUMMARY_RECENT_TOKENS', 600)),
+        concurrency=int(os.getenv('CHAT_SUMMARY_CONCURRENCY', 4)),
+        spill=spill,
+        on_usage=on_usage,
+    )
@@ -0,0 +1,345 @@
+# backend/tool_registry.py
+"""
+In-process registry of ai_tools and ai_agents.
+
+Both tables are read once into an immutable snapshot: tuples of named
+records, read-only maps by id and name, per-role and per-(role, category)
+tool tuples, and the compiled routing matcher (tool_router.py). Lookups are
+dict hits against the current snapshot; a reload builds a new snapshot and
+swaps it in with one assignment, so readers never lock or see a half-built
+registry.
+
+Migration 7 bumps tool_registry_version (and NOTIFYs tool_registry_changed)
+on every change to either table. Each worker polls that one-row table at
+most every TOOL_REGISTRY_POLL_INTERVAL seconds, or with TOOL_REGISTRY_NOTIFY
+enabled LISTENs and reloads as soon as the change commits.
+"""
+
+import os
+import json
+import time
+import select
+import logging
+import threading
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+from sqlalchemy import text
+from tool_router import CompiledMatcher, ROLES, ALL_ROLES, ROLE_BITS, mask_for, normalize_role, role_mask
+
+logger = logging.getLogger(__name__)
+
+CHANGE_CHANNEL = 'tool_registry_changed'
+
+TOOLS_SQL = """
+    SELECT CAST(id AS TEXT) AS id, name, display_name, description, CAST(category AS TEXT) AS category,
+           CAST(allowed_roles AS TEXT[]) AS allowed_roles, requires_approval, implementation_type,
+           default_model, model_settings, CAST(system_prompt_template_id AS TEXT) AS system_prompt_template_id,
+           CAST(user_prompt_template_id AS TEXT) AS user_prompt_template_id, estimated_tokens_per_use,
+           cost_per_use, daily_limit_per_user, tags, keywords
+    FROM ai_tools
+    WHERE is_active
+    ORDER BY name
+"""
+
+AGENTS_SQL = """
+    SELECT CAST(id AS TEXT) AS id, name, display_name, description, agent_type,
+           CAST(available_tools AS TEXT[]) AS available_tools, tool_selection_strategy,
+           CAST(system_prompt_id AS TEXT) AS system_prompt_id, CAST(memory_type AS TEXT) AS memory_type,
+           memory_config, max_iterations, CAST(allowed_roles AS TEXT[]) AS allowed_roles, requires_approval
+    FROM ai_agents
+    WHERE is_active
+    ORDER BY name
+"""
+
+
+def _frozen(value):
+    """Read-only view of a JSONB value (psycopg2 returns dicts, other drivers may return text)"""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return MappingProxyType(dict(value or {}))
+
+
+class ToolInfo(NamedTuple):
+    id: str
+    name: str
+    display_name: str
+    description: Optional[str]
+    category: str
+    allowed_roles: frozenset
+    role_mask: int
+    requires_approval: bool
+    implementation_type: Optional[str]
+    default_model: Optional[str]
+    model_settings: MappingProxyType
+    system_prompt_template_id: Optional[str]
+    user_prompt_template_id: Optional[str]
+    estimated_tokens_per_use: Optional[int]
+    cost_per_use: Optional[float]
+    daily_limit_per_user: Optional[int]
+    tags: tuple
+    keywords: tuple
+
+    @classmethod
+    def from_row(cls, row):
+        roles = frozenset(normalize_role(role) for role in row['allowed_roles'] or ())
+        return cls(
+            id=row['id'], name=row['name'], display_name=row['display_name'], description=row['description'],
+            category=row['category'], allowed_roles=roles, role_mask=role_mask(roles),
+            requires_approval=bool(row['requires_approval']), implementation_type=row['implementation_type'],
+            default_model=row['default_model'], model_settings=_frozen(row['model_settings']),
+            system_prompt_template_id=row['system_prompt_template_id'],
+            user_prompt_template_id=row['user_prompt_template_id'],
+            estimated_tokens_per_use=row['estimated_tokens_per_use'],
+            cost_per_use=float(row['cost_per_use']) if row['cost_per_use'] is not None else None,
+            daily_limit_per_user=row['daily_limit_per_user'],
+            tags=tuple(row['tags'] or ()), keywords=tuple(row['keywords'] or ()),
+        )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'displayName': self.display_name,
+            'description': self.description,
+            'category': self.category,
+            'allowedRoles': sorted(self.allowed_roles),
+            'requiresApproval': self.requires_approval,
+            'defaultModel': self.default_model,
+            'dailyLimitPerUser': self.daily_limit_per_user,
+            'tags': list(self.tags),
+        }
+
+
+class AgentInfo(NamedTuple):
+    id: str
+    name: str
+    display_name: str
+    description: Optional[str]
+    agent_type: Optional[str]
+    available_tools: tuple  # tool ids
+    tool_selection_strategy: Optional[str]
+    system_prompt_id: Optional[str]
+    memory_type: Optional[str]
+    memory_config: MappingProxyType
+    max_iterations: Optional[int]
+    allowed_roles: frozenset
+    role_mask: int
+    requires_approval: bool
+
+    @classmethod
+    def from_row(cls, row):
+        roles = frozenset(normalize_role(role) for role in row['allowed_roles'] or ())
+        return cls(
+            id=row['id'], name=row['name'], display_name=row['display_name'], description=row['description'],
+            agent_type=row['agent_type'], available_tools=tuple(row['available_tools'] or ()),
+            tool_selection_strategy=row['tool_selection_strategy'], system_prompt_id=row['system_prompt_id'],
+            memory_type=row['memory_type'], memory_config=_frozen(row['memory_config']),
+            max_iterations=row['max_iterations'], allowed_roles=roles, role_mask=role_mask(roles),
+            requires_approval=bool(row['requires_approval']),
+        )
+
+
+def _visible(items, role):
+    """Items whose allowed_roles include `role` (superadmin sees everything)"""
+    mask = ALL_ROLES if role == 'superadmin' else ROLE_BITS[role]
+    return tuple(item for item in items if item.role_mask & mask)
+
+
+class RegistrySnapshot:
+    """Immutable view of the active tools and agents at one registry version"""
+
+    def __init__(self, tools, agents, version=None):
+        self.version = version
+        self.loaded_at = time.time()
+        self.tools = tuple(tools)
+        self.agents = tuple(agents)
+        self.tools_by_id = MappingProxyType({tool.id: tool for tool in self.tools})
+        self.tools_by_name = MappingProxyType({tool.name: tool for tool in self.tools})
+        self.agents_by_name = MappingProxyType({agent.name: agent for agent in self.agents})
+
+        by_role, by_role_category = {}, {}
+        for role in ROLES:
+            visible = _visible(self.tools, role)
+            by_role[role] = visible
+            for tool in visible:
+                by_role_category.setdefault((role, tool.category), []).append(tool)
+        self.tools_by_role = MappingProxyType(by_role)
+        self.tools_by_role_category = MappingProxyType({key: tuple(tools) for key, tools in by_role_category.items()})
+        self.agents_by_role = MappingProxyType({role: _visible(self.agents, role) for role in ROLES})
+
+        self.matcher = CompiledMatcher([tool._asdict() for tool in self.tools])
+
+
+class ToolRegistry:
+    """Current RegistrySnapshot plus reload by version poll or LISTEN/NOTIFY"""
+
+    def __init__(self, engine, poll_interval=30.0, notify=False):
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.notify = notify
+        self._snapshot = RegistrySnapshot((), ())
+        self._checked_at = 0.0
+        self._loaded = False
+        self._reload_lock = threading.Lock()
+        self._listener = None
+        self.reloads = 0
+        self.failures = 0
+
+    # Loading
+
+    def current_version(self, conn):
+        """Registry version from migration 7, or None on a database without it"""
+        if not conn.execute(text("SELECT to_regclass('tool_registry_version') IS NOT NULL")).scalar():
+            return None
+        return conn.execute(text("SELECT version FROM tool_registry_version")).scalar()
+
+    def load(self):
+        """Read both tables and swap in a new snapshot; returns it"""
+        with self.engine.connect() as conn:
+            version = self.current_version(conn)
+            tools = [ToolInfo.from_row(row) for row in conn.execute(text(TOOLS_SQL)).mappings()]
+            has_agents = conn.execute(text("SELECT to_regclass('ai_agents') IS NOT NULL")).scalar()
+            agents = [AgentInfo.from_row(row) for row in conn.execute(text(AGENTS_SQL)).mappings()] if has_agents else []
+        snapshot = RegistrySnapshot(tools, agents, version=version)
+        self._snapshot = snapshot
+        self._loaded = True
+        self.reloads += 1
+        logger.info(f"🧰 Tool registry v{version}: {len(tools)} tools, {len(agents)} agents")
+        return snapshot
+
+    def snapshot(self):
+        """Current snapshot, loading on first use and reloading if the version moved"""
+        if not self._loaded or (not self.notify and time.monotonic() - self._checked_at > self.poll_interval):
+            self._refresh()
+        return self._snapshot
+
+    def _refresh(self):
+        # One thread checks; the others keep serving the snapshot they have
+        if not self._reload_lock.acquire(blocking=not self._loaded):
+            return
+        try:
+            if self._loaded and time.monotonic() - self._checked_at <= self.poll_interval and not self.notify:
+                return
+            self._checked_at = time.monotonic()
+            if self._loaded:
+                with self.engine.connect() as conn:
+                    version = self.current_version(conn)
+                if version is not None and version == self._snapshot.version:
+                    return
+            self.load()
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"⚠️  Tool registry reload failed: {e}")
+        finally:
+            self._reload_lock.release()
+
+    def invalidate(self):
+        """Force a reload on next access"""
+        self._loaded = False
+
+    # Lookups (all dict hits on the current snapshot)
+
+    def tool(self, name_or_id):
+        snapshot = self.snapshot()
+        return snapshot.tools_by_name.get(name_or_id) or snapshot.tools_by_id.get(name_or_id)
+
+    def tools_for(self, role, category=None):
+        """Tools `role` may use, optionally only those in `category`"""
+        role = normalize_role(role)
+        snapshot = self.snapshot()
+        if category is None:
+            return snapshot.tools_by_role.get(role, ())
+        return snapshot.tools_by_role_category.get((role, category), ())
+
+    def can_use(self, role, name_or_id):
+        tool = self.tool(name_or_id)
+        return tool is not None and bool(tool.role_mask & mask_for(role))
+
+    def agent(self, name):
+        return self.snapshot().agents_by_name.get(name)
+
+    def agents_for(self, role):
+        return self.snapshot().agents_by_role.get(normalize_role(role), ())
+
+    def agent_tools(self, name):
+        """The agent's available tools that are active, in its configured order"""
+        snapshot = self.snapshot()
+        agent = snapshot.agents_by_name.get(name)
+        if agent is None:
+            return ()
+        return tuple(snapshot.tools_by_id[tool_id] for tool_id in agent.available_tools
+                     if tool_id in snapshot.tools_by_id)
+
+    @property
+    def matcher(self):
+        return self.snapshot().matcher
+
+    # Cross-worker reloads
+
+    def start_listener(self):
+        """Reload when another connection NOTIFYs a change (needs TOOL_REGISTRY_NOTIFY)"""
+        if self.notify and self._listener is None:
+            self._listener = threading.Thread(target=self._listen, name='tool-registry-listener', daemon=True)
+            self._listener.start()
+        return self
+
+    def _listen(self):
+        while True:
+            connection = None
+            try:
+                connection = self.engine.raw_connection()
+                dbapi = connection.dbapi_connection
+                dbapi.autocommit = True
+                cursor = dbapi.cursor()
+                cursor.execute(f"LISTEN {CHANGE_CHANNEL}")
+                # Anything may have changed while we were not listening
+                self.load()
+                while True:
+                    if select.select([dbapi], [], [], 30.0) == ([], [], []):
+                        continue
+                    dbapi.poll()
+                    if dbapi.notifies:
+                        # A burst of changes is one reload
+                        dbapi.notifies.clear()
+                        self.load()
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"⚠️  Tool registry listener disconnected: {e}")
+                time.sleep(5)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.invalidate()
+                    except Exception:
+                        pass
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'version': snapshot.version,
+            'tools': len(snapshot.tools),
+            'agents': len(snapshot.agents),
+            'loadedAt': snapshot.loaded_at if self._loaded else None,
+            'reloads': self.reloads,
+            'failures': self.failures,
+            'mode': 'notify' if self.notify else 'poll',
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_tool_registry(engine=None):
+    """Process-wide registry configured from TOOL_REGISTRY_POLL_INTERVAL / TOOL_REGISTRY_NOTIFY"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            if engine is None:
+                from models import engine
+            _registry = ToolRegistry(
+                engine,
+                poll_interval=float(os.getenv('TOOL_REGISTRY_POLL_INTERVAL', 30)),
+                notify=os.getenv('TOOL_REGISTRY_NOTIFY', 'False').lower() == 'true',
+            ).start_listener()
+        return _registry
@@ -0,0 +1,341 @@
+# backend/tool_router.py
+"""
+Rule-based tool routing for /api/chat.
+
+Every active ai_tools row contributes phrases - its keywords, tags and name
+- to one precompiled matcher: a phrase dictionary plus a word-level prefix
+set, scanned once over the message's words (Aho-Corasick over words rather
+than characters; one big regex alternation backtracks and measured slower
+than testing each keyword). Each phrase maps to the tools it points at,
+weighted by source and divided by how many tools share it (a phrase every
+tool has says nothing). allowed_roles is folded into a role bitmask per
+tool, so routing a query is one scan plus a few integer ANDs and additions:
+microseconds, no LLM call. Only when the best score is not confidently
+ahead of the runner-up (ROUTER_MIN_CONFIDENCE) does the router ask the LLM
+to classify the query among the tools the role may use. In the app the
+matcher is compiled by the tool registry (tool_registry.py) and replaced
+whenever ai_tools changes.
+
+A tool requested by name is only honoured if the caller's role may use it.
+Decisions carry the selection method ('explicit', 'rule_based',
+'ai_based', 'default') and a confidence, matching
+tool_executions.selection_method / confidence_score.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+ROLES = ('superadmin', 'admin', 'faculty', 'student', 'staff')
+ROLE_BITS = {role: 1 << position for position, role in enumerate(ROLES)}
+ALL_ROLES = (1 << len(ROLES)) - 1
+
+DEFAULT_TOOL = 'general_chat'
+
+# Phrase weights by where the phrase came from
+KEYWORD_WEIGHT = 3.0
+TAG_WEIGHT = 2.0
+NAME_WEIGHT = 2.0
+NAME_WORD_WEIGHT = 1.0
+
+# Words too generic to say anything about a tool on their own
+STOPWORDS = frozenset(
+    'a an and the of for to in on with my me i you your ai assistant generator creator builder tool system'.split()
+)
+
+# Keywords for the default ai_tools rows (applied by migration 6 where none are set)
+DEFAULT_TOOL_KEYWORDS = {
+    'ai_tutor': ['tutor', 'explain', 'help me understand', 'what is', 'how does', 'teach me', 'concept'],
+    'study_guide_generator': ['study guide', 'study notes', 'revision', 'review sheet', 'flashcard', 'exam prep',
+                              'summarize chapter', 'cheat sheet'],
+    'essay_assistant': ['essay', 'thesis', 'paragraph', 'introduction', 'conclusion', 'argument', 'proofread',
+                        'outline my'],
+    'math_solver': ['solve', 'equation', 'calculate', 'derivative', 'integral', 'algebra', 'calculus',
+                    'math problem', 'simplify', 'factor'],
+    'lesson_planner': ['lesson plan', 'lesson', 'learning objectives', 'curriculum', 'class activity',
+                       'teaching plan', 'unit plan'],
+    'quiz_creator': ['quiz', 'test questions', 'multiple choice', 'exam questions', 'answer key', 'assessment',
+                     'true or false'],
+    'rubric_builder': ['rubric', 'grading criteria', 'scoring guide', 'marking scheme'],
+    'feedback_generator': ['feedback', 'comments on', 'student work', 'grade comments', 'constructive'],
+    'report_generator': ['report', 'annual report', 'enrollment report', 'summary report', 'accreditation'],
+    'email_composer': ['email', 'draft a message', 'announcement', 'newsletter', 'letter to', 'reply to'],
+    'schedule_optimizer': ['schedule', 'timetable', 'room allocation', 'scheduling', 'calendar conflicts'],
+    'data_analyzer': ['analyze data', 'analytics', 'trends', 'statistics', 'retention rate', 'dashboard',
+                      'data analysis'],
+}
+
+
+def normalize_role(role):
+    """'super_admin' (JWT identities) and 'superadmin' (user_role enum) are the same role"""
+    return (role or '').replace('_', '').lower()
+
+
+def mask_for(role):
+    """Tools visible to one user role: superadmin sees every tool"""
+    role = normalize_role(role)
+    return ALL_ROLES if role == 'superadmin' else ROLE_BITS.get(role, 0)
+
+
+def role_mask(roles):
+    mask = 0
+    for role in roles or ():
+        mask |= ROLE_BITS.get(normalize_role(role), 0)
+    return mask
+
+
+WORD = re.compile(r'\w+')
+
+
+def _normalize_phrase(phrase):
+    return ' '.join(WORD.findall(phrase.lower()))
+
+
+class RouteDecision:
+    __slots__ = ('tool', 'tool_id', 'method', 'confidence', 'candidates', 'elapsed_us')
+
+    def __init__(self, tool, tool_id, method, confidence, candidates=(), elapsed_us=0.0):
+        self.tool = tool
+        self.tool_id = tool_id
+        self.method = method
+        self.confidence = confidence
+        self.candidates = candidates
+        self.elapsed_us = elapsed_us
+
+    def to_dict(self):
+        return {
+            'tool': self.tool,
+            'selectionMethod': self.method,
+            'confidence': round(self.confidence, 2),
+            'candidates': [{'tool': name, 'score': round(score, 2)} for name, score in self.candidates],
+            'routingUs': round(self.elapsed_us, 1),
+        }
+
+
+class CompiledMatcher:
+    """Immutable phrase matcher over a set of tools"""
+
+    def __init__(self, tools):
+        # tools: dicts with id, name, display_name, description, allowed_roles, tags, keywords
+        self.names = tuple(tool['name'] for tool in tools)
+        self.ids = tuple(str(tool['id']) if tool.get('id') else None for tool in tools)
+        self.descriptions = tuple(tool.get('description') or tool.get('display_name') or '' for tool in tools)
+        self.masks = tuple(role_mask(tool.get('allowed_roles')) for tool in tools)
+        self.index = {name: position for position, name in enumerate(self.names)}
+
+        sources = defaultdict(dict)  # phrase -> {tool position: weight}
+        for position, tool in enumerate(tools):
+            def add(phrase, weight):
+                phrase = _normalize_phrase(phrase)
+                if phrase and phrase not in STOPWORDS:
+                    sources[phrase][position] = max(sources[phrase].get(position, 0), weight)
+
+            for keyword in tool.get('keywords') or ():
+                add(keyword, KEYWORD_WEIGHT)
+            for tag in tool.get('tags') or ():
+                add(tag, TAG_WEIGHT)
+            for label in (tool['name'].replace('_', ' '), tool.get('display_name') or ''):
+                add(label, NAME_WEIGHT)
+                for word in _normalize_phrase(label).split():
+                    if len(word) > 2:
+                        add(word, NAME_WORD_WEIGHT)
+
+        # phrase -> ((tool position, weight), ...), shared phrases diluted by the number of tools
+        self.phrases = {}
+        for phrase, weights in sources.items():
+            postings = tuple((position, weight / len(weights)) for position, weight in weights.items())
+            self.phrases[phrase] = postings
+            # Plural forms route like the singular ("quizzes", "rubrics", "emails")
+            for plural in (phrase + 's', phrase + 'es'):
+                self.phrases.setdefault(plural, postings)
+
+        # Word-level trie as a set of proper prefixes: a scan only extends a
+        # candidate phrase while it can still grow into a known one
+        self.prefixes = set()
+        for phrase in self.phrases:
+            words = phrase.split()
+            for length in range(1, len(words)):
+                self.prefixes.add(' '.join(words[:length]))
+
+    def matches(self, text):
+        """Leftmost-longest matches: "lesson plan" is not also counted as "lesson" and "plan" """
+        words = WORD.findall(text.lower())
+        found = []
+        start = 0
+        while start < len(words):
+            candidate, longest, end = words[start], None, start + 1
+            while True:
+                if candidate in self.phrases:
+                    longest = (candidate, end)
+                if candidate not in self.prefixes or end == len(words):
+                    break
+                candidate = f'{candidate} {words[end]}'
+                end += 1
+            if longest is None:
+                start += 1
+            else:
+                found.append(longest[0])
+                start = longest[1]
+        return found
+
+    def score(self, text, mask):
+        """{tool position: score} for tools whose role mask intersects `mask`"""
+        scores = {}
+        for phrase in set(self.matches(text)):
+            for position, weight in self.phrases[phrase]:
+                if self.masks[position] & mask:
+                    scores[position] = scores.get(position, 0.0) + weight
+        return scores
+
+    def allowed(self, mask):
+        return [position for position, tool_mask in enumerate(self.masks) if tool_mask & mask]
+
+
+class ToolRouter:
+    """Routes a message to a tool by rules first and the LLM only when unsure"""
+
+    def __init__(self, tools=(), min_confidence=0.6, llm_fallback=None, on_usage=None, registry=None):
+        self.registry = registry  # ToolRegistry whose current snapshot supplies the matcher
+        self._matcher = None if registry is not None else CompiledMatcher(tools)
+        self.min_confidence = min_confidence
+        self.llm_fallback = llm_fallback  # callable returning a chat model, or None to disable
+        self.on_usage = on_usage  # callable(user_id, usage summary, request data) for fallback calls
+        self.counts = defaultdict(int)
+        self.total_us = 0.0
+
+    @property
+    def matcher(self):
+        return self.registry.matcher if self.registry is not None else self._matcher
+
+    @staticmethod
+    def confidence(top, runner_up):
+        """How far the best score is ahead: one keyword alone -> 0.75, two -> ~0.86"""
+        return top / (top + runner_up + 1.0)
+
+    def match(self, message, role):
+        """Rule-based decision, or a decision with method None if not confident"""
+        start = time.perf_counter()
+        matcher = self.matcher
+        scores = matcher.score(message, mask_for(role))
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:3]
+        candidates = tuple((matcher.names[position], score) for position, score in ranked)
+
+        if ranked:
+            top = ranked[0][1]
+            runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+            confidence = self.confidence(top, runner_up)
+            position = ranked[0][0]
+            method = 'rule_based' if confidence >= self.min_confidence else None
+            decision = RouteDecision(matcher.names[position], matcher.ids[position], method,
+                                     confidence, candidates)
+        else:
+            decision = RouteDecision(DEFAULT_TOOL, None, None, 0.0)
+        decision.elapsed_us = (time.perf_counter() - start) * 1e6
+        return decision
+
+    def route(self, message, role, requested_tool=None, user_id=None, allow_fallback=True):
+        """
+        Pick a tool for `message`. A requested tool is honoured only if `role`
+        may use it (otherwise the message is routed as if none was asked for);
+        pass allow_fallback=False to settle on rules alone, e.g. over budget.
+        """
+        if requested_tool:
+            matcher = self.matcher
+            position = matcher.index.get(requested_tool)
+            if requested_tool == DEFAULT_TOOL or (position is not None and matcher.masks[position] & mask_for(role)):
+                tool_id = matcher.ids[position] if position is not None else None
+                self.counts['explicit'] += 1
+                return RouteDecision(requested_tool, tool_id, 'explicit', 1.0)
+            self.counts['explicit_rejected'] += 1
+
+        decision = self.match(message, role)
+        self.total_us += decision.elapsed_us
+        # Only ambiguous matches go to the LLM; nothing matched at all is plain chat
+        if decision.method is None and decision.candidates and self.llm_fallback is not None and allow_fallback:
+            decision = self._classify(message, role, decision, user_id) or decision
+        if decision.method is None:
+            decision.method = 'default' if not decision.candidates else 'rule_based'
+            if decision.method == 'default':
+                decision.tool, decision.tool_id = DEFAULT_TOOL, None
+        self.counts[decision.method] += 1
+        return decision
+
+    def _classify(self, message, role, fallback, user_id):
+        """Ask the LLM to pick among the tools `role` may use; None if it cannot"""
+        from llm import UsageMeter
+
+        matcher = self.matcher
+        allowed = matcher.allowed(mask_for(role))
+        if not allowed:
+            return None
+        catalogue = '\n'.join(f"- {matcher.names[p]}: {matcher.descriptions[p]}" for p in allowed)
+        prompt = (
+            "Pick the single best tool for the user's request. Answer with the tool name only, "
+            f"or {DEFAULT_TOOL} if none fits.\n\nTools:\n{catalogue}\n\nRequest: {message}\nTool:"
+        )
+        start = time.perf_counter()
+        try:
+            llm = self.llm_fallback()
+            meter = UsageMeter(llm.model_name, prompt)
+            meter.add(llm.invoke(prompt))
+        except Exception as e:
+            self.counts['fallback_errors'] += 1
+            logger.warning(f"⚠️  LLM tool classification failed: {e}")
+            return None
+        if self.on_usage is not None:
+            self.on_usage(user_id, meter.summary(), {'route': message})
+
+        answer = _normalize_phrase(meter.text).replace(' ', '_')
+        position = matcher.index.get(answer)
+        if position is None or position not in allowed:
+            return RouteDecision(DEFAULT_TOOL, None, 'ai_based', 0.5, fallback.candidates,
+                                 fallback.elapsed_us + (time.perf_counter() - start) * 1e6)
+        return RouteDecision(answer, matcher.ids[position], 'ai_based', max(fallback.confidence, 0.5),
+                             fallback.candidates, fallback.elapsed_us + (time.perf_counter() - start) * 1e6)
+
+    def stats(self):
+        routed = sum(self.counts[m] for m in ('rule_based', 'ai_based', 'default'))
+        matcher = self.matcher
+        return {
+            'tools': len(matcher.names),
+            'phrases': len(matcher.phrases),
+            'minConfidence': self.min_confidence,
+            'decisions': dict(self.counts),
+            'ruleBasedShare': round(self.counts['rule_based'] / routed, 4) if routed else 0.0,
+            'meanRuleUs': round(self.total_us / routed, 1) if routed else 0.0,
+        }
+
+
+def tool_router_from_env(registry, on_usage=None):
+    """Router over the registry's tools; LLM fallback unless ROUTER_LLM_FALLBACK=False"""
+    llm_fallback = None
+    if os.getenv('ROUTER_LLM_FALLBACK', 'True').lower() == 'true':
+        from llm import get_chat_model
+
+        llm_fallback = lambda: get_chat_model(temperature=0)
+    return ToolRouter(
+        min_confidence=float(os.getenv('ROUTER_MIN_CONFIDENCE', 0.6)),
+        llm_fallback=llm_fallback,
+        on_usage=on_usage,
+        registry=registry,
+    )
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_tool_router(engine=None, on_usage=None):
+    """Process-wide router over the process-wide tool registry"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            from tool_registry import get_tool_registry
+
+            _router = tool_router_from_env(get_tool_registry(engine), on_usage=on_usage)
+        return _router
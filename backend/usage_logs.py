@@ -0,0 +1,358 @@
+# backend/usage_logs.py
+"""
+Buffered persistence of LLM usage to ai_usage_logs.
+
+Request handlers only append to an in-process buffer. A background thread
+flushes it every USAGE_FLUSH_INTERVAL seconds (or as soon as a batch fills)
+with one multi-row INSERT, then applies the batch's cost to ai_budgets with
+one upsert per flush (aggregated per entity) and bumps the dashboard rollups.
+This replaces the per-row track_ai_budget() trigger, which serialized every
+insert on the user's ai_budgets row.
+
+A batch rejected for its data (a malformed id, a missing user) is retried
+row by row and the rows that still fail are dead-lettered, so one bad row
+never blocks the rest. Batches that fail for other reasons (database down)
+are retried with backoff up to USAGE_MAX_RETRIES times.
+"""
+
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import defaultdict, deque
+import psycopg2
+from psycopg2.extras import execute_values
+from sqlalchemy import text
+from rollups import increment, AI_REQUESTS, AI_ERRORS, AI_COST
+
+logger = logging.getLogger(__name__)
+
+USAGE_COLUMNS = (
+    'user_id', 'tool_id', 'conversation_id', 'input_data', 'output_data',
+    'execution_time_ms', 'total_tokens', 'prompt_tokens', 'completion_tokens',
+    'model_used', 'cost', 'status', 'error_message',
+)
+
+INSERT_USAGE_SQL = f"INSERT INTO ai_usage_logs ({', '.join(USAGE_COLUMNS)}) VALUES %s"
+INSERT_USAGE_TEMPLATE = (
+    "(%s::uuid, %s::uuid, %s::uuid, %s::jsonb, %s::jsonb, %s, %s, %s, %s, %s, %s, %s, %s)"
+)
+
+# One statement per flush: add the aggregated cost, resetting stale day/month windows
+UPSERT_BUDGETS_SQL = """
+    INSERT INTO ai_budgets (entity_type, entity_id, daily_usage, monthly_usage)
+    VALUES %s
+    ON CONFLICT (entity_type, entity_id) DO UPDATE SET
+        daily_usage = CASE WHEN ai_budgets.daily_reset_at < CURRENT_DATE
+                           THEN EXCLUDED.daily_usage
+                           ELSE ai_budgets.daily_usage + EXCLUDED.daily_usage END,
+        daily_reset_at = CURRENT_DATE,
+        monthly_usage = CASE WHEN ai_budgets.monthly_reset_at < DATE_TRUNC('month', CURRENT_DATE)::DATE
+                             THEN EXCLUDED.monthly_usage
+                             ELSE ai_budgets.monthly_usage + EXCLUDED.monthly_usage END,
+        monthly_reset_at = DATE_TRUNC('month', CURRENT_DATE)::DATE
+"""
+UPSERT_BUDGETS_TEMPLATE = "(%s, %s::uuid, %s, %s)"
+
+FAILED_STATUSES = ('error', 'failed', 'timeout')
+
+
+def is_bad_data(error):
+    """True if the database rejected the rows themselves, so retrying the same batch cannot succeed"""
+    error = getattr(error, 'orig', None) or error
+    return isinstance(error, (psycopg2.DataError, psycopg2.IntegrityError))
+
+
+def usage_row(user_id, usage, input_data, output_data=None, status='success',
+              error_message=None, conversation_id=None, tool_id=None):
+    """Build an ai_usage_logs row from a UsageMeter.summary()"""
+    return {
+        'user_id': str(user_id),
+        'tool_id': str(tool_id) if tool_id else None,
+        'conversation_id': str(conversation_id) if conversation_id else None,
+        'input_data': json.dumps(input_data),
+        'output_data': json.dumps(output_data) if output_data is not None else None,
+        'execution_time_ms': usage.get('executionTimeMs'),
+        'total_tokens': usage.get('totalTokens'),
+        'prompt_tokens': usage.get('promptTokens'),
+        'completion_tokens': usage.get('completionTokens'),
+        'model_used': usage.get('model'),
+        'cost': usage.get('cost', 0),
+        'status': status,
+        'error_message': error_message,
+    }
+
+
+class UsageLogWriter:
+    """Batches usage rows and writes them from a background thread"""
+
+    def __init__(self, engine, flush_interval=1.0, batch_size=500, max_buffer=20000, max_retries=8,
+                 max_backoff=60.0):
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._buffer = []
+        self._attempts = {}  # id(row) -> failed flushes so far, for rows waiting to be retried
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._consecutive_failures = 0
+        self._retry_at = 0.0
+        self.rows_written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.dropped_rows = 0
+        self.dead_letters = deque(maxlen=100)  # most recent rows the database refused
+        self.dead_lettered = 0
+        self._thread = threading.Thread(target=self._run, name='usage-log-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Usage log writer is closed")
+            self._buffer.append(row)
+            size = len(self._buffer)
+            if size >= self.batch_size:
+                self._condition.notify()
+            backing_off = time.monotonic() < self._retry_at
+            if size >= self.max_buffer and backing_off:
+                # The database is failing: shed the oldest rows rather than retry on the request thread
+                self._trim()
+
+        # Backpressure instead of unbounded growth if the database falls behind
+        if size >= self.max_buffer and not backing_off:
+            self.flush()
+
+    def _trim(self):
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            for dropped in self._buffer[:overflow]:
+                self._attempts.pop(id(dropped), None)
+            del self._buffer[:overflow]
+            before, self.dropped_rows = self.dropped_rows, self.dropped_rows + overflow
+            # First drop and then every thousand, not one line per request during an outage
+            if before == 0 or before // 1000 != self.dropped_rows // 1000:
+                logger.error(f"❌ Usage log buffer full: {self.dropped_rows} rows dropped so far")
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows written"""
+        with self._flush_lock:
+            with self._condition:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            try:
+                self._write(rows)
+            except Exception as e:
+                self.failed_flushes += 1
+                if not is_bad_data(e):
+                    logger.error(f"❌ Usage log flush of {len(rows)} rows failed: {e}")
+                    self._retry_later(rows)
+                    return 0
+                logger.warning(f"⚠️  Usage log batch of {len(rows)} rows rejected ({e}); retrying row by row")
+                return self._write_each(rows)
+            self._written(rows)
+            return len(rows)
+
+    def _written(self, rows):
+        self.flushes += 1
+        self.rows_written += len(rows)
+        self._consecutive_failures = 0
+        self._retry_at = 0.0
+        with self._condition:
+            for row in rows:
+                self._attempts.pop(id(row), None)
+        for listener in _flush_listeners:
+            try:
+                listener(rows)
+            except Exception as e:
+                logger.warning(f"⚠️  Usage flush listener failed: {e}")
+
+    def _write_each(self, rows):
+        """Isolate the rows the database refuses; the rest are written one transaction each"""
+        written, retry = 0, []
+        for position, row in enumerate(rows):
+            try:
+                self._write([row])
+            except Exception as e:
+                if not is_bad_data(e):
+                    # Not this row's fault after all: keep it and everything after it for later
+                    retry.extend(rows[position:])
+                    break
+                self._dead_letter(row, e)
+                continue
+            self._written([row])
+            written += 1
+        if retry:
+            self._retry_later(retry)
+        return written
+
+    def _dead_letter(self, row, error):
+        with self._condition:
+            self._attempts.pop(id(row), None)
+            self.dead_letters.append(dict(row, error=str(error)))
+            self.dead_lettered += 1
+        logger.error(f"❌ Dead-lettered usage row for user {row.get('user_id')!r}: {error}")
+
+    def _retry_later(self, rows):
+        """Requeue rows in front of newer ones with exponential backoff, dead-lettering after max_retries"""
+        self._consecutive_failures += 1
+        backoff = min(self.flush_interval * 2 ** self._consecutive_failures, self.max_backoff)
+        with self._condition:
+            self._retry_at = time.monotonic() + backoff
+            kept = []
+            for row in rows:
+                attempts = self._attempts.get(id(row), 0) + 1
+                if attempts > self.max_retries:
+                    self._attempts.pop(id(row), None)
+                    self.dead_letters.append(dict(row, error='retries exhausted'))
+                    self.dead_lettered += 1
+                    continue
+                self._attempts[id(row)] = attempts
+                kept.append(row)
+            if len(kept) < len(rows):
+                logger.error(f"❌ Gave up on {len(rows) - len(kept)} usage rows after {self.max_retries} retries")
+            self._buffer[:0] = kept
+            self._trim()
+
+    def close(self, timeout=10.0):
+        """Stop the background thread and flush what is left (registered with atexit)"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._condition:
+            buffered = len(self._buffer)
+        return {
+            'buffered': buffered,
+            'rowsWritten': self.rows_written,
+            'flushes': self.flushes,
+            'failedFlushes': self.failed_flushes,
+            'droppedRows': self.dropped_rows,
+            'deadLettered': self.dead_lettered,
+            'retryInSeconds': round(max(0.0, self._retry_at - time.monotonic()), 1),
+        }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed and len(self._buffer) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                closed = self._closed
+                # After a failed flush, wait out the backoff before trying again
+                delay = self._retry_at - time.monotonic()
+                if not closed and delay > 0:
+                    self._condition.wait(delay)
+                    closed = self._closed
+            if closed:
+                return
+            if time.monotonic() >= self._retry_at:
+                self.flush()
+
+    def _write(self, rows):
+        user_costs = defaultdict(float)
+        for row in rows:
+            user_costs[row['user_id']] += float(row['cost'] or 0)
+
+        with self.engine.begin() as conn:
+            cursor = conn.connection.cursor()
+            execute_values(
+                cursor, INSERT_USAGE_SQL,
+                [tuple(row[column] for column in USAGE_COLUMNS) for row in rows],
+                template=INSERT_USAGE_TEMPLATE, page_size=1000
+            )
+
+            memberships = {row[0]: row[1:] for row in conn.execute(
+                text("SELECT CAST(id AS TEXT), institution_id, department_id FROM users "
+                     "WHERE id = ANY(CAST(:ids AS UUID[]))"),
+                {'ids': list(user_costs)}
+            )}
+            institutions = {user_id: ids[0] for user_id, ids in memberships.items()}
+
+            budget_costs = defaultdict(float)
+            for user_id, cost in user_costs.items():
+                if cost > 0:
+                    budget_costs[('user', user_id)] += cost
+                    institution_id, department_id = memberships.get(user_id, (None, None))
+                    if institution_id:
+                        budget_costs[('institution', str(institution_id))] += cost
+                    if department_id:
+                        budget_costs[('department', str(department_id))] += cost
+
+            if budget_costs:
+                # Sorted so concurrent workers lock ai_budgets rows in the same order
+                execute_values(
+                    cursor, UPSERT_BUDGETS_SQL,
+                    [(entity_type, entity_id, cost, cost)
+                     for (entity_type, entity_id), cost in sorted(budget_costs.items())],
+                    template=UPSERT_BUDGETS_TEMPLATE
+                )
+            cursor.close()
+
+            # Dashboard rollups, aggregated per institution
+            rollup_deltas = defaultdict(lambda: defaultdict(float))
+            for row in rows:
+                deltas = rollup_deltas[institutions.get(row['user_id'])]
+                deltas[AI_REQUESTS] += 1
+                deltas[AI_ERRORS] += 1 if row['status'] in FAILED_STATUSES else 0
+                deltas[AI_COST] += float(row['cost'] or 0)
+            for institution_id, deltas in rollup_deltas.items():
+                increment(conn, institution_id, deltas)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+# Called synchronously with every recorded row (e.g. the in-memory budget guard)
+_usage_listeners = []
+
+
+# Called with each batch of rows once it has been committed to ai_usage_logs
+_flush_listeners = []
+
+
+def add_usage_listener(listener):
+    _usage_listeners.append(listener)
+
+
+def add_flush_listener(listener):
+    _flush_listeners.append(listener)
+
+
+def get_usage_writer(engine):
+    """Process-wide writer, flushed automatically at interpreter shutdown"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = UsageLogWriter(
+                engine,
+                flush_interval=float(os.getenv('USAGE_FLUSH_INTERVAL', 1.0)),
+                batch_size=int(os.getenv('USAGE_BATCH_SIZE', 500)),
+                max_retries=int(os.getenv('USAGE_MAX_RETRIES', 8)),
+            )
+            atexit.register(_writer.close)
+        return _writer
+
+
+def record_usage(engine, row):
+    """Queue one usage row; database problems are logged, never raised to the request"""
+    for listener in _usage_listeners:
+        try:
+            listener(row)
+        except Exception as e:
+            logger.warning(f"⚠️  Usage listener failed: {e}")
+    try:
+        get_usage_writer(engine).submit(row)
+    except Exception as e:
+        logger.warning(f"⚠️  Could not record AI usage: {e}")
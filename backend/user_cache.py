@@ -0,0 +1,192 @@
+# backend/user_cache.py
+"""
+Per-process cache of user profiles keyed by user id.
+
+Protected endpoints resolve the JWT identity to the user's current profile
+(role, institution, ...) from here instead of opening a session per request.
+Entries expire after USER_CACHE_TTL seconds and are dropped explicitly when a
+user changes. With USER_CACHE_NOTIFY enabled, invalidations are also broadcast
+to the other workers over Postgres LISTEN/NOTIFY.
+"""
+
+import os
+import time
+import select
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import text
+from sqlalchemy.orm import joinedload
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'user_cache_invalidate'
+
+
+def load_profile(session_factory, user_id):
+    """Read one user with their institution, or None if they do not exist"""
+    from models import User
+
+    session = session_factory()
+    try:
+        user = session.query(User).options(joinedload(User.institution)).filter(User.id == user_id).first()
+        if user is None:
+            return None
+        return {
+            'id': str(user.id),
+            'email': user.email,
+            'name': user.full_name,
+            'role': user.role,
+            'institutionId': str(user.institution_id) if user.institution_id else None,
+            'institution': user.institution.name if user.institution else None,
+            'lastLogin': user.last_login,
+        }
+    finally:
+        session.close()
+
+
+class ProfileCache:
+    """LRU + TTL cache of profile dicts with local and cross-worker invalidation"""
+
+    def __init__(self, loader, ttl=60.0, max_entries=50000, engine=None):
+        self.loader = loader  # callable: user_id -> profile dict or None
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.engine = engine  # set to broadcast invalidations over NOTIFY
+        self._entries = OrderedDict()
+        # Bumped by invalidations so a load that raced one is not stored
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        key = str(user_id)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = (self._epoch, self._generations.get(key, 0))
+
+        profile = self.loader(key)
+        if profile is not None:
+            with self._lock:
+                if generation != (self._epoch, self._generations.get(key, 0)):
+                    # Invalidated while loading: the profile may predate the change
+                    return profile
+                self._entries[key] = (now + self.ttl, profile)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return profile
+
+    def invalidate(self, user_id, conn=None):
+        """
+        Drop a user locally and, when broadcasting, on every other worker.
+
+        Pass the connection/session that made the change so the NOTIFY is
+        delivered when (and only if) that transaction commits.
+        """
+        self.invalidate_local(user_id)
+        if self.engine is None:
+            return
+        try:
+            if conn is not None:
+                conn.execute(text("SELECT pg_notify(:channel, :id)"),
+                             {'channel': INVALIDATION_CHANNEL, 'id': str(user_id)})
+            else:
+                with self.engine.begin() as own:
+                    own.execute(text("SELECT pg_notify(:channel, :id)"),
+                                {'channel': INVALIDATION_CHANNEL, 'id': str(user_id)})
+        except Exception as e:
+            logger.warning(f"⚠️  Could not broadcast user cache invalidation: {e}")
+
+    def invalidate_local(self, user_id):
+        key = str(user_id)
+        with self._lock:
+            if len(self._generations) >= self.max_entries:
+                self._generations.clear()
+                self._epoch += 1
+            self._generations[key] = self._generations.get(key, 0) + 1
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def start_listener(self):
+        """Apply invalidations published by other workers (needs engine)"""
+        if self.engine is not None and self._listener is None:
+            self._listener = threading.Thread(target=self._listen, name='user-cache-listener', daemon=True)
+            self._listener.start()
+        return self
+
+    def _listen(self):
+        while True:
+            connection = None
+            try:
+                connection = self.engine.raw_connection()
+                dbapi = connection.dbapi_connection
+                dbapi.autocommit = True
+                cursor = dbapi.cursor()
+                cursor.execute(f"LISTEN {INVALIDATION_CHANNEL}")
+                # Anything may have changed while we were not listening
+                self.clear()
+                while True:
+                    if select.select([dbapi], [], [], 30.0) == ([], [], []):
+                        continue
+                    dbapi.poll()
+                    while dbapi.notifies:
+                        self.invalidate_local(dbapi.notifies.pop(0).payload)
+            except Exception as e:
+                logger.warning(f"⚠️  User cache listener disconnected: {e}")
+                time.sleep(5)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.invalidate()
+                    except Exception:
+                        pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hitRate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'crossWorker': self.engine is not None,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_profile_cache():
+    """Process-wide profile cache configured from USER_CACHE_TTL / USER_CACHE_NOTIFY"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            from models import engine, SessionLocal
+
+            notify = os.getenv('USER_CACHE_NOTIFY', 'False').lower() == 'true'
+            _cache = ProfileCache(
+                lambda user_id: load_profile(SessionLocal, user_id),
+                ttl=float(os.getenv('USER_CACHE_TTL', 60)),
+                max_entries=int(os.getenv('USER_CACHE_MAX_ENTRIES', 50000)),
+                engine=engine if notify else None,
+            ).start_listener()
+        return _cache
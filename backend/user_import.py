@@ -0,0 +1,151 @@
+# backend/user_import.py
+"""
+Bulk user signup/import.
+
+Rows arrive as CSV (header: email, firstName, lastName, role, password) or
+a JSON list of objects with the same keys. Every row needs a password
+(invite-pending accounts without one come from the streaming provisioner,
+provisioning.py), and callers can only create roles ranked at or below their own. Every distinct email domain is
+resolved once through the institution directory, passwords are hashed on the
+shared pool, and users are inserted in chunks of IMPORT_CHUNK_SIZE with one
+multi-row INSERT ... ON CONFLICT DO NOTHING per chunk.
+"""
+
+import io
+import re
+import csv
+import uuid
+from datetime import datetime
+from collections import Counter
+from sqlalchemy.dialects.postgresql import insert
+from models import User
+from rollups import record_new_user
+
+VALID_ROLES = ('super_admin', 'admin', 'faculty', 'staff', 'student')
+
+# An importer may create accounts up to their own rank, never above it
+ROLE_RANKS = {'student': 1, 'staff': 2, 'faculty': 2, 'admin': 3, 'super_admin': 4}
+
+MIN_PASSWORD_LENGTH = 8
+
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+# Accept both the API's camelCase and snake_case column names
+FIELD_ALIASES = {
+    'email': 'email',
+    'firstname': 'first_name', 'first_name': 'first_name',
+    'lastname': 'last_name', 'last_name': 'last_name',
+    'role': 'role',
+    'password': 'password',
+}
+
+
+def normalize_row(raw):
+    row = {}
+    for key, value in raw.items():
+        field = FIELD_ALIASES.get(str(key).strip().lower())
+        if field:
+            row[field] = value.strip() if isinstance(value, str) else value
+    row['email'] = str(row.get('email') or '').lower()
+    row['role'] = row.get('role') or 'student'
+    row['first_name'] = row.get('first_name') or ''
+    row['last_name'] = row.get('last_name') or ''
+    return row
+
+
+def parse_rows(body, content_type):
+    """List of normalized rows from a CSV or JSON request body"""
+    if 'csv' in (content_type or ''):
+        text_body = body.decode('utf-8-sig') if isinstance(body, bytes) else body
+        return [normalize_row(raw) for raw in csv.DictReader(io.StringIO(text_body))]
+    if isinstance(body, dict):
+        body = body.get('users', [])
+    return [normalize_row(raw) for raw in body or []]
+
+
+def validate_row(row, max_role='student', require_password=True):
+    """Error message for an unusable row, or None; `max_role` is the importing user's role"""
+    if not EMAIL_PATTERN.match(row['email']):
+        return 'Invalid email'
+    if row['role'] not in VALID_ROLES:
+        return f"Invalid role. Must be one of {list(VALID_ROLES)}"
+    if ROLE_RANKS[row['role']] > ROLE_RANKS.get(max_role, 0):
+        return f"Not allowed to create {row['role']} accounts"
+    password = row.get('password')
+    if not password and not require_password:
+        return None
+    if not isinstance(password, str) or len(password) < MIN_PASSWORD_LENGTH:
+        return f"A password of at least {MIN_PASSWORD_LENGTH} characters is required"
+    return None
+
+
+def import_users(engine, directory, hasher, rows, max_role='student', allowed_institution_id=None,
+                 chunk_size=500):
+    """
+    Insert `rows`, returning {'created', 'skipped', 'errors'}.
+
+    Errors carry the row's 1-based position in the batch. Existing emails are
+    skipped, not updated. Roles above `max_role` (the caller's) are rejected. Unknown domains are rejected; bulk import never
+    creates institutions.
+    """
+    errors = []
+    institutions = directory.lookup_many(row['email'].split('@')[-1] for row in rows if '@' in row['email'])
+
+    accepted, seen = [], set()
+    for position, row in enumerate(rows, start=1):
+        error = validate_row(row, max_role)
+        institution = institutions.get(row['email'].split('@')[-1]) if not error else None
+        if not error and institution is None:
+            error = 'Institution not found for this email domain'
+        elif not error and allowed_institution_id and institution['id'] != str(allowed_institution_id):
+            error = 'Email domain belongs to another institution'
+        elif not error and row['email'] in seen:
+            error = 'Duplicate email in batch'
+        if error:
+            errors.append({'row': position, 'email': row['email'], 'error': error})
+            continue
+        seen.add(row['email'])
+        accepted.append((position, row, institution['id']))
+
+    # Hash the whole batch concurrently on the pool
+    password_hashes = hasher.hash_many([row.get('password') for _, row, _ in accepted])
+
+    created, table = 0, User.__table__
+    for start in range(0, len(accepted), chunk_size):
+        chunk = accepted[start:start + chunk_size]
+        now = datetime.utcnow()
+        values = [{
+            'id': uuid.uuid4(),
+            'email': row['email'],
+            'first_name': row['first_name'],
+            'last_name': row['last_name'],
+            'role': row['role'],
+            'institution_id': uuid.UUID(institution_id),
+            'password_hash': password_hash,
+            'is_active': True,
+            'created_at': now,
+            'updated_at': now,
+        } for (_, row, institution_id), password_hash in zip(chunk, password_hashes[start:start + chunk_size])]
+
+        with engine.begin() as conn:
+            # One multi-row statement per chunk; emails that already exist come back missing
+            inserted = conn.execute(
+                insert(table).values(values).on_conflict_do_nothing(index_elements=['email'])
+                .returning(table.c.email, table.c.institution_id)
+            ).fetchall()
+
+        for institution_id, count in Counter(str(institution_id) for _, institution_id in inserted).items():
+            record_new_user(institution_id, count)
+        created += len(inserted)
+        inserted_emails = {email for email, _ in inserted}
+        errors.extend(
+            {'row': position, 'email': row['email'], 'error': 'User with this email already exists'}
+            for position, row, _ in chunk if row['email'] not in inserted_emails
+        )
+
+    errors.sort(key=lambda error: error['row'])
+    return {
+        'created': created,
+        'skipped': len(rows) - created,
+        'errors': errors,
+    }
@@ -0,0 +1,309 @@
+# backend/vector_index.py
+"""
+Embedding pipeline and nearest-neighbour retrieval over conversation_embeddings.
+
+Messages are split into overlapping chunks, embedded in batches and COPYed
+into conversation_embeddings. Search runs on the pgvector HNSW (or IVFFlat)
+index created by migration 5, with recall/latency traded off per query via
+VECTOR_EF_SEARCH (HNSW) or VECTOR_PROBES (IVFFlat). Searches scoped to one
+conversation use pgvector 0.8's iterative index scans, or on older versions an
+exact scan of that conversation's rows, so the filter cannot empty the
+candidate list. Where pgvector is not
+available (tests, laptops), NumpyVectorIndex does exact brute-force search
+in process behind the same interface.
+"""
+
+import io
+import os
+import csv
+import json
+import uuid
+import logging
+import threading
+from sqlalchemy import text
+from embeddings import EMBEDDING_DIMENSIONS, get_embedding_provider
+
+logger = logging.getLogger(__name__)
+
+# ~4 characters per token, as in llm.estimate_tokens
+CHARS_PER_TOKEN = 4
+
+COPY_EMBEDDINGS_SQL = (
+    "COPY conversation_embeddings (id, conversation_id, message_id, content_chunk, embedding, metadata) "
+    "FROM STDIN WITH (FORMAT csv)"
+)
+
+SEARCH_COLUMNS = """
+    CAST(id AS TEXT), embedding <=> CAST(:vector AS vector) AS distance,
+    CAST(conversation_id AS TEXT), CAST(message_id AS TEXT), content_chunk, metadata
+"""
+
+SEARCH_SQL = text(f"""
+    SELECT {SEARCH_COLUMNS}
+    FROM conversation_embeddings
+    WHERE embedding IS NOT NULL
+    ORDER BY embedding <=> CAST(:vector AS vector)
+    LIMIT :k
+""")
+
+SCOPED_SEARCH_SQL = text(f"""
+    SELECT {SEARCH_COLUMNS}
+    FROM conversation_embeddings
+    WHERE embedding IS NOT NULL AND conversation_id = CAST(:conversation_id AS UUID)
+    ORDER BY embedding <=> CAST(:vector AS vector)
+    LIMIT :k
+""")
+
+# The MATERIALIZED CTE keeps the planner on idx_embeddings_conversation, away from the ANN index
+SCOPED_EXACT_SEARCH_SQL = text(f"""
+    WITH scoped AS MATERIALIZED (
+        SELECT {SEARCH_COLUMNS}
+        FROM conversation_embeddings
+        WHERE embedding IS NOT NULL AND conversation_id = CAST(:conversation_id AS UUID)
+    )
+    SELECT * FROM scoped ORDER BY distance LIMIT :k
+""")
+
+
+def vector_literal(vector):
+    return '[' + ','.join(f'{float(value):.6f}' for value in vector) + ']'
+
+
+def chunk_text(content, max_tokens=200, overlap_tokens=20):
+    """Split text on whitespace into chunks of about `max_tokens`, overlapping by `overlap_tokens`"""
+    words = content.split()
+    if not words:
+        return []
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = overlap_tokens * CHARS_PER_TOKEN
+
+    chunks, current, size = [], [], 0
+    for word in words:
+        if current and size + len(word) + 1 > max_chars:
+            chunks.append(' '.join(current))
+            # Carry the tail of the previous chunk over for context
+            carried, carried_size = [], 0
+            for previous in reversed(current):
+                if carried_size + len(previous) + 1 > overlap_chars:
+                    break
+                carried.insert(0, previous)
+                carried_size += len(previous) + 1
+            current, size = carried, carried_size
+        current.append(word)
+        size += len(word) + 1
+    chunks.append(' '.join(current))
+    return chunks
+
+
+class VectorIndex:
+    """Interface for nearest-neighbour search over embedded chunks"""
+
+    def add(self, items):
+        """Index (id, vector, metadata) tuples; metadata carries conversation_id, message_id and content"""
+        raise NotImplementedError
+
+    def search(self, vector, k=10, conversation_id=None):
+        """[(id, distance, metadata)] of the k nearest chunks by cosine distance"""
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class PgVectorIndex(VectorIndex):
+    """ANN search on conversation_embeddings through its pgvector index"""
+
+    def __init__(self, engine, ef_search=40, probes=10):
+        self.engine = engine
+        self.ef_search = ef_search
+        self.probes = probes
+        self.searches = 0
+        self._iterative_scan = None  # pgvector >= 0.8, checked on the first scoped search
+
+    def _supports_iterative_scan(self, conn):
+        if self._iterative_scan is None:
+            version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+            try:
+                self._iterative_scan = tuple(int(part) for part in version.split('.')[:2]) >= (0, 8)
+            except (AttributeError, ValueError):
+                self._iterative_scan = False
+        return self._iterative_scan
+
+    def add(self, items):
+        """Bulk-load (id, vector, metadata) tuples; metadata must carry conversation_id"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for item_id, vector, metadata in items:
+            extra = {key: value for key, value in metadata.items()
+                     if key not in ('conversation_id', 'message_id', 'content')}
+            # Empty unquoted CSV fields load as NULL
+            writer.writerow((
+                item_id or uuid.uuid4(), metadata['conversation_id'], metadata.get('message_id') or '',
+                metadata['content'], vector_literal(vector), json.dumps(extra),
+            ))
+        buffer.seek(0)
+        with self.engine.begin() as conn:
+            cursor = conn.connection.cursor()
+            cursor.copy_expert(COPY_EMBEDDINGS_SQL, buffer)
+            cursor.close()
+
+    def search(self, vector, k=10, conversation_id=None, ef_search=None, probes=None):
+        params = {'vector': vector_literal(vector), 'k': k, 'conversation_id': conversation_id}
+        with self.engine.begin() as conn:
+            # Per-transaction recall/latency knobs; each is ignored by the other index type
+            conn.execute(text(f"SET LOCAL hnsw.ef_search = {int(ef_search or self.ef_search)}"))
+            conn.execute(text(f"SET LOCAL ivfflat.probes = {int(probes or self.probes)}"))
+            if conversation_id is None:
+                rows = conn.execute(SEARCH_SQL, params).fetchall()
+            elif self._supports_iterative_scan(conn):
+                # Keep walking the index until k rows pass the conversation filter
+                conn.execute(text("SET LOCAL hnsw.iterative_scan = strict_order"))
+                conn.execute(text("SET LOCAL ivfflat.iterative_scan = relaxed_order"))
+                rows = conn.execute(SCOPED_SEARCH_SQL, params).fetchall()
+            else:
+                # Older pgvector stops after ef_search candidates and filters afterwards,
+                # so a small conversation can come back short: rank its rows exactly instead
+                rows = conn.execute(SCOPED_EXACT_SEARCH_SQL, params).fetchall()
+        self.searches += 1
+        # ivfflat's relaxed_order can return rows slightly out of order
+        rows = sorted(rows, key=lambda row: row[1])
+        return [
+            (row[0], float(row[1]), dict(row[5] or {}, conversation_id=row[2], message_id=row[3], content=row[4]))
+            for row in rows
+        ]
+
+    def stats(self):
+        return {'backend': 'pgvector', 'efSearch': self.ef_search, 'probes': self.probes, 'searches': self.searches}
+
+
+class NumpyVectorIndex(VectorIndex):
+    """Exact in-process cosine search; for tests and environments without pgvector"""
+
+    def __init__(self, dimensions=EMBEDDING_DIMENSIONS):
+        import numpy as np
+
+        self._np = np
+        self.dimensions = dimensions
+        self._vectors = np.empty((0, dimensions), dtype=np.float32)
+        self._ids = []
+        self._metadata = []
+        self._pending = []
+        self._lock = threading.Lock()
+        self.searches = 0
+
+    def add(self, items):
+        np = self._np
+        with self._lock:
+            for item_id, vector, metadata in items:
+                self._ids.append(str(item_id or uuid.uuid4()))
+                self._metadata.append(metadata)
+                self._pending.append(np.asarray(vector, dtype=np.float32))
+
+    def add_array(self, ids, vectors, metadata=None):
+        """Bulk-add an (n, dimensions) array without per-row conversion"""
+        np = self._np
+        with self._lock:
+            self._ids.extend(str(item_id) for item_id in ids)
+            self._metadata.extend(metadata or ({} for _ in ids))
+            self._pending.append(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimensions))
+
+    def _matrix(self):
+        """Unit-normalized vectors, folding in anything added since the last search"""
+        np = self._np
+        with self._lock:
+            if self._pending:
+                block = np.vstack(self._pending).astype(np.float32, copy=False)
+                norms = np.linalg.norm(block, axis=1, keepdims=True)
+                block /= np.where(norms == 0, 1, norms)
+                self._vectors = np.vstack([self._vectors, block])
+                self._pending = []
+            return self._vectors, self._ids, self._metadata
+
+    def search(self, vector, k=10, conversation_id=None):
+        np = self._np
+        vectors, ids, metadata = self._matrix()
+        if not ids:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        distances = 1 - vectors @ query
+
+        if conversation_id:
+            mask = np.array([m.get('conversation_id') == str(conversation_id) for m in metadata])
+            distances = np.where(mask, distances, np.inf)
+
+        k = min(k, len(ids))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        self.searches += 1
+        return [(ids[i], float(distances[i]), metadata[i]) for i in nearest if np.isfinite(distances[i])]
+
+    def __len__(self):
+        return len(self._ids)
+
+    def stats(self):
+        return {'backend': 'numpy', 'vectors': len(self), 'searches': self.searches}
+
+
+class EmbeddingPipeline:
+    """Chunks messages, embeds them in batches and bulk-writes them to a VectorIndex"""
+
+    def __init__(self, index, embed, batch_size=64, chunk_tokens=200, overlap_tokens=20):
+        self.index = index
+        self.embed = embed  # callable: list[str] -> list[vector]
+        self.batch_size = batch_size
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.chunks_indexed = 0
+
+    def index_messages(self, conversation_id, messages):
+        """
+        Index message dicts ({'id', 'content', ...}, e.g. ConversationRepository
+        rows); returns the number of chunks written
+        """
+        chunks = [
+            {'conversation_id': str(conversation_id), 'message_id': str(message['id']) if message.get('id') else None,
+             'content': chunk, 'kind': 'message', 'chunk': position}
+            for message in messages
+            for position, chunk in enumerate(chunk_text(message['content'], self.chunk_tokens, self.overlap_tokens))
+        ]
+        for start in range(0, len(chunks), self.batch_size):
+            batch = chunks[start:start + self.batch_size]
+            vectors = self.embed([chunk['content'] for chunk in batch])
+            self.index.add([(None, vector, chunk) for vector, chunk in zip(vectors, batch)])
+        self.chunks_indexed += len(chunks)
+        return len(chunks)
+
+    def search(self, query, k=5, conversation_id=None):
+        return self.index.search(self.embed([query])[0], k=k, conversation_id=conversation_id)
+
+
+def pgvector_available(engine):
+    try:
+        with engine.connect() as conn:
+            return bool(conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'vector'")).scalar())
+    except Exception as e:
+        logger.warning(f"⚠️  Could not check for pgvector: {e}")
+        return False
+
+
+def vector_index_from_env(engine=None):
+    """pgvector when configured and installed, otherwise the in-process NumPy index"""
+    backend = os.getenv('VECTOR_BACKEND', 'pgvector')
+    if backend == 'pgvector' and engine is not None and pgvector_available(engine):
+        return PgVectorIndex(
+            engine,
+            ef_search=int(os.getenv('VECTOR_EF_SEARCH', 40)),
+            probes=int(os.getenv('VECTOR_PROBES', 10)),
+        )
+    logger.info("ℹ️  Using in-process NumPy vector index")
+    return NumpyVectorIndex()
+
+
+def embedding_pipeline_from_env(engine=None):
+    """Pipeline over vector_index_from_env() and the configured embedding provider"""
+    return EmbeddingPipeline(
+        vector_index_from_env(engine),
+        get_embedding_provider(),
+        batch_size=int(os.getenv('EMBEDDING_BATCH_SIZE', 64)),
+    )
@@ -0,0 +1,75 @@
+# bench_chat_concurrency.py
+"""
+Load test for the /chat endpoint in main.py.
+
+Fires requests at increasing concurrency levels (one session per request so
+per-session locking does not serialize them) and reports throughput and
+latency. If the handler blocked the event loop, throughput would stay flat
+as concurrency grows; with non-blocking LLM calls it should scale roughly
+linearly until the upstream (or CHAT_MAX_CONCURRENCY) saturates.
+
+To load-test without a real provider, run backend/llm_stub_server.py and
+start main.py with LLM_PROVIDER=stub; the stub's GET /stats shows what
+actually reached the upstream.
+
+/chat needs an access token: log in through the Flask app's /api/auth/login
+and export it as CHAT_BEARER_TOKEN.
+
+Usage: python bench_chat_concurrency.py [base_url] [requests_per_level]
+"""
+
+import os
+import json
+import statistics
+import sys
+import time
+import uuid
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+CONCURRENCY_LEVELS = [1, 2, 4, 8, 16, 32]
+
+
+def send_chat(base_url, message):
+    body = json.dumps({'message': message, 'session_id': f"bench-{uuid.uuid4()}"}).encode('utf-8')
+    req = urllib.request.Request(f"{base_url}/chat", data=body, headers={
+        'Content-Type': 'application/json',
+        'Authorization': f"Bearer {os.getenv('CHAT_BEARER_TOKEN', '')}",
+    })
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=120) as response:
+        response.read()
+    return (time.perf_counter() - start) * 1000
+
+
+def run_level(base_url, concurrency, total_requests):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(lambda i: send_chat(base_url, f"Say hello #{i}"), range(total_requests)))
+        elapsed = time.perf_counter() - start
+    ordered = sorted(latencies)
+    return {
+        'throughput': total_requests / elapsed,
+        'p50': statistics.median(ordered),
+        'p95': ordered[int(len(ordered) * 0.95) - 1],
+    }
+
+
+def main():
+    base_url = sys.argv[1] if len(sys.argv) > 1 else 'http://localhost:8000'
+    per_level = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+
+    print(f"🚀 Chat load test against {base_url} ({per_level} requests per level)")
+    print("=" * 64)
+    print(f"{'concurrency':>11} | {'req/s':>8} | {'p50 ms':>9} | {'p95 ms':>9} | {'speedup':>7}")
+    baseline = None
+    for concurrency in CONCURRENCY_LEVELS:
+        result = run_level(base_url, concurrency, max(per_level, concurrency))
+        baseline = baseline or result['throughput']
+        print(f"{concurrency:>11} | {result['throughput']:>8.2f} | {result['p50']:>9.1f} | "
+              f"{result['p95']:>9.1f} | {result['throughput'] / baseline:>6.1f}x")
+    print("=" * 64)
+
+
+if __name__ == "__main__":
+    main()
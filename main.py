@@ -1,51 +1,215 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from pydantic import BaseModel
-from langchain_groq import ChatGroq
 from langchain.chains import ConversationChain
-from langchain.memory import ConversationBufferMemory
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Optional
+import uuid
+import asyncio
 import os
+import sys
+import jwt
 from dotenv import load_dotenv
 
 load_dotenv()
+
+# Shared modules (session store, DB engine) live in backend/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from session_store import ChatSession, SessionLocks, session_key, session_store_from_env
+from conversations import ConversationAccessError
+from llm import get_chat_model, UsageMeter, sse_event
+from usage_logs import record_usage, usage_row, get_usage_writer
+from budget_guard import budget_guard_from_env, expected_cost, BudgetExceededError
+from summary_memory import SummaryBufferMemory, summary_manager_from_env
+from llm_limiter import LimiterRejected, limiter_stats
+
 app = FastAPI(title="Simple Chat API")
 
+# Tokens are issued by the Flask app's /api/auth/login (flask-jwt-extended, HS256, same key)
+JWT_SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key')
+
 # Request model
 class ChatRequest(BaseModel):
     message: str
     session_id: str = "default"
 
+def current_user_id(authorization: Optional[str] = Header(None)) -> str:
+    """User id from a verified access token; every call is logged and budgeted against it"""
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+    try:
+        claims = jwt.decode(token, JWT_SECRET_KEY, algorithms=['HS256'])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    identity = claims.get('sub')
+    user_id = identity.get('id') if isinstance(identity, dict) else identity
+    try:
+        if claims.get('type', 'access') != 'access':
+            raise ValueError(claims.get('type'))
+        return str(uuid.UUID(str(user_id)))
+    except ValueError:
+        raise HTTPException(status_code=401, detail="Token does not identify a user")
+
 # Initialize LangChain components
-llm = ChatGroq(
-    model="mistral-saba-24b",
-    temperature=0.7,
-)
-
-# Store conversation memory for different sessions
-memory_store = {}
-
-def get_conversation(session_id: str) -> ConversationChain:
-    if session_id not in memory_store:
-        memory = ConversationBufferMemory()
-        memory_store[session_id] = ConversationChain(
-            llm=llm,
-            memory=memory,
-            verbose=False
-        )
-    return memory_store[session_id]
+llm = get_chat_model()
+
+def build_session(session_id: str, messages: list) -> ChatSession:
+    memory = SummaryBufferMemory()
+    memory.chat_memory.messages.extend(messages)
+    chain = ConversationChain(
+        llm=llm,
+        memory=memory,
+        verbose=False
+    )
+    return ChatSession(session_id, memory, chain)
+
+# Database is optional here: used for usage logs and session spill when configured
+engine = None
+if os.getenv('DATABASE_URL'):
+    from db_engine import create_db_engine
+    engine = create_db_engine()
+
+# Budgets are always enforced; without a database they use the default limits in memory
+budget_guard = budget_guard_from_env(engine)
+
+def check_budget(request: ChatRequest, user_id: str):
+    try:
+        budget_guard.check(user_id, expected_cost(llm.model_name, request.message))
+    except BudgetExceededError as e:
+        raise HTTPException(status_code=429, detail=e.to_dict())
+
+def log_usage(row: dict):
+    if engine is not None:
+        record_usage(engine, row)
+    else:
+        # No ai_usage_logs to write to, but the spend still counts against the budgets
+        budget_guard.on_usage(row)
+
+# Bounded conversation memory (LRU + TTL, token and byte budgets)
+memory_store = session_store_from_env(build_session, engine=engine)
+
+# Serialize turns within a session; bound concurrent upstream LLM calls per worker
+session_locks = SessionLocks()
+llm_slots = asyncio.Semaphore(int(os.getenv('CHAT_MAX_CONCURRENCY', 64)))
+
+def record_summary_usage(session: ChatSession, usage: dict, message_range: tuple):
+    if session.user_id:
+        log_usage(usage_row(session.user_id, usage, {'summarize': list(message_range)}))
+
+# Older turns are folded into a rolling summary in the background to keep prompts flat;
+# summaries queue behind interactive turns in the upstream limiter
+summary_manager = summary_manager_from_env(get_chat_model(priority='batch'), session_locks,
+                                           spill=memory_store.spill, on_usage=record_summary_usage)
+
+def get_conversation(session_id: str, user_id: Optional[str] = None) -> ChatSession:
+    return memory_store.get(session_id, user_id=user_id)
 
 @app.post("/chat")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, user_id: str = Depends(current_user_id)):
+    check_budget(request, user_id)
+    meter, status, error = None, 'success', None
     try:
-        conversation = get_conversation(request.session_id)
-        response = conversation.predict(input=request.message)
+        async with session_locks.hold(session_key(request.session_id, user_id)):
+            # Store lookups may rehydrate/spill to Postgres, keep them off the event loop
+            session = await asyncio.to_thread(get_conversation, request.session_id, user_id)
+            prompt = session.chain.prompt.format(
+                input=request.message, **session.memory.load_memory_variables({})
+            )
+            summary_manager.record_turn(session, prompt)
+            meter = UsageMeter(llm.model_name, prompt)
+            async with llm_slots:
+                response = await session.chain.apredict(input=request.message)
+            meter.add(response)
+            await asyncio.to_thread(memory_store.commit, session)
+            summary_manager.maybe_schedule(session)
         return JSONResponse({
             "response": response,
-            "session_id": request.session_id
+            "session_id": request.session_id,
+            "usage": meter.summary()
         })
+    except asyncio.CancelledError:
+        status = 'cancelled'
+        raise
+    except ConversationAccessError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except LimiterRejected as e:
+        status, error = 'error', str(e)
+        # Upstream is saturated or its circuit is open: shed load instead of queueing forever
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
+        status, error = 'error', str(e)
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Same accounting as /chat/stream, so this spend reaches the budget guard and ai_usage_logs
+        if meter is not None:
+            row = usage_row(user_id, meter.summary(), {'message': request.message},
+                            {'response': meter.text}, status=status, error_message=error)
+            await asyncio.to_thread(log_usage, row)
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request, user_id: str = Depends(current_user_id)):
+    """Stream tokens as Server-Sent Events; the final `done` frame carries usage and cost"""
+    check_budget(request, user_id)
+
+    async def events():
+        status, error = 'success', None
+        async with session_locks.hold(session_key(request.session_id, user_id)):
+            try:
+                session = await asyncio.to_thread(get_conversation, request.session_id, user_id)
+            except ConversationAccessError as e:
+                yield sse_event({'type': 'error', 'message': str(e)}, event='error')
+                return
+            prompt = session.chain.prompt.format(
+                input=request.message, **session.memory.load_memory_variables({})
+            )
+            summary_manager.record_turn(session, prompt)
+            meter = UsageMeter(llm.model_name, prompt)
+            chunks = llm.astream(prompt)
+            try:
+                async with llm_slots:
+                    async for chunk in chunks:
+                        if await http_request.is_disconnected():
+                            status = 'cancelled'
+                            break
+                        content = meter.add(chunk)
+                        if content:
+                            yield sse_event({'type': 'token', 'content': content})
+
+                if status == 'success':
+                    session.memory.save_context({'input': request.message}, {'response': meter.text})
+                    await asyncio.to_thread(memory_store.commit, session)
+                    summary_manager.maybe_schedule(session)
+                    yield sse_event({
+                        'type': 'done',
+                        'session_id': request.session_id,
+                        'usage': meter.summary()
+                    }, event='done')
+            except asyncio.CancelledError:
+                status = 'cancelled'
+                raise
+            except Exception as e:
+                status, error = 'error', str(e)
+                yield sse_event({'type': 'error', 'message': error}, event='error')
+            finally:
+                # Closing the generator aborts the upstream completion
+                await chunks.aclose()
+                row = usage_row(user_id, meter.summary(), {'message': request.message},
+                                {'response': meter.text}, status=status, error_message=error)
+                await asyncio.to_thread(log_usage, row)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.on_event("shutdown")
+def flush_usage_logs():
+    # Don't lose buffered ai_usage_logs rows on deploys/restarts
+    if engine is not None:
+        get_usage_writer(engine).close()
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy", "sessions": memory_store.stats(), "memory": summary_manager.stats(),
+            "upstream": limiter_stats()}
\ No newline at end of file